@@ -0,0 +1,328 @@
+"""Suggested in and out points for the scheduled talks in a recording"""
+
+import array
+import datetime
+import json
+import logging
+import math
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import zoneinfo
+
+try:
+    import numpy
+except ImportError:  # Only needed to work out the loudness faster
+    numpy = None
+
+from . import cores, formvideo, probe
+
+logger = logging.getLogger(__name__)
+
+SILENCE_DB = -35
+SILENCE_MIN_S = 2
+SCENE_THRESHOLD = 10
+SCENE_FPS = 5  # Scene changes are looked for in this many frames a second
+# The audio is resampled to this for the loudness envelope
+ENVELOPE_RATE = 1000
+ENVELOPE_WINDOW_S = 0.5
+READ_WINDOWS = 120  # How many windows of audio to read at once
+SPEECH_DB = -40  # Windows louder than this are taken to be someone talking
+SPEECH_CHECK_S = 30  # How long after an in point to listen for them
+# How far before and after a scheduled time to look for a boundary
+SEARCH_BEFORE_S = 600
+SEARCH_AFTER_S = 900
+TIMEZONE = "Europe/London"  # Of the schedule, and recording file names
+
+# e.g. "2024-05-31 17-20-00" from OBS, or "20240531-172000"
+FILENAME_TIME = re.compile(
+    r"(\d{4})-?(\d{2})-?(\d{2})[ _T-]?(\d{2})[-:.]?(\d{2})[-:.]?(\d{2})"
+)
+SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+SCENE = re.compile(r"lavfi\.scd\.time: ([\d.]+)")
+
+
+def recording_start(path, probed, timezone=TIMEZONE):
+    """When ``path`` started recording, in the schedule's local time, from its
+    file name or else its ``creation_time`` tag. ``None`` if neither says."""
+    match = FILENAME_TIME.search(Path(path).stem)
+    if match:
+        try:
+            return datetime.datetime(*(int(part) for part in match.groups()))
+        except ValueError:
+            pass
+
+    creation_time = probed.get("format", {}).get("tags", {}).get("creation_time")
+    if creation_time:
+        try:
+            created = datetime.datetime.fromisoformat(creation_time)
+        except ValueError:
+            return None
+        if created.tzinfo is not None:
+            created = created.astimezone(zoneinfo.ZoneInfo(timezone))
+        return created.replace(tzinfo=None)
+    return None
+
+
+def venue_from_name(path, venues):
+    """The venue whose name is in ``path``'s file name, ignoring case and
+    punctuation, or ``None``."""
+
+    def simplify(name):
+        return re.sub(r"[^a-z0-9]", "", name.lower())
+
+    stem = simplify(Path(path).stem)
+    # Longest first, so "Stage A" can't match "Stage AB"
+    for venue in sorted(venues, key=len, reverse=True):
+        if simplify(venue) and simplify(venue) in stem:
+            return venue
+    return None
+
+
+def detect(path, ffmpeg_bin=formvideo.FFMPEG_BIN, progress=None):
+    """Find the silences and scene changes in ``path``, and its loudness in
+    dBFS every ``ENVELOPE_WINDOW_S``, from one FFmpeg run.
+
+    The audio is read from FFmpeg as it's decoded, so the whole recording
+    never has to be in memory. ``progress`` is called with how many seconds
+    have been read.
+    """
+    ffmpeg_args = [
+        ffmpeg_bin,
+        "-nostats",
+        "-i", str(path),
+        "-map", "0:v",
+        "-vf", f"fps={SCENE_FPS},scale=320:-2,scdet=threshold={SCENE_THRESHOLD}",
+        "-f", "null", "-",
+        "-map", "0:a",
+        "-af", f"silencedetect=noise={SILENCE_DB}dB:duration={SILENCE_MIN_S}",
+        "-ac", "1",
+        "-ar", str(ENVELOPE_RATE),
+        "-f", "s16le", "pipe:1",
+    ]  # fmt: skip
+    silences = []
+    scenes = []
+    with (
+        cores.reserving(),
+        subprocess.Popen(
+            cores.ffmpeg_args(ffmpeg_args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **cores.popen_kwargs(),
+        ) as proc,
+    ):
+        reader = threading.Thread(
+            target=_read_events, args=[proc.stderr, silences, scenes], daemon=True
+        )
+        reader.start()
+        envelope = _envelope(proc.stdout, progress)
+        reader.join()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(returncode=proc.returncode, cmd=ffmpeg_args)
+    return {"silences": silences, "scenes": scenes, "envelope": envelope}
+
+
+def _read_events(stderr, silences, scenes):
+    silence_start = None
+    for ln in stderr:
+        ln = ln.decode("utf-8", "replace")
+        if match := SILENCE_START.search(ln):
+            silence_start = max(0, float(match[1]))
+        elif (match := SILENCE_END.search(ln)) and silence_start is not None:
+            silences.append([silence_start, float(match[1])])
+            silence_start = None
+        elif match := SCENE.search(ln):
+            scenes.append(float(match[1]))
+
+
+def _envelope(stream, progress=None):
+    window = round(ENVELOPE_RATE * ENVELOPE_WINDOW_S)
+    envelope = []
+    read_s = 0
+    while True:
+        data = stream.read(window * READ_WINDOWS * 2)
+        if not data:
+            return envelope
+        if numpy is not None:
+            samples = numpy.frombuffer(data[: len(data) // 2 * 2], dtype="<i2")
+            whole = len(samples) // window * window
+            squares = samples.astype(numpy.float64) ** 2
+            mean_squares = list(squares[:whole].reshape(-1, window).mean(axis=1))
+            if whole < len(samples):
+                mean_squares.append(squares[whole:].mean())
+        else:
+            samples = array.array("h")
+            samples.frombytes(data[: len(data) // 2 * 2])
+            if sys.byteorder == "big":
+                samples.byteswap()
+            mean_squares = [
+                sum(x * x for x in samples[i : i + window])
+                / len(samples[i : i + window])
+                for i in range(0, len(samples), window)
+            ]
+        envelope += [_dbfs(mean_square) for mean_square in mean_squares]
+        read_s += len(data) / 2 / ENVELOPE_RATE
+        if progress:
+            progress(read_s)
+
+
+def _dbfs(mean_square):
+    if mean_square <= 0:
+        return -100.0
+    return max(-100.0, 10 * math.log10(mean_square / 32768**2))
+
+
+def _speech_after(envelope, time_s):
+    """Whether most of the ``SPEECH_CHECK_S`` after ``time_s`` is loud."""
+    first = int(time_s / ENVELOPE_WINDOW_S)
+    windows = envelope[first : first + int(SPEECH_CHECK_S / ENVELOPE_WINDOW_S)]
+    if not windows:
+        return False
+    return sum(level > SPEECH_DB for level in windows) >= len(windows) / 2
+
+
+def _pick(target_s, silence_points, scenes, accept=None):
+    """The boundary nearest ``target_s``: preferably the edge of a silence
+    that ``accept`` (if given) likes, then any silence, then a scene change,
+    and ``target_s`` itself if there are none. Returns ``(time, source)``."""
+    low, high = target_s - SEARCH_BEFORE_S, target_s + SEARCH_AFTER_S
+
+    def nearest(points):
+        points = [point for point in points if low <= point <= high]
+        return min(points, key=lambda point: abs(point - target_s), default=None)
+
+    candidates = [("silence", silence_points)]
+    if accept:
+        accepted = [point for point in silence_points if accept(point)]
+        candidates.insert(0, ("silence", accepted))
+    candidates.append(("scene", scenes))
+    for source, points in candidates:
+        point = nearest(points)
+        if point is not None:
+            return point, source
+    return target_s, "schedule"
+
+
+def suggest(talks, detected, start, duration_s, framerate=formvideo.FRAMERATE):
+    """In and out timecodes for each of ``talks`` (schedule entries) that's
+    on during a recording which started at ``start`` and lasts
+    ``duration_s``."""
+    envelope = detected["envelope"]
+    silence_ends = [end for _, end in detected["silences"]]
+    silence_starts = [start_s for start_s, _ in detected["silences"]]
+
+    suggestions = []
+    for talk in talks:
+        scheduled_in = (
+            datetime.datetime.fromisoformat(talk["start_date"]) - start
+        ).total_seconds()
+        scheduled_out = (
+            datetime.datetime.fromisoformat(talk["end_date"]) - start
+        ).total_seconds()
+        if scheduled_out <= 0 or scheduled_in >= duration_s:
+            continue
+
+        # Talks start as a silence ends and someone starts speaking, and end
+        # as the applause dies down into a silence
+        in_s, in_source = _pick(
+            scheduled_in,
+            silence_ends,
+            detected["scenes"],
+            accept=lambda point: _speech_after(envelope, point),
+        )
+        out_s, out_source = _pick(scheduled_out, silence_starts, detected["scenes"])
+        in_s = min(max(in_s, 0), duration_s)
+        out_s = min(max(out_s, 0), duration_s)
+        if out_s <= in_s:
+            in_s, in_source = max(scheduled_in, 0), "schedule"
+            out_s, out_source = min(scheduled_out, duration_s), "schedule"
+
+        suggestions.append(
+            {
+                "talk_id": talk["id"],
+                "title": talk["title"],
+                "start_tc": formvideo.seconds_to_timecode(in_s, framerate),
+                "end_tc": formvideo.seconds_to_timecode(out_s, framerate),
+                "start_from": in_source,
+                "end_from": out_source,
+            }
+        )
+    return suggestions
+
+
+def analyse_video(
+    task,
+    video,
+    talk_schedule,
+    analysis_dir,
+    venue=None,
+    timezone=TIMEZONE,
+    framerate=formvideo.FRAMERATE,
+    probe_cache=None,
+):
+    """Suggest in and out points for the talks scheduled in ``video``'s venue
+    while it was recording, and save them to ``analysis_dir``.
+
+    Raises ``ValueError`` if the venue or start of the recording can't be
+    worked out.
+    """
+    video = Path(video)
+    probed = probe.probe(video, probe_cache, formvideo.FFPROBE_BIN)
+    duration_s = probe.duration_seconds(probed)
+    start = recording_start(video, probed, timezone)
+    if start is None:
+        raise ValueError(f"can't tell when {video.name} started recording")
+    venue = venue or venue_from_name(video, talk_schedule.venues())
+    if venue is None:
+        raise ValueError(f"can't tell which venue {video.name} is of")
+    logger.info("Analysing %s, recorded in %s from %s", video, venue, start)
+
+    started_at = time.monotonic()
+    with formvideo.ProgressReporter(task, "Analysing", duration_s) as progress:
+
+        def report(read_s):
+            elapsed_s = time.monotonic() - started_at
+            progress.update(
+                {
+                    "out_time_s": read_s,
+                    "fps": None,
+                    "speed": read_s / elapsed_s if elapsed_s else None,
+                    "bitrate_kbps": None,
+                }
+            )
+
+        detected = detect(video, progress=report)
+
+    analysis = {
+        "video": str(video),
+        "venue": venue,
+        "start": start.isoformat(),
+        "duration": duration_s,
+        "silences": detected["silences"],
+        "scenes": detected["scenes"],
+        "suggestions": suggest(
+            talk_schedule.in_venue(venue), detected, start, duration_s, framerate
+        ),
+    }
+    analysis_path = Path(analysis_dir) / f"{video.stem}.json"
+    analysis_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = analysis_path.with_name(f"{analysis_path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(analysis, f)
+    os.replace(tmp_path, analysis_path)
+    return str(analysis_path)
+
+
+def load(analysis_dir, video_name):
+    """The saved analysis of the video called ``video_name``, or ``None``."""
+    try:
+        with open(Path(analysis_dir) / f"{video_name}.json") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
@@ -1,165 +1,381 @@
 import datetime
 import json
-import os
 import pathlib
+import subprocess
 import urllib.parse
 
+import celery.states
 import flask
-import requests
 
-from . import tasks
+from . import (
+    analysis,
+    events,
+    formvideo,
+    grist,
+    library,
+    results,
+    scrub,
+    tasks,
+    workerstate,
+)
 
 app = tasks.flask_app
 app_cel = tasks.celery_app
+workers = workerstate.WorkerSnapshot(
+    app_cel, interval=app.config["WORKER_SNAPSHOT_SECONDS"]
+)
+event_hub = events.EventHub(app_cel)
+media_library = library.MediaLibrary(
+    app.config["VIDEO_SOURCES"],
+    interval=app.config["LIBRARY_SCAN_SECONDS"],
+    probe_cache=str(app.config["PROBE_CACHE"]),
+)
+talk_schedule = tasks.talk_schedule
+
+# Seconds between comments sent down an idle event stream to keep it open
+EVENTS_KEEPALIVE = 15
+# Seconds to wait for more Grist updates to send along with each one
+GRIST_BATCH_DELAY = 2
 
 app.config["api_route"] = "/api/v1"
 
 
-def get_files(target, ext_filter=[]):
-    try:
-        for file in sorted(os.listdir(target)):
-            path = os.path.join(target, file)
-            if os.path.isfile(path):
-                if os.path.splitext(file)[1] in ext_filter or ext_filter == []:
-                    yield (os.path.splitext(file)[0])
-    except FileNotFoundError:
-        return None
-
-
 @app.route("/")
 def index():
-    files = []
-    for source in app.config["VIDEO_SOURCES"]:
-        vid_dir = {
-            "files": get_files(source["DISKDIR"], ext_filter=source["EXT"]),
-            "dir": source["WEBDIR"],
-            "name": source["NAME"],
-        }
-        files.append(vid_dir)
+    sources = app.config["VIDEO_SOURCES"]
 
-    running_tasks = app_cel.control.inspect().active()
-    if running_tasks:
-        for name, host in running_tasks.items():
-            for task in host:
-                task["time_start"] = datetime.datetime.fromtimestamp(
+    running_tasks = {
+        name: [
+            {
+                **task,
+                "time_start": datetime.datetime.fromtimestamp(
                     task["time_start"]
-                ).strftime("%Y-%m-%d %H:%M:%S")
-    else:
-        running_tasks = {"": []}
+                ).strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            for task in host
+        ]
+        for name, host in workers.active().items()
+    } or {"": []}
     return flask.render_template("index.html", **locals())
 
 
+@app.route(app.config["api_route"] + "/library/<vid_dir>", methods=["GET"])
+def api_library(vid_dir):
+    """A page of the files in a source folder, for a server-side DataTable."""
+    if vid_dir not in media_library.sources:
+        return flask.jsonify({"success": False}), 404
+
+    args = flask.request.args
+    start = args.get("start", 0, type=int)
+    length = args.get("length", 100, type=int)
+    sort_column = args.get("order[0][column]", 0, type=int)
+    total, entries = media_library.files(
+        vid_dir,
+        search=args.get("search[value]", ""),
+        sort=args.get(f"columns[{sort_column}][data]", "name"),
+        descending=args.get("order[0][dir]") == "desc",
+    )
+    return flask.jsonify(
+        {
+            "draw": args.get("draw", 0, type=int),
+            "recordsTotal": total,
+            "recordsFiltered": len(entries),
+            "data": entries[start:] if length < 0 else entries[start : start + length],
+        }
+    )
+
+
+def _proxy_dir(video):
+    """The web folder of a video's proxy, if ingest made one. The log page
+    plays that, but builds still use the full quality source."""
+    proxy = app.config["VIDEO_PROXY"]
+    if (pathlib.Path(proxy["DISKDIR"]) / f"{video}.mp4").is_file():
+        return proxy["WEBDIR"]
+    return None
+
+
+def _scrub_url(video):
+    """Where the log page finds a video's timeline, if ingest made one."""
+    scrub_config = app.config["VIDEO_SCRUB"]
+    if (pathlib.Path(scrub_config["DISKDIR"]) / video / scrub.INDEX_FILE).is_file():
+        return f"/static/video/{scrub_config['WEBDIR']}/{video}"
+    return None
+
+
 @app.route("/log/<vid_dir>/<video>")
 def log(vid_dir, video):
+    proxy_dir = None
+    scrub_url = _scrub_url(video)
     for source in app.config["VIDEO_SOURCES"]:
         if source["WEBDIR"] == vid_dir:
             if ".mp4" in source["EXT"]:
                 vid_type = "mp4"
                 vid_ext = "mp4"
+                proxy_dir = _proxy_dir(video)
             if ".mpd" in source["EXT"]:
                 vid_type = "dash"
                 vid_ext = "mpd"
-
-    # with urllib.request.urlopen("https://www.emfcamp.org/schedule/2024.json") as url:
-    # with urllib.request.urlopen("https://www.emfcamp.org/schedule/2022.json") as url:
-    with open(pathlib.Path(__file__).parent / "talks.json") as url:
-        data = json.load(url)
-        talks = {}
-        for talk in data:
-            if talk["type"] == "talk":
-                talks[talk["id"]] = {
-                    "title": talk["title"],
-                    "presenter": talk["speaker"],
-                }
-        talks_sorted = dict(sorted(talks.items(), key=lambda k_v: k_v[1]["title"]))
-    talks_json = json.dumps(talks_sorted)
+            if ".m3u8" in source["EXT"]:
+                vid_type = "hls"
+                vid_ext = "m3u8"
+            build_video = f"{vid_dir}/{video}.{vid_ext}"
+            if "BUILD_FROM" in source:
+                build_video = f"{source['BUILD_FROM']}/{video}.mp4"
+
+    talks = talks_sorted = talk_schedule.talks()
+    talks_json = talk_schedule.talks_json()
+    profiles = app.config["ENCODE_PROFILES"]
+    build_profile = app.config["BUILD_PROFILE"]
+    found = analysis.load(app.config["VIDEO_ANALYSIS"], video)
+    suggestions_json = json.dumps(
+        {
+            suggestion["talk_id"]: suggestion
+            for suggestion in (found["suggestions"] if found else [])
+        }
+    )
     return flask.render_template("log.html", **locals())
 
 
 def _update_grist(talk_id, grist_data):
+    """Queue an update to a talk's Grist record, to be sent in the background."""
     if "GRIST_TABLE_URL" not in app.config or "GRIST_KEY" not in app.config:
         return
-    sess = requests.session()
-    sess.headers.update(
-        {
-            "Authorization": f'Bearer {app.config["GRIST_KEY"]}',
-        }
-    )
-
-    # Find the right ID
-    resp = sess.get(app.config["GRIST_TABLE_URL"])
-    resp.raise_for_status()
-    for record in resp.json()["records"]:
-        if str(record["fields"]["id2"]) == str(talk_id):
-            talk_record = record
-            break
+    if grist.add_pending(app_cel, talk_id, grist_data):
+        tasks.sync_grist.apply_async(countdown=GRIST_BATCH_DELAY)
     else:
-        return  # couldn't find it :(
-
-    # Patch
-    resp = sess.patch(
-        app.config["GRIST_TABLE_URL"],
-        headers={"Content-Type": "application/json"},
-        json={
-            "records": [
-                {
-                    "id": talk_record["id"],
-                    "fields": grist_data,
-                }
-            ],
-        },
-    )
-    resp.raise_for_status()
+        tasks.sync_grist.delay({str(talk_id): grist_data})
 
 
-@app.route(app.config["api_route"] + "/build", methods=["POST"])
-def api_build():
-    with open(pathlib.Path(__file__).parent / "talks.json") as url:
-        data = json.load(url)
+def _build_profile(fields):
+    """The encoder settings a build request asks for, by ``profile`` name."""
+    name = fields.get("profile") or app.config["BUILD_PROFILE"]
+    try:
+        return app.config["ENCODE_PROFILES"][name]
+    except KeyError:
+        raise ValueError(f"unknown encode profile {name}") from None
+
 
+def _check_build(fields, scheduled_only=False, require_source=False):
+    """Check a build request and work out its ``build_video`` arguments and
+    Grist update. Raises ``ValueError`` if it can't be built, or with
+    ``require_source``, if its video doesn't exist yet."""
+    _build_profile(fields)
     description = None
-    for talk in data:
-        if talk["id"] == int(flask.request.form["talkid"]):
-            filename = "{}_{}".format(flask.request.form["talkid"], talk["slug"])
-            description = talk["description"]
-            break
+    talk = talk_schedule.talk(fields["talkid"])
+    if talk:
+        filename = "{}_{}".format(fields["talkid"], talk["slug"])
+        description = talk["description"]
+    elif scheduled_only:
+        raise ValueError(f"talk {fields['talkid']} isn't in the schedule")
     else:
-        filename = "{}".format(flask.request.form["talkid"])
+        filename = "{}".format(fields["talkid"])
 
     talk_data = {
-        "title": flask.request.form["title"],
-        "presenter": flask.request.form["presenter"],
+        "title": fields["title"],
+        "presenter": fields["presenter"],
         "filename": filename,
     }
 
     if description:
         talk_data["description"] = description
 
-    vid_dir = str(pathlib.Path(flask.request.form["video"]).parts[0])
+    video_parts = pathlib.Path(fields["video"]).parts
+    if len(video_parts) != 2:
+        raise ValueError(f"video {fields['video']} isn't <folder>/<file>")
+    vid_dir, vid = video_parts
     for source in app.config["VIDEO_SOURCES"]:
         if source["WEBDIR"] == vid_dir:
             vid_dir_path = pathlib.Path(source["DISKDIR"])
             break
     else:
         raise ValueError(f"unknown video dir {vid_dir}")
-    vid = pathlib.Path(flask.request.form["video"]).parts[1]
+    if require_source and not (vid_dir_path / vid).is_file():
+        raise ValueError(f"video {fields['video']} doesn't exist")
+
+    # Catch bad timecodes, and those past the end of the video, before
+    # queueing anything
+    try:
+        formvideo.check_timecodes(
+            vid_dir_path / vid,
+            fields["start_tc"],
+            fields["end_tc"],
+            probe_cache=str(app.config["PROBE_CACHE"]),
+        )
+    except (subprocess.CalledProcessError, OSError):
+        app.logger.warning("Couldn't probe %s, leaving it to the build", vid)
+
     grist_data = {
-        "in_time": flask.request.form["start_tc"],
-        "out_time": flask.request.form["end_tc"],
+        "in_time": fields["start_tc"],
+        "out_time": fields["end_tc"],
         "Source_file": vid,
     }
-    if flask.request.form["talkid"]:
-        _update_grist(flask.request.form["talkid"], grist_data)
-    result = tasks.build_video.delay(
+    args = (
         str(vid_dir_path / vid),
         talk_data,
-        flask.request.form["start_tc"],
-        flask.request.form["end_tc"],
+        fields["start_tc"],
+        fields["end_tc"],
+    )
+    return args, grist_data
+
+
+def _queue_build(fields, args, grist_data):
+    """Queue a checked build, or find the same build already done or running.
+    Returns the response to send about it."""
+    if fields["talkid"]:
+        _update_grist(fields["talkid"], grist_data)
+    task_id, output = tasks.submit_build(
+        *args,
         out_dir=str(app.config["VIDEO_OUTPUT"]),
         temp_dir=str(app.config["VIDEO_TEMP"]),
         log_dir=str(app.config["LOG_DIR"]),
+        smart_render=app.config["SMART_RENDER"],
+        asset_cache_bytes=app.config["ASSET_CACHE_MAX_BYTES"],
+        parallel_chunk_s=app.config["BUILD_CHUNK_SECONDS"],
+        checkpoint_s=app.config["CHECKPOINT_SECONDS"],
+        probe_cache=str(app.config["PROBE_CACHE"]),
+        profile=_build_profile(fields),
+    )
+    if output:
+        return {"result_id": task_id, "output": output}
+    return {"result_id": task_id}
+
+
+def _queue_preview(args):
+    """Queue a preview of a checked build, ahead of everything else."""
+    preview_config = app.config["VIDEO_PREVIEW"]
+    result = tasks.build_video.apply_async(
+        args,
+        {
+            "out_dir": str(preview_config["DISKDIR"]),
+            "temp_dir": str(app.config["VIDEO_TEMP"]),
+            "log_dir": str(app.config["LOG_DIR"]),
+            "asset_cache_bytes": app.config["ASSET_CACHE_MAX_BYTES"],
+            "probe_cache": str(app.config["PROBE_CACHE"]),
+            "profile": app.config["ENCODE_PROFILES"][app.config["PREVIEW_PROFILE"]],
+            "preview_s": app.config["PREVIEW_SECONDS"],
+            "preview_height": preview_config["HEIGHT"],
+        },
+        priority=0,
     )
+    return {"result_id": result.id, "preview": True}
 
+
+@app.route(app.config["api_route"] + "/build", methods=["POST"])
+def api_build():
+    """Queue a build, or with ``preview`` set, a quick low quality render of
+    just its intro and outro."""
+    try:
+        args, grist_data = _check_build(flask.request.form)
+    except ValueError as exc:
+        return flask.jsonify({"success": False, "error": str(exc)}), 400
+    if flask.request.form.get("preview"):
+        return _queue_preview(args)
+    return _queue_build(flask.request.form, args, grist_data)
+
+
+@app.route(app.config["api_route"] + "/preview/<task_id>", methods=["GET"])
+def api_preview(task_id):
+    """How a preview is getting on, and where to watch it once it's done."""
+    state, info = results.task_states(app_cel, [task_id])[task_id]
+    result = {"state": state, "progress": results.progress_percent(info)}
+    if state == celery.states.SUCCESS:
+        result["url"] = "/static/video/{}/{}".format(
+            app.config["VIDEO_PREVIEW"]["WEBDIR"], pathlib.Path(info).name
+        )
+    elif state in celery.states.PROPAGATE_STATES:
+        result["error"] = str(info)
+    return flask.jsonify(result)
+
+
+BUILD_FIELDS = ("talkid", "title", "presenter", "video", "start_tc", "end_tc")
+
+
+@app.route(app.config["api_route"] + "/builds", methods=["POST"])
+def api_builds():
+    """Queue a JSON list of builds, each with the fields of ``/build``.
+
+    Every build is checked first, and if any can't be built, none are queued
+    and the response lists what's wrong with each by its place in the list.
+    """
+    builds = flask.request.get_json(silent=True)
+    if not isinstance(builds, list) or not builds:
+        return flask.jsonify({"success": False, "error": "expected a list"}), 400
+
+    checked = []
+    errors = []
+    talk_ids = set()
+    for index, fields in enumerate(builds):
+        try:
+            if not isinstance(fields, dict):
+                raise ValueError("expected an object")
+            missing = [field for field in BUILD_FIELDS if not fields.get(field)]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+            fields = {
+                field: str(fields[field])
+                for field in (*BUILD_FIELDS, "profile")
+                if field in fields
+            }
+            if fields["talkid"] in talk_ids:
+                raise ValueError(f"talk {fields['talkid']} is in the list twice")
+            talk_ids.add(fields["talkid"])
+            args, grist_data = _check_build(
+                fields, scheduled_only=True, require_source=True
+            )
+            checked.append((fields, args, grist_data))
+        except ValueError as exc:
+            errors.append({"index": index, "error": str(exc)})
+    if errors:
+        return flask.jsonify({"success": False, "errors": errors}), 400
+
+    result_ids = [_queue_build(*build)["result_id"] for build in checked]
+    return flask.jsonify({"success": True, "result_ids": result_ids})
+
+
+@app.route(app.config["api_route"] + "/schedule", methods=["POST"])
+def api_schedule_refresh():
+    """Download the latest schedule from ``SCHEDULE_URL``."""
+    talk_count = talk_schedule.refresh()
+    return flask.jsonify({"success": True, "talks": talk_count})
+
+
+def _video_path(vid_dir, video):
+    """The full quality file of ``video`` in the source with web folder
+    ``vid_dir``, or ``None``."""
+    for source in app.config["VIDEO_SOURCES"]:
+        if source["WEBDIR"] == vid_dir:
+            break
+    else:
+        return None
+    if "BUILD_FROM" in source:
+        return _video_path(source["BUILD_FROM"], video)
+    for ext in source["EXT"]:
+        path = pathlib.Path(source["DISKDIR"]) / f"{video}{ext}"
+        if path.is_file():
+            return path
+    return None
+
+
+@app.route(app.config["api_route"] + "/analysis/<vid_dir>/<video>", methods=["GET"])
+def api_analysis(vid_dir, video):
+    """Suggested in and out points for the talks in a video, along with the
+    silences and scene changes they were picked from."""
+    found = analysis.load(app.config["VIDEO_ANALYSIS"], video)
+    if found is None:
+        return flask.jsonify({"success": False, "error": "not analysed yet"}), 404
+    return flask.jsonify({"success": True, **found})
+
+
+@app.route(app.config["api_route"] + "/analysis/<vid_dir>/<video>", methods=["POST"])
+def api_analyse(vid_dir, video):
+    """Analyse a video, in the venue given in the form if its file name
+    doesn't say."""
+    path = _video_path(vid_dir, video)
+    if path is None:
+        return flask.jsonify({"success": False, "error": "no such video"}), 404
+    result = tasks.analyse_video.delay(
+        str(path), venue=flask.request.form.get("venue") or None
+    )
     return {"result_id": result.id}
 
 
@@ -173,55 +389,83 @@ def view_tasks():
     return flask.render_template("tasks.html", **locals())
 
 
+BUILD_TASKS = (
+    tasks.build_video.name,
+    tasks.build_video_segment.name,
+    tasks.merge_video.name,
+)
+
+
+def _build_task_info(task):
+    if task["type"] == tasks.build_video.name:
+        source, talk, in_tc, out_tc = task["args"][:4]
+    else:
+        # Segments and merges of a parallel build carry the build plan instead
+        build = (
+            task["args"][-1]
+            if task["type"] == tasks.merge_video.name
+            else task["args"][0]
+        )
+        source, talk = build["source"], build
+        in_tc, out_tc = build["start_tc"], build["end_tc"]
+    return {
+        "source": source,
+        "title": talk["title"],
+        "presenter": talk["presenter"],
+        "in_tc": in_tc,
+        "out_tc": out_tc,
+    }
+
+
 @app.route(app.config["api_route"] + "/tasks", methods=["GET"])
 def api_tasks():
-    running_tasks = app_cel.control.inspect().active()
-    scheduled_tasks = app_cel.control.inspect().reserved()
+    running_tasks = workers.active()
+    scheduled_tasks = workers.reserved()
     result = {"data": []}
+    states = results.task_states(
+        app_cel,
+        (
+            task["id"]
+            for host_tasks in (running_tasks, scheduled_tasks)
+            for host in host_tasks.values()
+            for task in host
+            if task["type"] in BUILD_TASKS
+        ),
+    )
     if running_tasks:
         for name, host in running_tasks.items():
             for task in host:
-                if task["type"] == tasks.build_video.name:
-                    state = app_cel.AsyncResult(task["id"])
-                    state.ready()
-                    progress = 0
-                    if state.info and "current" in state.info and "total" in state.info:
-                        progress = (state.info["current"] * 100) / state.info["total"]
+                if task["type"] in BUILD_TASKS:
+                    state, info = states[task["id"]]
+                    progress = results.progress_percent(info)
                     result["data"].append(
                         {
                             "time_start": datetime.datetime.fromtimestamp(
                                 task["time_start"]
                             ).strftime("%Y-%m-%d %H:%M:%S"),
                             "id": task["id"],
-                            "source": task["args"][0],
-                            "title": task["args"][1]["title"],
-                            "presenter": task["args"][1]["presenter"],
-                            "in_tc": task["args"][2],
-                            "out_tc": task["args"][3],
+                            **_build_task_info(task),
                             "node": task["hostname"],
-                            "state": state.state,
+                            "state": state,
                             "progress": f"{progress:.1f}%",
+                            "eta": results.eta_text(info),
                         }
                     )
 
     if scheduled_tasks:
         for name, host in scheduled_tasks.items():
             for task in host:
-                if task["type"] == tasks.build_video.name:
-                    state = app_cel.AsyncResult(task["id"])
-                    state.ready()
+                if task["type"] in BUILD_TASKS:
+                    state, _ = states[task["id"]]
                     result["data"].append(
                         {
                             "time_start": None,
                             "id": task["id"],
-                            "source": task["args"][0],
-                            "title": task["args"][1]["title"],
-                            "presenter": task["args"][1]["presenter"],
-                            "in_tc": task["args"][2],
-                            "out_tc": task["args"][3],
+                            **_build_task_info(task),
                             "node": task["hostname"],
-                            "state": state.state,
+                            "state": state,
                             "progress": "0%",
+                            "eta": "",
                         }
                     )
     return flask.jsonify(result)
@@ -229,7 +473,7 @@ def api_tasks():
 
 @app.route(app.config["api_route"] + "/watch", methods=["GET"])
 def api_watch():
-    running_tasks = app_cel.control.inspect().active()
+    running_tasks = workers.active()
     result = {"data": []}
 
     for folder in app.config["WATCHFOLDERS"]:
@@ -272,12 +516,13 @@ def api_watch_stop(folder: str):
 
     fullpath = folder_config["FULLPATH"]
 
-    for node, running_tasks in app_cel.control.inspect().active().items():
+    for node, running_tasks in workers.active().items():
         for task in running_tasks:
             if (task["args"][0] == str(fullpath) or folder is None) and task[
                 "type"
             ] == tasks.watch_folder.name:
                 app_cel.control.revoke(task["id"], terminate=True)
+    workers.refresh_soon()
     return flask.jsonify({"success": True})
 
 
@@ -286,8 +531,11 @@ def api_watch_start(folder):
     for folder_config in app.config["WATCHFOLDERS"]:
         if folder_config["NAME"] == folder:
             task = tasks.watch_folder.delay(
-                str(folder_config["FULLPATH"]), str(folder_config["OUTPUT_DIR"])
+                str(folder_config["FULLPATH"]),
+                str(folder_config["OUTPUT_DIR"]),
+                poll=folder_config.get("POLL", False),
             )
+            workers.refresh_soon()
             result = {"data": {"id": task.id}, "success": True}
             break
     else:
@@ -295,42 +543,143 @@ def api_watch_start(folder):
     return flask.jsonify(result)
 
 
+INGEST_TASKS = (
+    tasks.ingest_video.name,
+    tasks.ingest_video_segment.name,
+    tasks.merge_ingest.name,
+    tasks.analyse_video.name,
+)
+
+
+def _ingest_plan(task):
+    """The plan of the parallel ingest a segment or merge task is part of."""
+    if task["type"] == tasks.ingest_video_segment.name:
+        return task["args"][0]
+    if task["type"] == tasks.merge_ingest.name:
+        return task["args"][-1]
+    return None
+
+
+def _ingest_segments(plan, states):
+    """``{segment ID: [seconds done, duration]}`` of a parallel ingest, for
+    the page to keep up to date from each segment's progress events."""
+    segments = {}
+    for segment, segment_id in zip(plan["segments"], plan["segment_ids"]):
+        state, info = states[segment_id]
+        done_s = 0
+        if state == celery.states.SUCCESS:
+            done_s = segment["duration_s"]
+        elif isinstance(info, dict) and "current" in info:
+            done_s = info["current"]
+        segments[segment_id] = [done_s, segment["duration_s"]]
+    return segments
+
+
+def _ingest_progress(segments):
+    done_s = sum(done_s for done_s, _ in segments.values())
+    total_s = sum(duration_s for _, duration_s in segments.values())
+    return (done_s * 100) / total_s if total_s else 0
+
+
 @app.route(app.config["api_route"] + "/ingest", methods=["GET"])
 def api_ingest():
-    running_tasks = app_cel.control.inspect().active()
+    running_tasks = workers.active()
     result = {"data": []}
+    parallel_ingests = {}
+
+    # Look up every task and parallel segment the table needs in one go
+    task_ids = []
+    for host in running_tasks.values():
+        for task in host:
+            if task["type"] not in INGEST_TASKS:
+                continue
+            plan = _ingest_plan(task)
+            task_ids.extend(plan["segment_ids"] if plan else [task["id"]])
+    states = results.task_states(app_cel, task_ids)
 
     if running_tasks:
         for name, host in running_tasks.items():
             for task in host:
-                if task["type"] == tasks.ingest_video.name:
-                    state = app_cel.AsyncResult(task["id"])
-                    state.ready()
-                    progress = 0
-                    if state.info and "current" in state.info and "total" in state.info:
-                        progress = (state.info["current"] * 100) / state.info["total"]
-                    result["data"].append(
-                        {
-                            "time_start": datetime.datetime.fromtimestamp(
-                                task["time_start"]
-                            ).strftime("%Y-%m-%d %H:%M:%S"),
-                            "id": task["id"],
-                            "input": task["args"][0],
-                            "node": task["hostname"],
-                            "progress": f"{progress:.1f}%",
-                        }
-                    )
+                if task["type"] not in INGEST_TASKS:
+                    continue
+                plan = _ingest_plan(task)
+                if plan is not None:
+                    # Show a parallel ingest as one row, however many of its
+                    # segments are running
+                    if plan["task_id"] in parallel_ingests:
+                        parallel_ingests[plan["task_id"]]["node"] += (
+                            ", " + task["hostname"]
+                        )
+                        continue
+                    segments = _ingest_segments(plan, states)
+                    progress = _ingest_progress(segments)
+                    eta = ""
+                    task_id = plan["task_id"]
+                    input_file = plan["input"]
+                else:
+                    _, info = states[task["id"]]
+                    progress = results.progress_percent(info)
+                    eta = results.eta_text(info)
+                    task_id = task["id"]
+                    input_file = task["args"][0]
+                row = {
+                    "time_start": datetime.datetime.fromtimestamp(
+                        task["time_start"]
+                    ).strftime("%Y-%m-%d %H:%M:%S"),
+                    "id": task_id,
+                    "input": input_file,
+                    "node": task["hostname"],
+                    "progress": f"{progress:.1f}%",
+                    "eta": eta,
+                }
+                if plan is not None:
+                    row["segments"] = segments
+                    parallel_ingests[task_id] = row
+                result["data"].append(row)
     return flask.jsonify(result)
 
 
 @app.route(app.config["api_route"] + "/ingest/<taskid>", methods=["DELETE"])
 def api_ingest_stop(taskid=None):
-    for node, running_tasks in app_cel.control.inspect().active().items():
+    for node, running_tasks in workers.active().items():
         for task in running_tasks:
-            if task["id"] == taskid and task["type"] == tasks.ingest_video.name:
+            if task["type"] not in INGEST_TASKS:
+                continue
+            plan = _ingest_plan(task)
+            if plan is None and task["id"] == taskid:
+                app_cel.control.revoke(task["id"], terminate=True)
+            elif plan is not None and plan["task_id"] == taskid:
+                # Stop the running segments and drop any still queued
+                for segment_id in plan["segment_ids"]:
+                    app_cel.control.revoke(segment_id, terminate=True)
                 app_cel.control.revoke(task["id"], terminate=True)
+    workers.refresh_soon()
     return flask.jsonify({"success": True})
 
 
+@app.route(app.config["api_route"] + "/events", methods=["GET"])
+def api_events():
+    """Stream task progress and state changes as Server-Sent Events."""
+    if not event_hub.available():
+        return flask.jsonify({"success": False}), 503
+
+    def stream():
+        yield "retry: 5000\n\n"
+        for batch in event_hub.listen(keepalive=EVENTS_KEEPALIVE):
+            if not batch:
+                yield ": keepalive\n\n"
+                continue
+            # Tasks starting or stopping change what the tables list
+            if any(event["meta"] is None for event in batch):
+                workers.refresh_soon()
+            yield f"data: {json.dumps(batch, default=str)}\n\n"
+
+    return flask.Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     app.run(debug=True)
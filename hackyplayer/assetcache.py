@@ -0,0 +1,95 @@
+"""Content-addressed cache for rendered build assets"""
+
+import hashlib
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = 1024 * 1024 * 1024
+HASH_CHUNK = 1024 * 1024
+
+# (path, size, mtime) -> sha256, so large resources are only read once
+_file_hashes = {}
+
+
+def file_hash(path):
+    path = Path(path).resolve()
+    stats = os.stat(path)
+    memo_key = (str(path), stats.st_size, stats.st_mtime_ns)
+    try:
+        return _file_hashes[memo_key]
+    except KeyError:
+        pass
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def cache_key(*parts):
+    """Hash ``parts`` into a cache key.
+
+    ``Path`` parts are keyed on the file's contents rather than its name, so
+    replacing a resource invalidates everything rendered from it.
+    """
+    key_parts = [
+        {"file": file_hash(part)} if isinstance(part, Path) else part for part in parts
+    ]
+    return hashlib.sha256(
+        json.dumps(key_parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class AssetCache:
+    """Directory of rendered assets, evicted least recently used first."""
+
+    def __init__(self, cache_dir, max_bytes=MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key, suffix, build):
+        """Return the path of asset ``key``, calling ``build(path)`` to render
+        it on a miss."""
+        path = self.cache_dir / f"{key}{suffix}"
+        if path.exists():
+            logger.debug("Asset cache hit: %s", path.name)
+            os.utime(path)
+            return path
+
+        logger.debug("Asset cache miss: %s", path.name)
+        # Render under a unique name so concurrent builds, on any host sharing
+        # the cache, don't clobber each other, keeping the suffix so tools can infer the output format
+        tmp_path = self.cache_dir / f"{key}.tmp-{uuid.uuid4().hex}{suffix}"
+        try:
+            build(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or ".tmp-" in entry.name:
+                continue
+            stats = entry.stat()
+            entries.append((stats.st_mtime, stats.st_size, Path(entry.path)))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            logger.info("Evicting cached asset: %s", path.name)
+            path.unlink(missing_ok=True)
+            total -= size
@@ -5,6 +5,8 @@ import pathlib
 import celery
 import flask
 
+from . import events
+
 DEFAULT_CONFIG = {
     "VIDEO_SOURCES": [
         {
@@ -25,22 +27,154 @@ DEFAULT_CONFIG = {
             "EXT": [".mpd"],
             "NAME": "Live",
         },
+        {
+            "DISKDIR": pathlib.Path("static/video/hls"),
+            "WEBDIR": "hls",
+            "EXT": [".m3u8"],
+            "NAME": "Source (HLS)",
+            # Builds use the full quality file in this folder
+            "BUILD_FROM": "source",
+        },
     ],
     "VIDEO_OUTPUT": pathlib.Path("static/video/output"),
+    "VIDEO_PROXY": {
+        "DISKDIR": pathlib.Path("static/video/proxy"),
+        "WEBDIR": "proxy",
+        "HEIGHT": 540,
+    },
+    "INGEST_PROXY": False,
+    "VIDEO_HLS": {
+        "DISKDIR": pathlib.Path("static/video/hls"),
+        "LADDER": [[1080, "6M"], [720, "3M"], [360, "800k"]],
+    },
+    "INGEST_HLS": False,
+    "VIDEO_SCRUB": {
+        "DISKDIR": pathlib.Path("static/video/scrub"),
+        "WEBDIR": "scrub",
+        "THUMB_SECONDS": 10,
+    },
+    "INGEST_SCRUB": False,
     "VIDEO_TEMP": pathlib.Path("temp"),
+    "SMART_RENDER": True,
+    # Encoder settings by name, over formvideo.DEFAULT_PROFILE. Smart
+    # rendering copies the ingested H.264 between re-encoded intros and
+    # outros, so build profiles should encode H.264 too.
+    "ENCODE_PROFILES": {
+        "publish": {"CRF": 16},
+        # For checking a cut: quick to encode and decode, and named "-draft"
+        "draft": {
+            "CRF": 30,
+            "PRESET": "ultrafast",
+            "TUNE": "fastdecode",
+            "SUFFIX": "-draft",
+        },
+        # For CPU-only workers: close to publish quality at several times
+        # the speed of the default preset
+        "cpu-fast": {
+            "CRF": 17,
+            "PRESET": "veryfast",
+            "THREADS": 0,
+            "X264_PARAMS": "rc-lookahead=20:ref=2",
+        },
+        "ingest": {"CRF": 12},
+        # With an NVIDIA GPU, e.g.:
+        # "nvenc": {"VIDEO_CODEC": "h264_nvenc", "BITRATE": "12M", "PRESET": "p4"},
+    },
+    "BUILD_PROFILE": "publish",
+    # Previews render just the intro and outro of a build, with
+    # PREVIEW_SECONDS of the talk each side, to check the in and out points
+    "PREVIEW_PROFILE": "draft",
+    "PREVIEW_SECONDS": 20,
+    "VIDEO_PREVIEW": {
+        "DISKDIR": pathlib.Path("static/video/preview"),
+        "WEBDIR": "preview",
+        "HEIGHT": 360,
+    },
+    "INGEST_PROFILE": "ingest",
+    "ASSET_CACHE_MAX_BYTES": 1024 * 1024 * 1024,
+    "BUILD_CHUNK_SECONDS": 0,
+    "INGEST_CHUNK_SECONDS": 0,
+    # Builds and ingests not split into chunks above are still encoded in
+    # chunks of this many seconds, so a retry picks up where they stopped
+    "CHECKPOINT_SECONDS": 600,
+    # Temp folders and partial outputs of jobs that aren't running or
+    # finished are removed this long after they were last written to
+    "TEMP_MAX_AGE_SECONDS": 2 * 24 * 60 * 60,
+    # Finished builds keep the segments a rebuild with new talk details can
+    # reuse for TEMP_MAX_AGE_SECONDS, newest first, up to this many bytes
+    "REUSE_MAX_BYTES": 50 * 1024 * 1024 * 1024,
     "WATCHFOLDERS": [
         {
             "NAME": "input",
             "FULLPATH": pathlib.Path("static/video/input"),
             "OUTPUT_DIR": pathlib.Path("static/video/source"),
+            "POLL": False,
         }
     ],
     "CELERY": {
         "broker_url": "redis://localhost",
         "result_backend": "redis://localhost",
         "task_ignore_result": False,
+        # Every worker takes from every queue unless started with -Q, so
+        # run some with "-Q build" to keep builds from waiting on ingests
+        "task_queues": {
+            "celery": {},
+            "build": {},
+            "ingest": {},
+            "analysis": {},
+            "watch": {},
+        },
+        # With Redis, lower numbers are taken first. 0 is kept for previews,
+        # then the later tasks of a started build or ingest go first, so they
+        # finish soonest.
+        "task_routes": {
+            "hackyplayer.tasks.build_video": {"queue": "build", "priority": 4},
+            "hackyplayer.tasks.build_video_segment": {"queue": "build", "priority": 2},
+            "hackyplayer.tasks.merge_video": {"queue": "build", "priority": 1},
+            "hackyplayer.tasks.ingest_video": {"queue": "ingest", "priority": 4},
+            "hackyplayer.tasks.ingest_video_segment": {
+                "queue": "ingest",
+                "priority": 2,
+            },
+            "hackyplayer.tasks.merge_ingest": {"queue": "ingest", "priority": 1},
+            "hackyplayer.tasks.analyse_video": {"queue": "analysis", "priority": 5},
+            # Watchfolders run until they're stopped, so they get their own
+            # worker rather than holding a slot an encode could use
+            "hackyplayer.tasks.watch_folder": {"queue": "watch"},
+        },
+        "broker_transport_options": {
+            "priority_steps": list(range(10)),
+            "sep": ":",
+            "queue_order_strategy": "priority",
+        },
+        # Only take a task when there's a free process for it, so nothing
+        # waits in one worker's buffer while another is idle
+        "worker_prefetch_multiplier": 1,
+    },
+    # How many cores the FFmpegs of all the workers on a node share (all of
+    # them if None), and where they lock the ones they're using
+    "WORKER_CORES": None,
+    "CORE_LOCK_DIR": None,
+    # Cores each task asks for, and how nice its FFmpegs are to the others.
+    # FFmpeg's threads are sized to the cores it gets.
+    "TASK_CPU": {
+        "build_video": {"THREADS": 8, "NICE": 0},
+        "build_video_segment": {"THREADS": 4, "NICE": 0},
+        "merge_video": {"THREADS": 1, "NICE": 0},
+        "ingest_video": {"THREADS": 8, "NICE": 5},
+        "ingest_video_segment": {"THREADS": 4, "NICE": 5},
+        "merge_ingest": {"THREADS": 4, "NICE": 5},
+        "analyse_video": {"THREADS": 2, "NICE": 10},
     },
     "LOG_DIR": pathlib.Path("logs"),
+    "WORKER_SNAPSHOT_SECONDS": 2,
+    "LIBRARY_SCAN_SECONDS": 10,
+    "PROBE_CACHE": pathlib.Path("probe.sqlite3"),
+    "SCHEDULE_FILE": pathlib.Path(__file__).parent / "talks.json",
+    "SCHEDULE_URL": "https://www.emfcamp.org/schedule/2024.json",
+    "SCHEDULE_TIMEZONE": "Europe/London",
+    "VIDEO_ANALYSIS": pathlib.Path("analysis"),
+    "INGEST_ANALYSE": False,
 }
 
 
@@ -50,6 +184,10 @@ def celery_init_app(app):
             with app.app_context():
                 return self.run(*args, **kwargs)
 
+        def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+            super().update_state(task_id, state, meta, **kwargs)
+            events.publish(self.app, task_id or self.request.id, self.name, state, meta)
+
     celery_app = celery.Celery(app.name, task_cls=FlaskTask)
     celery_app.config_from_object(app.config["CELERY"])
     celery_app.set_default()
@@ -0,0 +1,146 @@
+"""Sharing a node's CPU cores between the FFmpegs its workers run"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Where the workers on a node lock the cores they're using. Every worker on
+# the node must use the same folder, on a local disk.
+LOCK_DIR = Path(tempfile.gettempdir()) / "hackyplayer-cores"
+# How long to wait for all of the cores asked for before making do with
+# however many are free
+WAIT_S = 30
+POLL_S = 0.5
+
+# The cores asked for by, and reserved by, the task running in each thread
+_wanted = threading.local()
+_reserved = threading.local()
+
+
+class CoreBudget:
+    """The first ``cores`` CPUs a worker may run on, shared between every
+    worker process on the node by locking a file for each one.
+
+    The locks go with the processes holding them, so a worker that dies
+    can't keep its cores.
+    """
+
+    def __init__(self, cores=None, lock_dir=LOCK_DIR):
+        cpus = sorted(os.sched_getaffinity(0))
+        self.cpus = cpus[:cores] if cores else cpus
+        self.lock_dir = Path(lock_dir)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    def _lock_free(self, count):
+        """Lock up to ``count`` free cores, returning ``{cpu: lock file}``."""
+        held = {}
+        for cpu in self.cpus:
+            if len(held) == count:
+                break
+            f = open(self.lock_dir / f"cpu{cpu}.lock", "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            held[cpu] = f
+        return held
+
+    @contextlib.contextmanager
+    def want(self, threads, nice=0):
+        """Have each FFmpeg the current thread runs until the ``with`` block
+        ends reserve ``threads`` cores while it runs (see ``reserving``)."""
+        _wanted.value = (self, threads, nice)
+        try:
+            yield
+        finally:
+            _wanted.value = None
+
+    @contextlib.contextmanager
+    def reserve(self, threads, nice=0, wait_s=WAIT_S):
+        """Reserve ``threads`` cores for the FFmpegs the current thread runs
+        until the ``with`` block ends.
+
+        Waits up to ``wait_s`` for that many to be free, then takes however
+        many are (but always at least one), so no core sits idle while a
+        big task waits for a busy node to empty.
+        """
+        threads = max(1, min(threads, len(self.cpus)))
+        deadline = time.monotonic() + wait_s
+        while True:
+            held = self._lock_free(threads)
+            if len(held) == threads or (held and time.monotonic() >= deadline):
+                break
+            for f in held.values():
+                f.close()
+            time.sleep(POLL_S)
+
+        if len(held) < threads:
+            logger.info("Only %d of %d cores free, using those", len(held), threads)
+        _reserved.value = (sorted(held), nice)
+        try:
+            yield sorted(held)
+        finally:
+            _reserved.value = None
+            for f in held.values():
+                f.close()
+
+
+def reserved():
+    """``(cpus, nice)`` reserved by the current thread, or ``None``."""
+    return getattr(_reserved, "value", None)
+
+
+@contextlib.contextmanager
+def reserving():
+    """Reserve the cores the current thread wants until the ``with`` block,
+    which runs an FFmpeg, ends, so a task only holds cores while it encodes
+    rather than while it plans or waits."""
+    wanted = getattr(_wanted, "value", None)
+    if wanted is None or reserved() is not None:
+        yield
+        return
+    budget, threads, nice = wanted
+    with budget.reserve(threads, nice):
+        yield
+
+
+def ffmpeg_args(args):
+    """``args`` with FFmpeg's filter threads limited to the reserved cores.
+
+    Encoders and decoders size their thread pools to the CPUs they can run
+    on, so ``popen_kwargs`` limiting those is enough for them.
+    """
+    reservation = reserved()
+    if reservation is None:
+        return list(args)
+    threads = str(len(reservation[0]))
+    return [
+        args[0],
+        "-filter_threads", threads,
+        "-filter_complex_threads", threads,
+        *args[1:],
+    ]  # fmt: skip
+
+
+def popen_kwargs():
+    """``subprocess.Popen`` arguments to run a child on the reserved cores,
+    at the reserved niceness."""
+    reservation = reserved()
+    if reservation is None:
+        return {}
+    cpus, nice = reservation
+
+    def limit():
+        os.sched_setaffinity(0, cpus)
+        if nice:
+            os.nice(nice)
+
+    return {"preexec_fn": limit}
@@ -0,0 +1,43 @@
+"""SQLite databases shared between threads and worker processes"""
+
+import contextlib
+import sqlite3
+import threading
+from pathlib import Path
+
+# (path, schema) of the databases this process has set up, so each is only
+# set up once rather than every time one is opened
+_initialised = set()
+_initialised_lock = threading.Lock()
+
+
+class Database:
+    """An SQLite database with ``schema``, in WAL mode so reads don't wait
+    for writes.
+
+    Each method uses its own connection, so a database can be shared between
+    threads and worker processes.
+    """
+
+    schema = ""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        with _initialised_lock:
+            key = (self.db_path.resolve(), self.schema)
+            if key in _initialised:
+                return
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as db:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(self.schema)
+            _initialised.add(key)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
@@ -0,0 +1,143 @@
+"""Task progress and state changes, pushed over Redis pub/sub"""
+
+import json
+import logging
+import queue
+import threading
+import time
+
+import celery.states
+
+from .results import redis_client
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "hackyplayer:events"
+# Least time between progress events for one task, in seconds. Changes of
+# state are always published straight away.
+PUBLISH_INTERVAL = 1.0
+# How long a stream collects events before sending them on, in seconds
+COALESCE_INTERVAL = 0.5
+# How long to wait in the subscriber thread before reconnecting
+RECONNECT_DELAY = 5
+# How often the subscriber checks its connection is still alive, in seconds
+HEALTH_CHECK_INTERVAL = 30
+
+# task_id -> (time, state) of the last throttled event published by this
+# process within PUBLISH_INTERVAL
+_last_published = {}
+
+
+def publish(celery_app, task_id, task_name, state, meta=None, force=False):
+    """Publish a task's state and progress, unless an event for the same
+    state was published less than ``PUBLISH_INTERVAL`` ago."""
+    now = time.monotonic()
+    last = _last_published.get(task_id)
+    if not force and last and last[1] == state and now - last[0] < PUBLISH_INTERVAL:
+        return
+
+    # Forced events, like those of tasks being queued, aren't throttled, so
+    # they aren't remembered either: a process that only queues tasks would
+    # otherwise keep every one of them
+    if state in celery.states.READY_STATES:
+        _last_published.pop(task_id, None)
+    elif not force:
+        # Kept in the order they were published, so the ones too old to
+        # throttle anything, like those of tasks finished in another process,
+        # can be dropped from the front
+        _last_published.pop(task_id, None)
+        _last_published[task_id] = (now, state)
+        while now - next(iter(_last_published.values()))[0] >= PUBLISH_INTERVAL:
+            del _last_published[next(iter(_last_published))]
+
+    client = redis_client(celery_app)
+    if client is None:
+        return
+    event = {"id": task_id, "task": task_name, "state": state, "meta": meta}
+    try:
+        client.publish(CHANNEL, json.dumps(event, default=str))
+    except Exception:
+        logger.warning("Couldn't publish event for task %s", task_id, exc_info=True)
+
+
+class EventHub:
+    """Shares one subscription to the events channel between every stream in
+    this process."""
+
+    def __init__(self, celery_app):
+        self.celery_app = celery_app
+        self._queues = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def available(self):
+        return redis_client(self.celery_app) is not None
+
+    def listen(self, keepalive):
+        """Yield lists of events, keeping only the latest one for each task
+        within ``COALESCE_INTERVAL``. Yields an empty list if there are no
+        events for ``keepalive`` seconds."""
+        events = queue.SimpleQueue()
+        with self._lock:
+            self._queues.add(events)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._subscribe, name="event-hub", daemon=True
+                )
+                self._thread.start()
+
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=keepalive)
+                except queue.Empty:
+                    yield []
+                    continue
+                batch = {event["id"]: event}
+                deadline = time.monotonic() + COALESCE_INTERVAL
+                while (remaining := deadline - time.monotonic()) > 0:
+                    try:
+                        event = events.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    batch[event["id"]] = event
+                yield list(batch.values())
+        finally:
+            with self._lock:
+                self._queues.discard(events)
+
+    def _client(self):
+        """A Redis client of its own for the subscription, which waits for
+        messages as long as it takes: the result backend's times out reads
+        after ``redis_socket_timeout``, which an idle channel would hit."""
+        backend = self.celery_app.backend
+        pool = backend.ConnectionPool(
+            **{
+                **backend.connparams,
+                "socket_timeout": None,
+                "health_check_interval": HEALTH_CHECK_INTERVAL,
+            }
+        )
+        return backend.redis.Redis(connection_pool=pool)
+
+    def _subscribe(self):
+        client = self._client()
+        while True:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(CHANNEL)
+                while True:
+                    # Wake up now and then, so the connection gets checked
+                    message = pubsub.get_message(timeout=HEALTH_CHECK_INTERVAL)
+                    if message is None:
+                        continue
+                    event = json.loads(message["data"])
+                    with self._lock:
+                        queues = list(self._queues)
+                    for events in queues:
+                        events.put(event)
+            except Exception:
+                logger.exception("Lost subscription to %s, reconnecting", CHANNEL)
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                pubsub.close()
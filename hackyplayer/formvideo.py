@@ -1,14 +1,19 @@
 import datetime
+import hashlib
 import json
 import logging
 import math
 import os
 import os.path
+import re
 import shutil
 import subprocess
 import threading
+import time
 from pathlib import Path
 
+from . import assetcache, cores, ledger, loudness, probe, scrub
+
 # Set default logger (is overwritten within certain functions)
 logger = logging.getLogger(__name__)
 formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -17,8 +22,50 @@ FFMPEG_BIN = "ffmpeg"
 FFPROBE_BIN = "ffprobe"
 IMAGEMAGICK_BIN = "convert"
 FRAMERATE = 50
-LOUD_LEVEL = -23
+TIMECODE_RE = re.compile(r"(\d{2}):(\d{2}):(\d{2}):(\d{2})")
 AAC_ENCODER = "aac"  # or e.g. libfdk_aac
+KEYFRAME_SEARCH_S = 10  # How far to look for a keyframe to splice on
+INGEST_OVERLAP_S = 1  # How much extra to decode before each ingest chunk
+PROXY_HEIGHT = 540
+# (height, video bitrate) of each HLS rendition, best first
+HLS_LADDER = [(1080, "6M"), (720, "3M"), (360, "800k")]
+HLS_SEGMENT_S = 4
+BUILD_VERSION = 2  # Bump when plan_build changes what it outputs
+# Previews render this much of the talk after the intro and before the outro
+PREVIEW_SECONDS = 20
+PREVIEW_HEIGHT = 360
+# Encoder settings, which the profiles passed to plan_build and plan_ingest
+# override. BITRATE, if set, replaces CRF for encoders without it.
+DEFAULT_PROFILE = {
+    "VIDEO_CODEC": "h264",
+    "CRF": 16,
+    "BITRATE": None,
+    "PRESET": None,
+    "TUNE": None,
+    "THREADS": None,
+    "X264_PARAMS": None,
+    "AUDIO_CODEC": AAC_ENCODER,
+    "AUDIO_BITRATE": "128k",
+    "SUFFIX": "",  # Added to build file names, to tell drafts apart
+}
+INGEST_PROFILE = {"CRF": 12}
+# Builds and ingests not split up to run in parallel are still encoded in
+# chunks of about this many seconds, so a retry only redoes the last one
+CHECKPOINT_S = 600
+# The segments of a job finished so far, in its temp folder
+MANIFEST_FILE = "manifest.jsonl"
+# Final outputs are written under this prefix, then renamed once complete
+PARTIAL_PREFIX = ".partial-"
+# Temp folders and partial outputs left this long by a job that isn't
+# running or finished are removed by clean_temp
+TEMP_MAX_AGE_S = 2 * 24 * 60 * 60
+ASSET_DIR = "assets"  # In the temp folder, shared by every build
+BUILD_JOB_DIR = "build-{}"
+INGEST_JOB_DIR = "ingest-{}"
+CARD_SEGMENTS = ("intro", "main")  # Build segments showing the title card
+COPIED_SEGMENTS = ("body",)  # Build segments stream copied, so quick to redo
+PROGRESS_INTERVAL_S = 2  # Least time between progress updates to the task
+PROGRESS_MIN_STEP = 0.001  # Least progress, as a fraction, worth reporting
 
 APP_ROOT = Path(".").resolve()
 TEMP_DIR = APP_ROOT / "temp"
@@ -34,17 +81,60 @@ SPONS_FILE = RESOURCE_DIR / "sponsor_slide_rounded.png"
 SPONS_END_FILE = RESOURCE_DIR / "sponsor_end_slide.png"
 
 
-def timecode_split(timecode, framerate=FRAMERATE):
-    splits = timecode.split(":")
-    hours = int(splits[0])
-    minutes = int(splits[1])
-    seconds = int(splits[2])
-    frames = int(splits[3])
+def encode_profile(profile=None):
+    """``DEFAULT_PROFILE`` with the settings of ``profile`` over it."""
+    return {**DEFAULT_PROFILE, **(profile or {})}
+
+
+def _video_codec(profile, framerate, *size_args):
+    """FFmpeg output options to encode video with ``profile``, with a closed
+    GOP every half second so builds can be spliced."""
+    profile = encode_profile(profile)
+    args = ["-c:v", profile["VIDEO_CODEC"]]
+    if profile["BITRATE"]:
+        args += ["-b:v", profile["BITRATE"]]
+    elif profile["CRF"] is not None:
+        args += ["-crf", str(profile["CRF"])]
+    for option, key in (
+        ("-preset", "PRESET"),
+        ("-tune", "TUNE"),
+        ("-threads", "THREADS"),
+        ("-x264-params", "X264_PARAMS"),
+    ):
+        if profile[key] is not None:
+            args += [option, str(profile[key])]
+    return [
+        *args,
+            "-g", str(math.floor(framerate / 2)),
+            "-flags", "+cgop",
+            *size_args,
+        "-r", str(framerate),
+        "-pix_fmt", "yuv420p",
+    ]  # fmt: skip
+
+
+def _audio_codec(profile):
+    profile = encode_profile(profile)
+    return [
+        "-c:a", profile["AUDIO_CODEC"],
+            "-ac", "2",
+            "-ar", "48000",
+            "-b:a", profile["AUDIO_BITRATE"],
+    ]  # fmt: skip
 
-    assert hours < 24
-    assert minutes < 60
-    assert seconds < 60
-    assert frames < framerate
+
+def timecode_split(timecode, framerate=FRAMERATE):
+    """Split an ``HH:MM:SS:FF`` timecode into its parts, raising
+    ``ValueError`` if it isn't one."""
+    match = TIMECODE_RE.fullmatch(str(timecode))
+    if match is None:
+        raise ValueError(f"timecode {timecode!r} isn't HH:MM:SS:FF")
+    hours, minutes, seconds, frames = (int(part) for part in match.groups())
+
+    if hours >= 24 or minutes >= 60 or seconds >= 60 or frames >= framerate:
+        raise ValueError(
+            f"timecode {timecode!r} is out of range (frames go up to {framerate - 1})"
+        )
 
     return (hours, minutes, seconds, frames)
 
@@ -55,6 +145,31 @@ def timecode_to_seconds(timecode, framerate=FRAMERATE):
     return (hours * 60 * 60) + (minutes * 60) + (seconds) + (frames / framerate)
 
 
+def seconds_to_timecode(seconds, framerate=FRAMERATE):
+    frames = round(seconds * framerate)
+    return "{:02d}:{:02d}:{:02d}:{:02d}".format(
+        frames // (framerate * 60 * 60),
+        frames // (framerate * 60) % 60,
+        frames // framerate % 60,
+        frames % framerate,
+    )
+
+
+def check_timecodes(video, start_tc, end_tc, framerate=FRAMERATE, probe_cache=None):
+    """Raise ``ValueError`` unless ``start_tc`` to ``end_tc`` is a non-empty
+    part of ``video``."""
+    start_s = timecode_to_seconds(start_tc, framerate)
+    end_s = timecode_to_seconds(end_tc, framerate)
+    if start_s >= end_s:
+        raise ValueError(f"start {start_tc} isn't before end {end_tc}")
+    duration_s = _video_duration_seconds(video, probe_cache)
+    # Allow the end to be on the last frame, however the container rounds it
+    if end_s > duration_s + 1 / framerate:
+        raise ValueError(
+            f"end {end_tc} is after the end of the video ({duration_s:.2f}s)"
+        )
+
+
 def timecode_to_timestamp(timecode, framerate=FRAMERATE):
     hours, minutes, seconds, frames = timecode_split(timecode, framerate)
 
@@ -93,13 +208,53 @@ class FileLogger:
         self.file = logging.getLogger(str(request_id))
         self.file.propagate = False
 
+        if self.file.handlers:
+            return
+
         file_handler = logging.FileHandler(task_log)
         file_handler.setFormatter(formatter)
         self.file.setLevel(logging.DEBUG)
         self.file.addHandler(file_handler)
 
 
-def form_video(
+def build_keys(
+    video,
+    talk,
+    start_tc,
+    end_tc,
+    framerate=FRAMERATE,
+    smart_render=False,
+    parallel_chunk_s=0,
+    profile=None,
+    checkpoint_s=0,
+):
+    """Identify a build by everything that goes into its output.
+
+    Returns ``(key, content_key)``: ``content_key`` covers the source file,
+    timecodes, slide resources and encoder settings, and ``key`` adds the
+    talk's details, which only the title card and file metadata use.
+    """
+    stats = os.stat(video)
+    content_key = assetcache.cache_key(
+        BUILD_VERSION,
+        {"size": stats.st_size, "hash": ledger.partial_hash(video, stats.st_size)},
+        start_tc,
+        end_tc,
+        framerate,
+        smart_render,
+        parallel_chunk_s or checkpoint_s,
+        encode_profile(profile),
+        FONT_PATH,
+        BKGD_FILE,
+        TRANSP_FILE,
+        LOGO_FILE,
+        SPONS_FILE,
+        SPONS_END_FILE,
+    )
+    return assetcache.cache_key(content_key, talk), content_key
+
+
+def plan_build(
     task,
     video,
     talk,
@@ -109,7 +264,40 @@ def form_video(
     out_dir=OUT_DIR,
     temp_dir=TEMP_DIR,
     log_dir=LOG_DIR,
+    smart_render=False,
+    asset_cache_bytes=assetcache.MAX_BYTES,
+    parallel_chunk_s=0,
+    probe_cache=None,
+    reuse=None,
+    profile=None,
+    preview_s=0,
+    preview_height=PREVIEW_HEIGHT,
+    job_id=None,
+    checkpoint_s=0,
 ):
+    """Render the text and slide assets for a build and plan its FFmpeg runs.
+
+    Returns a JSON-serialisable build plan. Its ``segments`` don't depend on
+    each other, so can be run in any order (or in parallel, if
+    ``parallel_chunk_s`` is set) with ``render_segment``, before
+    ``merge_build`` joins them into the output file. With
+    ``parallel_chunk_s``, talks which can't be stream copied are encoded in
+    chunks of roughly that many seconds.
+
+    ``reuse`` is the plan of a finished build with the same ``content_key``
+    (see ``build_keys``), whose segments are used instead of being rendered
+    again where they're still on disk. ``profile`` is the encoder settings
+    to use over ``DEFAULT_PROFILE``.
+
+    With ``preview_s``, only the intro and outro are rendered, each with
+    that many seconds of the talk, at ``preview_height``, to check the cut.
+
+    Segments are recorded in a manifest in the build's temp folder as they
+    finish, and skipped by a later build with the same ``job_id``, so one
+    retried after a failure carries on where it stopped. ``checkpoint_s``
+    splits talks which aren't split for ``parallel_chunk_s`` into chunks of
+    that many seconds, so that doesn't mean starting a full build again.
+    """
     temp_dir = Path(temp_dir).resolve()
     out_dir = Path(out_dir).resolve()
 
@@ -135,7 +323,6 @@ def form_video(
     col_bkg = "#00000000"  # "#21301850"
 
     # Generated file names
-    copr_file = "copyright.png"
     spres_file = "start_pres.png"
     stalk_file = "start_title.png"
 
@@ -145,6 +332,9 @@ def form_video(
     start_ts = timecode_to_timestamp(start_tc)
     end_ts = timecode_to_timestamp(end_tc)
 
+    # Fail now, rather than once FFmpeg runs out of video
+    check_timecodes(video, start_tc, end_tc, framerate, probe_cache)
+
     # Calculate some other reused variables
     fade_offset = end_s - start_s - (end_fade_in / 2.0)
     afade_offset = fade_offset - (afade_out)  # When to fade out the main talk audio
@@ -161,13 +351,15 @@ def form_video(
         filename = talk["filename"] + "-" + start_timestamp
     except KeyError:
         filename = start_timestamp
+    filename += encode_profile(profile)["SUFFIX"]
+    if preview_s:
+        filename += "-preview"
 
-    job_temp_dir = Path.joinpath(Path(temp_dir), Path(filename))
+    job_temp_dir = temp_dir / (BUILD_JOB_DIR.format(job_id) if job_id else filename)
     job_temp_dir.mkdir(parents=True, exist_ok=True)
 
-    copr_file = Path.joinpath(Path(temp_dir), Path(filename), copr_file)
-    spres_file = Path.joinpath(Path(temp_dir), Path(filename), spres_file)
-    stalk_file = Path.joinpath(Path(temp_dir), Path(filename), stalk_file)
+    spres_file = job_temp_dir / spres_file
+    stalk_file = job_temp_dir / stalk_file
 
     output_file = Path(filename + ".mp4")
     output_path = Path.joinpath(Path(out_dir), output_file)
@@ -235,7 +427,6 @@ def form_video(
         "-background", col_bkg,
         "-layers", "merge",
         "+repage",
-        copr_file,
     ]  # fmt: skip
 
     # Build all the text assets
@@ -243,7 +434,6 @@ def form_video(
     task.update_state(state="Building text assets")
     subprocess.check_output(start_title_args)
     subprocess.check_output(start_pres_arg)
-    subprocess.check_output(copyright_args)
 
     # Build file metadata list
     metadata = [
@@ -260,150 +450,984 @@ def form_video(
     # stagec has a background hum @ 150Hz
     apply_150_hz_notch = "stagec_" in video.name
 
-    # Run the final build FFmpeg
-    ffmpeg_args = [
-        FFMPEG_BIN,
-        "-ss", start_ts, "-to", end_ts, "-i", video.name,  # 0
-        "-stream_loop", "-1", "-r", str(framerate), "-i", BKGD_FILE,  # 1
-        "-loop", "1", "-framerate", str(framerate), "-i", TRANSP_FILE,  # 2
-        "-loop", "1", "-framerate", str(framerate), "-i", spres_file,  # 3
-        "-loop", "1", "-framerate", str(framerate), "-i", stalk_file,  # 4
-        "-width", "850", "-height", "380", "-keep_ar", "1", "-loop", "1", "-framerate", str(framerate), "-i", LOGO_FILE,  # 5
-        "-loop", "1", "-framerate", str(framerate), "-i", SPONS_FILE,  # 6
-        "-loop", "1", "-framerate", str(framerate), "-i", copr_file,  # 7
-        "-loop", "1", "-framerate", str(framerate), "-i", SPONS_END_FILE,  # 8
-        "-filter_complex",
-        (
-            "[0:a]afade=in:d={in_:.2f},afade=out:st={out_st:.2f}:d={out:.2f},adelay={title_end:.2f}:all=1,".format(
+    def talk_filters(fade_out_st):
+        return (
+            "afade=in:d={in_:.2f},afade=out:st={out_st:.2f}:d={out:.2f},".format(
                 in_=afade_in,
                 out=afade_out,
-                out_st=afade_offset,
-                title_end=title_end * 1000,
+                out_st=fade_out_st,
             )
             +
-            "aresample=async=1," +
-            # "volume=volume=1.9," +  # C3VOC were using this for GPN; do we need to boost the volume by 2x?
+            "aresample=async=1" +
+            # ",volume=volume=1.9" +  # C3VOC were using this for GPN; do we need to boost the volume by 2x?
             (
-                "equalizer=frequency=150:width_type=q:width=10:g=-20,"
+                ",equalizer=frequency=150:width_type=q:width=10:g=-20"
                 if apply_150_hz_notch
                 else ""
             )
-            + "ladspa=f=master_me-ladspa:p=master_me:controls=c1=-16|c22=21|c59=-3[a1];"
-            + f"[0:v]settb=AVTB,fps={framerate:.2f},format=yuv420p[main];"
-            + f"[1:v]settb=AVTB,fps={framerate:.2f},format=yuv420p[bg];"
-            + f"[2:v]settb=AVTB,fps={framerate:.2f},format=yuva420p[tp];"
-            + f"[3:v]settb=AVTB,fps={framerate:.2f},format=yuva420p[slide-pres];"
-            + f"[4:v]settb=AVTB,fps={framerate:.2f},format=yuva420p[slide-title];"
-            + f"[5:v]settb=AVTB,fps={framerate:.2f},format=yuva420p[logo];"
-            + f"[6:v]settb=AVTB,fps={framerate:.2f},format=yuva420p[slide-spons];"
-            + f"[7:v]settb=AVTB,fps={framerate:.2f},format=yuva420p[slide-copyright];"
-            + f"[8:v]settb=AVTB,fps={framerate:.2f},format=yuva420p[slide-spons-end];"
-            + "[logo]split[l1][l2];"
-            + "[bg]split[bg1][bg2];"
-            # Build the title slide by overlaying presenter/title/logo files
-            + "[tp][slide-pres]overlay=x=60:y=640:shortest=1[s2];"
-            + "[s2][slide-title]overlay=x=60:y=320:shortest=1[s3];"
-            + "[s3][l1]overlay=shortest=1[s4];"
-            # fade sponsor slide into title slide
-            + f"[slide-spons][s4]xfade=offset={spn_dur:.2f}:duration={spn_fade_out:.2f}[s5];"
-            # add background to the intro slides
-            + f"[bg1]trim=start=0:end={title_end:.2f}[bg3];"
-            + "[bg3][s5]overlay[s6];"
-            # build end slide by overlaying logo, background, copyright text and
-            # sponsors
-            + "[bg2][l2]overlay[e1];"
-            + "[e1][slide-spons-end]overlay[e2];"
-            + f"[e2][slide-copyright]overlay=x=870:y=70:shortest=1,trim=start=0:end={end_tdur:.2f}[end];"
-            # fade main video into end slide
-            + "[main][end]xfade=offset={eb_start:.2f}:duration=1,fade=out:st={eb_end:.2f}:d={end_fade:.2f}[m2];".format(
-                eb_start=fade_offset, eb_end=eb_end, end_fade=end_fade
-            )
-            # fade intro slides into main video
-            + "[s6][m2]xfade=offset={title_end:.2f}:duration={title_fade_out:.2f},fade=in:d={spn_fade_in:.2f}[p1]".format(
+        )  # fmt: skip
+
+    # The talk audio was compressed at ingest, so builds only normalise it,
+    # measured the same way before the title card's delay is added
+    def talk_audio_graph(fade_out_st, loudnorm):
+        return (
+            talk_filters(fade_out_st)
+            + f",adelay={title_end * 1000:.2f}:all=1,{loudnorm}[a1]"
+        )
+
+    if preview_s:
+        video_codec = _video_codec(
+            profile,
+            framerate,
+            "-s",
+            f"{preview_height * 16 // 9 // 2 * 2}x{preview_height}",
+        )
+    else:
+        video_codec = _video_codec(profile, framerate)
+    audio_codec = _audio_codec(profile)
+
+    def run_asset_render(state, ffmpeg_args, duration_s):
+        segment = _segment(state, ffmpeg_args, build_log, duration_s=duration_s)
+        _run_segment(task, segment, logger)
+
+    # Everything but the title card text is the same for every talk, so the
+    # slides behind it are rendered once and shared between builds
+    asset_cache = assetcache.AssetCache(temp_dir / ASSET_DIR, asset_cache_bytes)
+
+    # Previews have no time to measure the whole talk first
+    if preview_s:
+        loudnorm = loudness.dynamic_filter()
+    else:
+        measured = _measure_loudness(
+            task, asset_cache, video, start_ts, end_ts, talk_filters(afade_offset)
+        )
+        loudnorm = loudness.linear_filter(measured)
+        logger.info(
+            "Talk is %.1f LUFS, normalising with %s", measured["input_i"], loudnorm
+        )
+    audio_graph = "[0:a]" + talk_audio_graph(afade_offset, loudnorm)
+
+    asset_codec = [
+        "-c:v", "h264",
+            "-crf", "12",
+            "-g", str(math.floor(framerate / 2)),
+            "-flags", "+cgop",
+        "-r", str(framerate),
+        "-pix_fmt", "yuv420p",
+    ]  # fmt: skip
+
+    def cached_render(state, ffmpeg_args, duration_s):
+        return asset_cache.get(
+            assetcache.cache_key(*ffmpeg_args),
+            ".mp4",
+            lambda path: run_asset_render(
+                state, [*ffmpeg_args, path, "-y"], duration_s
+            ),
+        )
+
+    copr_file = asset_cache.get(
+        assetcache.cache_key(FONT_PATH, *copyright_args),
+        ".png",
+        lambda path: subprocess.check_output([*copyright_args, path]),
+    )
+
+    # Fade the sponsor slide out over the background
+    intro_plate_file = cached_render(
+        "Rendering intro background",
+        [
+            FFMPEG_BIN,
+            "-stream_loop", "-1", "-r", str(framerate), "-i", BKGD_FILE,  # 0
+            "-loop", "1", "-framerate", str(framerate), "-i", TRANSP_FILE,  # 1
+            "-loop", "1", "-framerate", str(framerate), "-i", SPONS_FILE,  # 2
+            "-filter_complex",
+            (
+                _slide_pads(framerate, [
+                    (0, "yuv420p", "bg"),
+                    (1, "yuva420p", "tp"),
+                    (2, "yuva420p", "slide-spons"),
+                ])
+                + f"[slide-spons][tp]xfade=offset={spn_dur:.2f}:duration={spn_fade_out:.2f}[s5];"
+                + f"[bg]trim=start=0:end={title_end:.2f}[bg3];"
+                + "[bg3][s5]overlay[plate]"
+            ),
+            "-map", "[plate]:v",
+            *asset_codec,
+        ],
+        title_end,
+    )  # fmt: skip
+
+    # Build end slide by overlaying logo, background, copyright text and
+    # sponsors
+    end_slate_file = cached_render(
+        "Rendering end slate",
+        [
+            FFMPEG_BIN,
+            "-stream_loop", "-1", "-r", str(framerate), "-i", BKGD_FILE,  # 0
+            "-width", "850", "-height", "380", "-keep_ar", "1", "-loop", "1", "-framerate", str(framerate), "-i", LOGO_FILE,  # 1
+            "-loop", "1", "-framerate", str(framerate), "-i", copr_file,  # 2
+            "-loop", "1", "-framerate", str(framerate), "-i", SPONS_END_FILE,  # 3
+            "-filter_complex",
+            (
+                _slide_pads(framerate, [
+                    (0, "yuv420p", "bg"),
+                    (1, "yuva420p", "logo"),
+                    (2, "yuva420p", "slide-copyright"),
+                    (3, "yuva420p", "slide-spons-end"),
+                ])
+                + "[bg][logo]overlay[e1];"
+                + "[e1][slide-spons-end]overlay[e2];"
+                + f"[e2][slide-copyright]overlay=x=870:y=70:shortest=1,trim=start=0:end={end_tdur:.2f}[end]"
+            ),
+            "-map", "[end]:v",
+            *asset_codec,
+        ],
+        end_tdur,
+    )  # fmt: skip
+
+    # Slide inputs shared by every build FFmpeg; input 0 is always the talk
+    slide_inputs = [
+        "-i", intro_plate_file,  # 1
+        "-loop", "1", "-framerate", str(framerate), "-i", TRANSP_FILE,  # 2
+        "-loop", "1", "-framerate", str(framerate), "-i", spres_file,  # 3
+        "-loop", "1", "-framerate", str(framerate), "-i", stalk_file,  # 4
+        "-width", "850", "-height", "380", "-keep_ar", "1", "-loop", "1", "-framerate", str(framerate), "-i", LOGO_FILE,  # 5
+        "-i", end_slate_file,  # 6
+    ]  # fmt: skip
+
+    # Build the title slide by overlaying presenter/title/logo files, and fade
+    # it in over the intro background as the sponsor slide fades out
+    intro_graph = (
+        "[tp][slide-pres]overlay=x=60:y=640:shortest=1[s2];"
+        + "[s2][slide-title]overlay=x=60:y=320:shortest=1[s3];"
+        + f"[s3][logo]overlay=shortest=1,fade=in:st={spn_dur:.2f}:d={spn_fade_out:.2f}:alpha=1[s5];"
+        + "[plate][s5]overlay[s6];"
+    )
+
+    build = {
+        "source": str(video),
+        "title": talk["title"],
+        "presenter": talk["presenter"],
+        "start_tc": start_tc,
+        "end_tc": end_tc,
+        "output": str(output_path),
+        "task_log": str(task_log),
+        "total": final_len_s,
+        "parallel": bool(parallel_chunk_s),
+        "segments": [],
+        "mux": None,
+        # Segment name -> output, including any reused from another build
+        "files": {},
+        "manifest": str(job_temp_dir / MANIFEST_FILE),
+    }
+
+    def segment_log(name):
+        if build["parallel"]:
+            return job_log_dir / f"{name}_build.log"
+        return build_log
+
+    def add_segment(name, state, ffmpeg_args, offset_s, duration_s, atomic=False):
+        segment = _segment(
+            state,
+            ffmpeg_args,
+            segment_log(name),
+            cwd=working_dir,
+            offset_s=offset_s,
+            duration_s=duration_s,
+            atomic=atomic,
+        )
+        segment["name"] = name
+        build["segments"].append(segment)
+        build["files"][name] = segment["output"]
+
+    splices = None
+    if preview_s:
+        # The outro has to start before the talk fades into the end slate
+        preview_s = max(min(preview_s, (end_s - start_s) / 2), end_fade_in)
+        splices = (False, [start_s + preview_s, end_s - preview_s])
+        if splices[1][0] >= splices[1][1]:
+            logger.info("Talk is too short to preview, rendering all of it.")
+            splices = None
+    elif smart_render or parallel_chunk_s or checkpoint_s:
+        splices = _plan_splices(
+            video,
+            start_s + title_fade_out,
+            start_s + fade_offset,
+            parallel_chunk_s or checkpoint_s,
+            framerate,
+            probe_cache,
+        )
+        if splices is None:
+            logger.info("Talk is too short to split, running a full build.")
+        elif not splices[0] and not (parallel_chunk_s or checkpoint_s):
+            logger.info("Source can't be spliced, falling back to a full build.")
+            splices = None
+
+    if splices is None:
+        # Run the final build FFmpeg
+        ffmpeg_args = [
+            FFMPEG_BIN,
+            "-ss", start_ts, "-to", end_ts, "-i", video.name,  # 0
+            *slide_inputs,
+            "-filter_complex",
+            (
+                audio_graph + ";"
+                + _slide_pads(framerate, [
+                    (0, "yuv420p", "main"),
+                    (1, "yuv420p", "plate"),
+                    (2, "yuva420p", "tp"),
+                    (3, "yuva420p", "slide-pres"),
+                    (4, "yuva420p", "slide-title"),
+                    (5, "yuva420p", "logo"),
+                    (6, "yuv420p", "end"),
+                ])
+                + intro_graph
+                # fade main video into end slide
+                + "[main][end]xfade=offset={eb_start:.2f}:duration=1,fade=out:st={eb_end:.2f}:d={end_fade:.2f}[m2];".format(
+                    eb_start=fade_offset, eb_end=eb_end, end_fade=end_fade
+                )
+                # fade intro slides into main video
+                + "[s6][m2]xfade=offset={title_end:.2f}:duration={title_fade_out:.2f},fade=in:d={spn_fade_in:.2f}[p1]".format(
+                    title_fade_out=title_fade_out,
+                    title_end=title_end,
+                    spn_fade_in=spn_fade_in,
+                )
+            ),
+            "-map", "[p1]:v",
+            "-map", "[a1]:a",
+            "-map_metadata", "-1",
+            *metadata,
+            *video_codec,
+            *audio_codec,
+            "-movflags", "+faststart",
+            output_path,
+            "-y",
+        ]  # fmt: skip
+        add_segment(
+            "main", "Running main build", ffmpeg_args, 0, final_len_s, atomic=True
+        )
+        build["parallel"] = False
+        return build
+
+    copyable, splice_times = splices
+    splice_in, splice_out = splice_times[0], splice_times[-1]
+
+    # Only the intro and outro change pixels, so they're rendered on their own
+    # and the talk in between is either stream copied from the (closed GOP)
+    # ingested source, or re-encoded in chunks which can run in parallel
+    video_files = []
+
+    # Where the outro starts, relative to the start of [main]
+    outro_offset = splice_out - start_s
+    # How much of the talk a preview leaves out
+    gap_s = splice_out - splice_in if preview_s else 0
+
+    intro_file = job_temp_dir / "intro.ts"
+    intro_args = [
+        FFMPEG_BIN,
+        "-ss", start_ts, "-to", f"{splice_in:.6f}", "-i", video.name,  # 0
+        *slide_inputs,
+        "-filter_complex",
+        (
+            _slide_pads(framerate, [
+                (0, "yuv420p", "main"),
+                (1, "yuv420p", "plate"),
+                (2, "yuva420p", "tp"),
+                (3, "yuva420p", "slide-pres"),
+                (4, "yuva420p", "slide-title"),
+                (5, "yuva420p", "logo"),
+            ])
+            + intro_graph
+            + "[s6][main]xfade=offset={title_end:.2f}:duration={title_fade_out:.2f},fade=in:d={spn_fade_in:.2f}[p1]".format(
                 title_fade_out=title_fade_out,
                 title_end=title_end,
                 spn_fade_in=spn_fade_in,
             )
         ),
         "-map", "[p1]:v",
-        "-map", "[a1]:a",
+        *video_codec,
+        intro_file,
+        "-y",
+    ]  # fmt: skip
+    add_segment(
+        "intro", "Rendering intro", intro_args, 0, title_end + splice_in - start_s
+    )
+    video_files.append(intro_file)
+
+    if preview_s:
+        logger.info(
+            "Previewing, leaving out the talk from %.2fs to %.2fs.",
+            splice_in,
+            splice_out,
+        )
+    elif smart_render and copyable:
+        logger.info(
+            "Smart rendering, copying source from %.2fs to %.2fs.",
+            splice_in,
+            splice_out,
+        )
+        body_file = job_temp_dir / "body.ts"
+        body_args = [
+            FFMPEG_BIN,
+            "-ss", f"{splice_in:.6f}", "-i", video.name,
+            "-t", f"{splice_out - splice_in:.6f}",
+            "-map", "0:v",
+            "-c:v", "copy",
+            body_file,
+            "-y",
+        ]  # fmt: skip
+        add_segment(
+            "body",
+            "Copying talk video",
+            body_args,
+            title_end + splice_in - start_s,
+            splice_out - splice_in,
+        )
+        video_files.append(body_file)
+    else:
+        logger.info("Encoding talk in %d chunks.", len(splice_times) - 1)
+        for index, (chunk_in, chunk_out) in enumerate(
+            zip(splice_times, splice_times[1:])
+        ):
+            chunk_file = job_temp_dir / f"chunk{index:03d}.ts"
+            chunk_args = [
+                FFMPEG_BIN,
+                "-ss", f"{chunk_in:.6f}", "-to", f"{chunk_out:.6f}", "-i", video.name,
+                "-vf", f"settb=AVTB,fps={framerate:.2f},format=yuv420p",
+                "-map", "0:v",
+                *video_codec,
+                chunk_file,
+                "-y",
+            ]  # fmt: skip
+            add_segment(
+                f"chunk{index:03d}",
+                f"Encoding chunk {index + 1}/{len(splice_times) - 1}",
+                chunk_args,
+                title_end + chunk_in - start_s,
+                chunk_out - chunk_in,
+            )
+            video_files.append(chunk_file)
+
+    outro_file = job_temp_dir / "outro.ts"
+    outro_args = [
+        FFMPEG_BIN,
+        "-ss", f"{splice_out:.6f}", "-to", end_ts, "-i", video.name,  # 0
+        *slide_inputs,
+        "-filter_complex",
+        (
+            _slide_pads(framerate, [
+                (0, "yuv420p", "main"),
+                (6, "yuv420p", "end"),
+            ])
+            + "[main][end]xfade=offset={eb_start:.2f}:duration=1,fade=out:st={eb_end:.2f}:d={end_fade:.2f}[p1]".format(
+                eb_start=fade_offset - outro_offset,
+                eb_end=eb_end - outro_offset,
+                end_fade=end_fade,
+            )
+        ),
+        "-map", "[p1]:v",
+        *video_codec,
+        outro_file,
+        "-y",
+    ]  # fmt: skip
+    add_segment(
+        "outro",
+        "Rendering outro",
+        outro_args,
+        title_end + outro_offset - gap_s,
+        final_len_s - title_end - outro_offset,
+    )
+    video_files.append(outro_file)
+
+    # The audio is always filtered in one go, so fades and gain line up
+    audio_file = job_temp_dir / "audio.m4a"
+    if preview_s:
+        # Join the talk audio around the gap, so it lines up with the video
+        final_len_s -= gap_s
+        build["total"] = final_len_s
+        audio_args = [
+            FFMPEG_BIN,
+            "-ss", start_ts, "-to", f"{splice_in:.6f}", "-i", video.name,
+            "-ss", f"{splice_out:.6f}", "-to", end_ts, "-i", video.name,
+            "-filter_complex",
+            "[0:a][1:a]concat=n=2:v=0:a=1,"
+            + talk_audio_graph(afade_offset - gap_s, loudnorm),
+            "-map", "[a1]:a",
+            *audio_codec,
+            audio_file,
+            "-y",
+        ]  # fmt: skip
+    else:
+        audio_args = [
+            FFMPEG_BIN,
+            "-ss", start_ts, "-to", end_ts, "-i", video.name,
+            "-filter_complex", audio_graph,
+            "-map", "[a1]:a",
+            *audio_codec,
+            audio_file,
+            "-y",
+        ]  # fmt: skip
+    add_segment("audio", "Rendering audio", audio_args, 0, final_len_s)
+
+    concat_file = job_temp_dir / "segments.txt"
+    _write_concat_list(concat_file, video_files)
+
+    mux_args = [
+        FFMPEG_BIN,
+        "-f", "concat", "-safe", "0", "-i", concat_file,
+        "-i", audio_file,
+        "-map", "0:v",
+        "-map", "1:a",
         "-map_metadata", "-1",
         *metadata,
-        "-c:v", "h264",
-            "-crf", "16",
-            "-g", str(math.floor(framerate / 2)),
-            "-flags", "+cgop",
-        "-c:a", AAC_ENCODER,
-            "-ac", "2",
-            "-ar", "48000",
-            "-b:a", "128k",
-        "-r", str(framerate),
-        "-pix_fmt", "yuv420p",
+        "-c", "copy",
         "-movflags", "+faststart",
         output_path,
         "-y",
     ]  # fmt: skip
-    logger.info("Running main build.")
-    logger.debug(
-        "'" + ("' '".join(str(f).replace("'", "'\"'\"'") for f in ffmpeg_args)) + "'"
+    build["mux"] = _segment(
+        "Muxing",
+        mux_args,
+        build_log,
+        cwd=working_dir,
+        duration_s=final_len_s,
+        atomic=True,
     )
-    task.update_state(
-        state="Running main build", meta={"current": 0, "total": final_len_s}
+
+    if reuse:
+        _reuse_segments(build, reuse, logger)
+    return build
+
+
+def _measure_loudness(task, asset_cache, video, start_ts, end_ts, filters):
+    """Measure the loudness of the talk, cached by the source's contents and
+    the in and out points, so a rebuild doesn't have to."""
+    stats = os.stat(video)
+    key = assetcache.cache_key(
+        "loudness",
+        {"size": stats.st_size, "hash": ledger.partial_hash(video, stats.st_size)},
+        start_ts,
+        end_ts,
+        filters,
     )
-    with open(build_log, "a") as error_log:
-        for current_s in _run_ffmpeg(ffmpeg_args, stderr=error_log, cwd=working_dir):
-            current_s = min(current_s, final_len_s)
-            task.update_state(
-                state="Running main build",
-                meta={"current": current_s, "total": final_len_s},
-            )
+
+    def measure(path):
+        task.update_state(state="Measuring loudness")
+        measured = loudness.measure(video, start_ts, end_ts, filters, FFMPEG_BIN)
+        with open(path, "w") as f:
+            json.dump(measured, f)
+
+    with open(asset_cache.get(key, ".json", measure)) as f:
+        return json.load(f)
+
+
+def _reuse_segments(build, previous, logger):
+    """Drop the segments of ``build`` that the ``previous`` build already
+    rendered, linking its files in their place.
+
+    Only the title card differs between builds with the same content key,
+    so everything but the segments showing it is reused, and those too if
+    the title and presenter haven't changed. The mux always runs, for the
+    metadata, so a build without one (a single pass, writing the output
+    directly) reuses nothing.
+    """
+    if build["mux"] is None:
+        return
+    same_card = (previous["title"], previous["presenter"]) == (
+        build["title"],
+        build["presenter"],
+    )
+    segments = []
+    for segment in build["segments"]:
+        previous_file = previous.get("files", {}).get(segment["name"])
+        if (
+            (segment["name"] in CARD_SEGMENTS and not same_card)
+            or previous_file is None
+            or not os.path.exists(previous_file)
+        ):
+            segments.append(segment)
+            continue
+        logger.info("Reusing %s from an earlier build.", segment["name"])
+        Path(segment["output"]).unlink(missing_ok=True)
+        try:
+            os.link(previous_file, segment["output"])
+        except OSError:
+            shutil.copyfile(previous_file, segment["output"])
+    build["segments"] = segments
+
+
+def render_segment(task, build, index):
+    """Run one FFmpeg of a build planned by ``plan_build``."""
+    logger = FileLogger(task.request.id, build["task_log"])
+    segment = build["segments"][index]
+    # A segment running as its own task reports progress through itself,
+    # rather than through the build as a whole
+    _run_segment(
+        task,
+        segment,
+        logger,
+        progress=None if build["parallel"] else _progress_at(build, index),
+        manifest=build.get("manifest"),
+    )
+    return segment["output"]
+
+
+def merge_build(task, build):
+    """Join the segments of a build into its output file."""
+    logger = FileLogger(task.request.id, build["task_log"])
+    if build["mux"]:
+        _run_segment(task, build["mux"], logger, manifest=build.get("manifest"))
     logger.info("Completed main build.")
 
-    return str(output_path)
+    return build["output"]
+
+
+def run_build(task, build):
+    """Run every segment of a build in turn, then join them."""
+    for index in range(len(build["segments"])):
+        render_segment(task, build, index)
+    return merge_build(task, build)
+
+
+def form_video(task, *args, **kwargs):
+    return run_build(task, plan_build(task, *args, **kwargs))
+
+
+def _segment(state, ffmpeg_args, log, cwd=None, offset_s=0, duration_s=0, atomic=False):
+    """A planned FFmpeg run. With ``atomic``, its output is written under
+    ``PARTIAL_PREFIX`` and only renamed once it's complete."""
+    ffmpeg_args = [str(arg) for arg in ffmpeg_args]
+    # Every build FFmpeg writes its output just before "-y"
+    output = ffmpeg_args[-2]
+    partial = None
+    if atomic:
+        partial = str(Path(output).with_name(PARTIAL_PREFIX + Path(output).name))
+        ffmpeg_args[-2] = partial
+    return {
+        "state": state,
+        "args": ffmpeg_args,
+        "log": str(log),
+        "cwd": None if cwd is None else str(cwd),
+        "offset_s": offset_s,
+        "duration_s": duration_s,
+        "output": output,
+        "partial": partial,
+    }
+
+
+def _progress_at(plan, index):
+    """``(offset_s, total_s)`` to report the progress of running every
+    segment of ``plan`` in turn against, at the one at ``index``.
+
+    The segments' durations are added up, so progress only goes up, even
+    over a pass like the audio which covers the whole output again.
+    """
+    durations = [segment["duration_s"] for segment in plan["segments"]]
+    return sum(durations[:index]), sum(durations)
+
+
+def _run_segment(task, segment, logger, progress=None, manifest=None):
+    """Run a segment's FFmpeg, reporting progress through ``task``.
+
+    Progress is reported as ``(offset_s, total_s)`` (the work of a whole
+    build done before this segment, and all of it, see ``_progress_at``) if
+    given, or against the segment's own duration otherwise. With a
+    ``manifest``, the segment is skipped if it says it's already done, and
+    recorded there once it is.
+    """
+    offset_s, total_s = progress or (0, segment["duration_s"])
+
+    cwd = segment["cwd"] or "."
+    if manifest and _checkpointed(manifest, segment, cwd):
+        logger.info("%s: done before, skipping.", segment["state"])
+        return
+
+    logger.info("%s.", segment["state"])
+    logger.debug(_quote_args(segment["args"]))
+    with (
+        open(segment["log"], "a") as error_log,
+        ProgressReporter(task, segment["state"], total_s, offset_s) as progress,
+    ):
+        for sample in _run_ffmpeg(
+            segment["args"], stderr=error_log, cwd=segment["cwd"]
+        ):
+            progress.update(sample)
+    if segment.get("partial"):
+        os.replace(
+            os.path.join(cwd, segment["partial"]), os.path.join(cwd, segment["output"])
+        )
+    if manifest:
+        _checkpoint(manifest, segment, cwd)
+
+
+def _segment_key(segment):
+    return hashlib.sha256(json.dumps(segment["args"]).encode("utf-8")).hexdigest()
+
+
+def _checkpointed(manifest, segment, cwd):
+    """Whether ``manifest`` records the same FFmpeg run as ``segment`` having
+    finished, and its output is still there."""
+    output = os.path.join(cwd, segment["output"])
+    try:
+        size = os.path.getsize(output)
+        with open(manifest) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return False
+    key = _segment_key(segment)
+    for line in lines:
+        try:
+            done = json.loads(line)
+        except ValueError:  # Cut short by a crash
+            continue
+        if done == {"output": output, "key": key, "size": size}:
+            return True
+    return False
+
+
+def _checkpoint(manifest, segment, cwd):
+    output = os.path.join(cwd, segment["output"])
+    try:
+        size = os.path.getsize(output)
+    except FileNotFoundError:  # e.g. an HLS pattern, so can't be checked
+        return
+    done = {"output": output, "key": _segment_key(segment), "size": size}
+    # One short append, so workers finishing segments at once don't interleave
+    with open(manifest, "a") as f:
+        f.write(json.dumps(done) + "\n")
+
+
+def clean_temp(
+    temp_dir, keep=(), partial_dirs=(), max_age_s=TEMP_MAX_AGE_S, finished=None
+):
+    """Remove the folders in ``temp_dir``, other than those named in
+    ``keep``, and the partial outputs in ``partial_dirs``, that nothing has
+    written to for ``max_age_s``. Returns the paths removed.
+
+    ``finished`` maps the folders of finished jobs to the names of the files
+    in them worth keeping; everything else in those is removed straight away.
+    """
+    now = time.time()
+    removed = []
+    keep = {ASSET_DIR, *keep}
+    finished = finished or {}
+    try:
+        job_dirs = [entry for entry in os.scandir(temp_dir) if entry.is_dir()]
+    except FileNotFoundError:
+        job_dirs = []
+    for entry in job_dirs:
+        if entry.name in keep:
+            continue
+        if finished.get(entry.name):
+            removed.extend(_clean_finished(entry.path, finished[entry.name]))
+            continue
+        if entry.name not in finished and now - _newest_mtime(entry.path) < max_age_s:
+            continue
+        logger.info("Removing old temp folder %s", entry.path)
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed.append(entry.path)
+
+    for partial_dir in partial_dirs:
+        try:
+            entries = list(os.scandir(partial_dir))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if (
+                entry.name.startswith(PARTIAL_PREFIX)
+                and now - entry.stat().st_mtime >= max_age_s
+            ):
+                logger.info("Removing partial output %s", entry.path)
+                Path(entry.path).unlink(missing_ok=True)
+                removed.append(entry.path)
+    return removed
+
+
+def _clean_finished(path, keep_files):
+    """Remove everything in a finished job's folder but ``keep_files``."""
+    removed = []
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if root == path and name in keep_files:
+                continue
+            Path(file_path).unlink(missing_ok=True)
+            removed.append(file_path)
+        for name in dirs:
+            try:
+                os.rmdir(os.path.join(root, name))
+            except OSError:
+                pass
+    if removed:
+        logger.info("Removed %d files not worth keeping from %s", len(removed), path)
+    return removed
+
+
+def _newest_mtime(path):
+    newest = os.stat(path).st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                newest = max(newest, os.stat(os.path.join(root, name)).st_mtime)
+            except FileNotFoundError:
+                pass
+    return newest
+
+
+class ProgressReporter:
+    """Reports the progress of an FFmpeg run through ``task``.
+
+    Updates are sent at most every ``PROGRESS_INTERVAL_S``, and only once the
+    run has moved on by ``PROGRESS_MIN_STEP``, so long encodes don't flood
+    the result backend. The latest progress is always sent on leaving the
+    ``with`` block, whether the run finished or failed.
+    """
+
+    def __init__(self, task, state, total_s, offset_s=0):
+        self.task = task
+        self.state = state
+        self.total_s = total_s
+        self.offset_s = offset_s
+        self.meta = {"current": offset_s, "total": total_s}
+        self._sent_at = None
+        self._sent_s = None
+
+    def __enter__(self):
+        self._send()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._sent_s != self.meta["current"]:
+            self._send()
+
+    def update(self, sample):
+        current_s = min(self.offset_s + sample["out_time_s"], self.total_s)
+        self.meta = {
+            "current": current_s,
+            "total": self.total_s,
+            "fps": sample["fps"],
+            "speed": sample["speed"],
+            "bitrate_kbps": sample["bitrate_kbps"],
+            "eta_s": (
+                (self.total_s - current_s) / sample["speed"]
+                if sample["speed"]
+                else None
+            ),
+        }
+        if (
+            time.monotonic() - self._sent_at >= PROGRESS_INTERVAL_S
+            and current_s - self._sent_s >= PROGRESS_MIN_STEP * self.total_s
+        ):
+            self._send()
+
+    def _send(self):
+        self.task.update_state(state=self.state, meta=self.meta)
+        self._sent_at = time.monotonic()
+        self._sent_s = self.meta["current"]
+
+
+def _quote_args(args):
+    return "'" + ("' '".join(str(f).replace("'", "'\"'\"'") for f in args)) + "'"
+
+
+def _slide_pads(framerate, pads):
+    """Filters normalising each ``(input, pix_fmt, label)`` onto a named pad."""
+    return "".join(
+        f"[{idx}:v]settb=AVTB,fps={framerate:.2f},format={pix_fmt}[{label}];"
+        for idx, pix_fmt, label in pads
+    )
 
 
 def _run_ffmpeg(ffmpeg_args, **kwargs):
-    ffmpeg_args = list(ffmpeg_args)
+    """Run FFmpeg, yielding a sample from each report on its progress pipe
+    (see ``_progress_sample``)."""
+    with cores.reserving():
+        yield from _run_reserved_ffmpeg(ffmpeg_args, **kwargs)
+
+
+def _run_reserved_ffmpeg(ffmpeg_args, **kwargs):
+    ffmpeg_args = cores.ffmpeg_args(ffmpeg_args)
     pipe_r_fd, pipe_w_fd = os.pipe()
     pipe_r = os.fdopen(pipe_r_fd, "rb", buffering=0)
     ffmpeg_args += ["-progress", f"pipe:{pipe_w_fd}"]
-    with subprocess.Popen(ffmpeg_args, pass_fds=[pipe_w_fd], **kwargs) as proc:
+    with subprocess.Popen(
+        ffmpeg_args, pass_fds=[pipe_w_fd], **cores.popen_kwargs(), **kwargs
+    ) as proc:
         os.close(pipe_w_fd)
         threading.Thread(target=_close_on_exit, args=[proc, pipe_r]).start()
+        report = {}
         for ln in pipe_r:
             ln = ln.strip().decode("utf-8")
             if "=" not in ln:
                 continue
             key, _, value = ln.partition("=")
-            if key != "out_time_us" or value == "N/A":
+            report[key] = value
+            # Each report ends with progress=continue, or progress=end
+            if key != "progress":
                 continue
-            try:
-                yield int(value) / 1000000.0
-            except ValueError:
-                logger.warning("Invalid out_time_us from ffmpeg: %s", ln)
+            sample = _progress_sample(report)
+            report = {}
+            if sample is not None:
+                yield sample
     if proc.returncode != 0:
         raise subprocess.CalledProcessError(returncode=proc.returncode, cmd=ffmpeg_args)
 
 
+def _progress_sample(report):
+    """Pick the numbers out of one FFmpeg progress report.
+
+    Returns ``None`` if it doesn't say how far through the output FFmpeg is,
+    or a dict of ``out_time_s`` and, where FFmpeg knows them, the encoding
+    ``fps``, ``speed`` (as a multiple of realtime) and ``bitrate_kbps``.
+    """
+    try:
+        out_time_s = int(report.get("out_time_us", "N/A")) / 1000000.0
+    except ValueError:
+        return None
+
+    def number(key, unit=""):
+        try:
+            return float(report.get(key, "N/A").strip().removesuffix(unit))
+        except ValueError:
+            return None
+
+    return {
+        "out_time_s": out_time_s,
+        "fps": number("fps"),
+        "speed": number("speed", "x"),
+        "bitrate_kbps": number("bitrate", "kbits/s"),
+    }
+
+
 def _close_on_exit(proc, f):
     proc.wait()
     f.close()
 
 
-def _video_duration_seconds(fn):
+def _video_duration_seconds(fn, probe_cache=None):
+    return probe.duration_seconds(_probe_video(fn, probe_cache))
+
+
+def _probe_video(fn, probe_cache=None):
+    return probe.probe(fn, probe_cache, FFPROBE_BIN)
+
+
+def _keyframe_times(fn, read_intervals):
     ffprobe_args = [
         FFPROBE_BIN,
         "-v", "quiet",
-        "-print_format", "json",
-        "-show_format",
+        "-select_streams", "v:0",
+        "-read_intervals", read_intervals,
+        "-show_entries", "packet=pts_time,flags",
+        "-print_format", "csv=print_section=0",
         str(fn),
     ]  # fmt: skip
-    ffprobe_result = subprocess.check_output(ffprobe_args)
-    ffprobe_result_dict = json.loads(ffprobe_result)
-    return float(ffprobe_result_dict["format"]["duration"])
+    ffprobe_result = subprocess.check_output(ffprobe_args).decode("utf-8")
+    keyframes = []
+    for ln in ffprobe_result.splitlines():
+        pts_time, _, flags = ln.strip().partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    return sorted(keyframes)
+
+
+def _plan_splices(
+    fn, intro_min_s, outro_max_s, chunk_s=0, framerate=FRAMERATE, probe_cache=None
+):
+    """Pick the points to split the talk video of a build at.
+
+    Returns ``(copyable, splices)``, where ``splices`` are times in seconds
+    from the start of ``fn``: the first at or after ``intro_min_s``, the last
+    at or before ``outro_max_s`` and, if ``chunk_s`` is set, one roughly every
+    ``chunk_s`` in between. Splices are moved onto nearby keyframes where
+    there are any. ``copyable`` is True if the video between the first and
+    last splice can be stream copied into a build. Returns ``None`` if there's
+    no video between the intro and outro.
+    """
+    probed = _probe_video(fn, probe_cache)
+    stream = probe.video_stream(probed)
+    spliceable = (
+        stream.get("codec_name") == "h264"
+        and stream.get("pix_fmt") == "yuv420p"
+        and (stream.get("width"), stream.get("height")) == (1920, 1080)
+        and stream.get("avg_frame_rate") == f"{framerate}/1"
+    )
+
+    targets = [intro_min_s]
+    while chunk_s and targets[-1] + chunk_s < outro_max_s:
+        targets.append(targets[-1] + chunk_s)
+    windows = [(target, target + KEYFRAME_SEARCH_S) for target in targets]
+    windows.append((outro_max_s - KEYFRAME_SEARCH_S, outro_max_s))
+
+    # Packet timestamps (and -read_intervals) include the container start time
+    start_time = float(probed.get("format", {}).get("start_time", 0))
+    keyframes = [
+        round((k - start_time) * framerate) / framerate
+        for k in _keyframe_times(
+            fn,
+            ",".join(f"{start_time + a:.6f}%{start_time + b:.6f}" for a, b in windows),
+        )
+    ]
+
+    # Only the first and last splice need to be on keyframes to copy between
+    splices = []
+    copyable = spliceable
+    for target in targets:
+        keyframe = min(
+            (k for k in keyframes if target <= k <= target + KEYFRAME_SEARCH_S),
+            default=None,
+        )
+        if keyframe is None:
+            copyable = copyable and len(splices) > 0
+            keyframe = math.ceil(target * framerate) / framerate
+        splices.append(keyframe)
+
+    splice_out = max(
+        (k for k in keyframes if outro_max_s - KEYFRAME_SEARCH_S <= k <= outro_max_s),
+        default=None,
+    )
+    if splice_out is None:
+        copyable = False
+        splice_out = math.floor(outro_max_s * framerate) / framerate
 
+    splices = sorted(set(k for k in splices if k < splice_out))
+    if not splices:
+        return None
+    return (copyable, splices + [splice_out])
 
-def ingest_video(task, input_path, output_dir, framerate=FRAMERATE, log_dir=LOG_DIR):
+
+def plan_ingest(
+    task,
+    input_path,
+    output_dir,
+    framerate=FRAMERATE,
+    log_dir=LOG_DIR,
+    temp_dir=TEMP_DIR,
+    parallel_chunk_s=0,
+    probe_cache=None,
+    proxy_dir=None,
+    proxy_height=PROXY_HEIGHT,
+    hls_dir=None,
+    hls_ladder=HLS_LADDER,
+    scrub_dir=None,
+    thumb_interval_s=scrub.THUMB_INTERVAL_S,
+    profile=INGEST_PROFILE,
+    job_id=None,
+    checkpoint_s=0,
+):
+    """Plan the FFmpeg runs to ingest a raw recording.
+
+    Like ``plan_build``, returns a JSON-serialisable plan. With
+    ``parallel_chunk_s`` set, the video is encoded in chunks of that many
+    seconds which can run in parallel, alongside a single audio encode (the
+    loudness processing is stateful, so can't be split), and ``merge_ingest``
+    joins them. With ``proxy_dir`` set, the same FFmpeg runs also write a
+    small, short-GOP copy there for the log page to play. With ``hls_dir``
+    set, they also encode the renditions of an HLS package there, see
+    ``_plan_hls``, and with ``scrub_dir`` set, thumbnail sprites and waveform peaks for the log
+    page's timeline are written to a folder there named after the video.
+    ``profile`` is the encoder settings, and ``job_id`` and ``checkpoint_s``
+    make it resumable, as for ``plan_build``.
+    """
     input_path = Path(input_path)
 
     job_log_dir = Path(log_dir) / str(task.request.id)
@@ -415,57 +1439,538 @@ def ingest_video(task, input_path, output_dir, framerate=FRAMERATE, log_dir=LOG_
         Path(output_dir, os.path.splitext(input_file)[0] + ".mp4")
     )
 
-    final_len_s = _video_duration_seconds(input_path)
+    final_len_s = _video_duration_seconds(input_path, probe_cache)
+    chunk_s = parallel_chunk_s or checkpoint_s
 
-    ffmpeg_args = [
-        FFMPEG_BIN,
-        "-i", str(input_path),
-        "-vf", "bwdif",
-        "-filter_complex",
-        (
-            "[0:a]channelsplit=channels=FL+FR,"
-            "join=inputs=2:channel_layout=stereo,"
-            "adelay=250:all=1,"
-            "aresample=async=1,"
-            "dynaudnorm=maxgain=80,"
-            "ladspa=f=master_me-ladspa:p=master_me:controls=c1=-16|c22=21|c59=-3[a]"
-        ),
-        "-map", "0:v",
-        "-map", "[a]",
+    proxy_path = None
+    if proxy_dir:
+        proxy_path = Path(proxy_dir) / output_path.name
+        proxy_path.parent.mkdir(parents=True, exist_ok=True)
+
+    log_path = job_log_dir / f"{input_file}{start_timestamp}.log"
+
+    audio_graph = (
+        "[0:a]channelsplit=channels=FL+FR,"
+        "join=inputs=2:channel_layout=stereo,"
+        "adelay=250:all=1,"
+        "aresample=async=1,"
+        "dynaudnorm=maxgain=80,"
+        "ladspa=f=master_me-ladspa:p=master_me:controls=c1=-16|c22=21|c59=-3[a]"
+    )
+
+    video_codec = _video_codec(profile, framerate, "-s", "1920x1080")
+    audio_codec = _audio_codec(profile)
+
+    # Keyframes every few frames, so the log page can seek accurately
+    proxy_codec = [
         "-c:v", "h264",
-            "-crf", "12",
-            "-g", str(math.floor(framerate / 2)),
-            "-flags", "+cgop",
-            "-s", "1920x1080",
-        # "-c:v", "h264_nvenc", "-b:v", "12M",
-        "-c:a", AAC_ENCODER,
-            "-ac", "2",
-            "-ar", "48000",
-            "-b:a", "128k",
+            "-preset", "veryfast",
+            "-crf", "26",
+            "-g", str(math.floor(framerate / 5)),
         "-r", str(framerate),
         "-pix_fmt", "yuv420p",
+    ]  # fmt: skip
+
+    job_temp_dir = Path(temp_dir).resolve() / INGEST_JOB_DIR.format(
+        job_id or task.request.id
+    )
+
+    plan = {
+        "task_id": str(task.request.id),
+        "input": str(input_path),
+        "output": str(output_path),
+        "proxy": str(proxy_path) if proxy_path else None,
+        "total": final_len_s,
+        "parallel": bool(parallel_chunk_s) and final_len_s > chunk_s,
+        "segments": [],
+        "mux": None,
+        "manifest": None,
+        "hls": None,
+        "scrub": None,
+    }
+    if hls_dir:
+        job_temp_dir.mkdir(parents=True, exist_ok=True)
+        plan["hls"] = _plan_hls(output_path, hls_dir, hls_ladder, job_temp_dir)
+    if scrub_dir:
+        # The encodes also write the timeline's thumbnails and audio, so it
+        # takes no decode of its own
+        output_scrub_dir = Path(scrub_dir) / output_path.stem
+        output_scrub_dir.mkdir(parents=True, exist_ok=True)
+        plan["scrub"] = {
+            "dir": str(output_scrub_dir),
+            "interval": thumb_interval_s,
+            "thumbs": [],
+            "thumb_list": None,
+            "tile": None,
+        }
+
+    if not chunk_s or final_len_s <= chunk_s:
+        if proxy_path or plan["hls"] or plan["scrub"]:
+            # The proxy, HLS renditions and timeline come off splits of the
+            # main video and audio, and the main output goes last, so it's
+            # the segment's
+            video_pads, audio_pads, graph, outputs = ["v"], ["amain"], "", []
+            if proxy_path:
+                video_pads.append("vp")
+                audio_pads.append("aproxy")
+                graph += f";[vp]scale=-2:{proxy_height}[vproxy]"
+                outputs += [
+                    "-map", "[vproxy]",
+                    "-map", "[aproxy]",
+                    *proxy_codec,
+                    *audio_codec,
+                    "-movflags", "+faststart",
+                    proxy_path,
+                ]  # fmt: skip
+            if plan["hls"]:
+                video_pads.append("vhls")
+                audio_pads.append("ahls")
+                hls_graph, hls_outputs = _hls_video_outputs(
+                    plan["hls"], "vhls", framerate, "all"
+                )
+                graph += f";{hls_graph}"
+                outputs += [
+                    *hls_outputs,
+                    *_hls_audio_output(plan["hls"], "ahls", audio_codec),
+                ]
+            if plan["scrub"]:
+                video_pads.append("vs")
+                audio_pads.append("ascrub")
+                graph += (
+                    f";[vs]{scrub.thumb_filter(thumb_interval_s)},"
+                    f"tile={scrub.SPRITE_COLUMNS}x{scrub.SPRITE_ROWS}[vscrub]"
+                )
+                outputs += [
+                    *scrub.sprite_output("vscrub", output_scrub_dir),
+                    *scrub.pcm_output("ascrub", output_scrub_dir),
+                ]
+            ffmpeg_args = [
+                FFMPEG_BIN,
+                "-i", str(input_path),
+                "-filter_complex", (
+                    f"[0:v]bwdif,{_split('split', video_pads)};"
+                    f"{audio_graph};[a]{_split('asplit', audio_pads)}{graph}"
+                ),
+                *outputs,
+                "-map", "[v]",
+                "-map", "[amain]",
+                *video_codec,
+                *audio_codec,
+                "-movflags", "+faststart",
+                output_path,
+                "-y",
+            ]  # fmt: skip
+        else:
+            ffmpeg_args = [
+                FFMPEG_BIN,
+                "-i", str(input_path),
+                "-vf", "bwdif",
+                "-filter_complex", audio_graph,
+                "-map", "0:v",
+                "-map", "[a]",
+                *video_codec,
+                *audio_codec,
+                "-movflags", "+faststart",
+                output_path,
+                "-y",
+            ]  # fmt: skip
+        plan["segments"].append(
+            _segment(
+                "Ingesting...",
+                ffmpeg_args,
+                log_path,
+                duration_s=final_len_s,
+                atomic=True,
+            )
+        )
+        return plan
+
+    job_temp_dir.mkdir(parents=True, exist_ok=True)
+    plan["manifest"] = str(job_temp_dir / MANIFEST_FILE)
+
+    chunk_count = math.ceil(final_len_s / chunk_s)
+    chunk_files = []
+    proxy_chunk_files = []
+    if plan["scrub"]:
+        # Each chunk writes its own thumbnails, which merge_ingest tiles
+        thumb_list = job_temp_dir / "thumbs.txt"
+        plan["scrub"]["thumb_list"] = str(thumb_list)
+        plan["scrub"]["tile"] = _segment(
+            "Making timeline",
+            scrub.tile_args(thumb_list, output_scrub_dir, FFMPEG_BIN),
+            log_path,
+        )
+    for index in range(chunk_count):
+        chunk_in = index * chunk_s
+        chunk_len = min(chunk_s, final_len_s - chunk_in)
+        # Start decoding a little early so bwdif has the previous fields to
+        # work from, then trim the lead-in off after deinterlacing
+        seek = max(0, chunk_in - INGEST_OVERLAP_S)
+        trim = f"trim=start={chunk_in - seek:.6f}"
+        if index < chunk_count - 1:
+            trim += f":duration={chunk_len:.6f}"
+        chunk_file = job_temp_dir / f"chunk{index:03d}.ts"
+        chunk_args = [
+            FFMPEG_BIN,
+            "-ss", f"{seek:.6f}", "-i", str(input_path),
+            "-vf", f"bwdif,{trim},setpts=PTS-STARTPTS",
+            "-map", "0:v",
+            *video_codec,
+            chunk_file,
+            "-y",
+        ]  # fmt: skip
+        if proxy_path or plan["hls"] or plan["scrub"]:
+            video_pads, graph, outputs = ["v"], "", []
+            if proxy_path:
+                proxy_chunk_file = job_temp_dir / f"proxy{index:03d}.ts"
+                proxy_chunk_files.append(proxy_chunk_file)
+                video_pads.append("vp")
+                graph += f";[vp]scale=-2:{proxy_height}[vproxy]"
+                outputs += ["-map", "[vproxy]", *proxy_codec, proxy_chunk_file]
+            if plan["hls"]:
+                # Each chunk's renditions carry on the timestamps of the one
+                # before, so merge_ingest just joins their playlists
+                video_pads.append("vhls")
+                hls_graph, hls_outputs = _hls_video_outputs(
+                    plan["hls"], "vhls", framerate, f"chunk{index:03d}", chunk_in
+                )
+                graph += f";{hls_graph}"
+                outputs += hls_outputs
+            if plan["scrub"]:
+                # Picking the thumbnails due in this chunk, on the same
+                # times as the chunks around it, into a folder named for its
+                # times so none are left over from differently sized chunks
+                thumb_dir = job_temp_dir / f"thumbs{chunk_in:.3f}-{chunk_len:.3f}"
+                thumb_dir.mkdir(parents=True, exist_ok=True)
+                plan["scrub"]["thumbs"].append(str(thumb_dir))
+                first_s = -chunk_in % thumb_interval_s
+                video_pads.append("vs")
+                graph += f";[vs]{scrub.thumb_filter(thumb_interval_s, first_s)}[vscrub]"
+                outputs += [
+                    "-map", "[vscrub]",
+                    "-q:v", "5",
+                    thumb_dir / "%05d.jpg",
+                ]  # fmt: skip
+            chunk_args = [
+                FFMPEG_BIN,
+                "-ss", f"{seek:.6f}", "-i", str(input_path),
+                "-filter_complex", (
+                    f"[0:v]bwdif,{trim},setpts=PTS-STARTPTS,"
+                    f"{_split('split', video_pads)}{graph}"
+                ),
+                *outputs,
+                "-map", "[v]",
+                *video_codec,
+                chunk_file,
+                "-y",
+            ]  # fmt: skip
+        plan["segments"].append(
+            _segment(
+                f"Ingesting chunk {index + 1}/{chunk_count}",
+                chunk_args,
+                job_log_dir / f"chunk{index:03d}_ingest.log",
+                offset_s=chunk_in,
+                duration_s=chunk_len,
+            )
+        )
+        chunk_files.append(chunk_file)
+
+    audio_file = job_temp_dir / "audio.m4a"
+    audio_args = [
+        FFMPEG_BIN,
+        "-i", str(input_path),
+        "-filter_complex", audio_graph,
+        "-map", "[a]",
+        *audio_codec,
+        audio_file,
+        "-y",
+    ]  # fmt: skip
+    if plan["hls"] or plan["scrub"]:
+        audio_pads, outputs = ["amain"], []
+        if plan["hls"]:
+            audio_pads.append("ahls")
+            outputs += _hls_audio_output(plan["hls"], "ahls", audio_codec)
+        if plan["scrub"]:
+            audio_pads.append("ascrub")
+            outputs += scrub.pcm_output("ascrub", output_scrub_dir)
+        audio_args = [
+            FFMPEG_BIN,
+            "-i", str(input_path),
+            "-filter_complex", f"{audio_graph};[a]{_split('asplit', audio_pads)}",
+            *outputs,
+            "-map", "[amain]",
+            *audio_codec,
+            audio_file,
+            "-y",
+        ]  # fmt: skip
+    plan["segments"].append(
+        _segment(
+            "Ingesting audio",
+            audio_args,
+            job_log_dir / "audio_ingest.log",
+            duration_s=final_len_s,
+        )
+    )
+
+    concat_file = job_temp_dir / "chunks.txt"
+    _write_concat_list(concat_file, chunk_files)
+
+    mux_args = [
+        FFMPEG_BIN,
+        "-f", "concat", "-safe", "0", "-i", concat_file,
+        "-i", audio_file,
+        "-map", "0:v",
+        "-map", "1:a",
+        "-c", "copy",
         "-movflags", "+faststart",
         output_path,
         "-y",
     ]  # fmt: skip
+    if proxy_path:
+        proxy_concat_file = job_temp_dir / "proxies.txt"
+        _write_concat_list(proxy_concat_file, proxy_chunk_files)
+        mux_args = [
+            FFMPEG_BIN,
+            "-f", "concat", "-safe", "0", "-i", concat_file,
+            "-f", "concat", "-safe", "0", "-i", proxy_concat_file,
+            "-i", audio_file,
+            "-map", "1:v",
+            "-map", "2:a",
+            "-c", "copy",
+            "-movflags", "+faststart",
+            proxy_path,
+            "-map", "0:v",
+            "-map", "2:a",
+            "-c", "copy",
+            "-movflags", "+faststart",
+            output_path,
+            "-y",
+        ]  # fmt: skip
+    plan["mux"] = _segment(
+        "Joining chunks", mux_args, log_path, duration_s=final_len_s, atomic=True
+    )
 
-    logger.debug(ffmpeg_args)
+    return plan
+
+
+def _plan_hls(output_path, hls_dir, ladder, playlist_dir):
+    """Plan an HLS package of ``output_path`` in ``hls_dir``, with a video
+    rendition per ``(height, bitrate)`` of ``ladder`` and one of the audio.
+
+    The ingest FFmpegs encode the renditions alongside the main output, see
+    ``_hls_video_outputs`` and ``_hls_audio_output``, writing the segments in
+    a folder named after the video, and a playlist for their part of each
+    rendition in ``playlist_dir``. Once they're all done, ``_write_hls``
+    joins those, and writes the master playlist next to the folder so the
+    library lists it.
+    """
+    package_dir = Path(hls_dir) / output_path.stem
+    package_dir.mkdir(parents=True, exist_ok=True)
+    return {
+        "index": str(Path(hls_dir) / output_path.with_suffix(".m3u8").name),
+        "dir": str(package_dir),
+        "playlist_dir": str(playlist_dir),
+        "ladder": [list(rendition) for rendition in ladder],
+        "audio_bitrate": None,
+        "parts": [],
+    }
 
-    log_path = job_log_dir / f"{input_file}{start_timestamp}.log"
 
-    with open(log_path, "w+") as error_log:
-        for current_s in _run_ffmpeg(ffmpeg_args, stderr=error_log):
-            current_s = min(current_s, final_len_s)
-            task.update_state(
-                state="Ingesting...", meta={"current": current_s, "total": final_len_s}
-            )
+def _split(split_filter, pads):
+    """A ``split_filter`` (``split`` or ``asplit``) onto each of ``pads``."""
+    return f"{split_filter}={len(pads)}" + "".join(f"[{pad}]" for pad in pads)
+
+
+def _hls_muxer(hls, name, offset_s=0):
+    """FFmpeg output options writing an HLS rendition part ``name``, with
+    its timestamps starting ``offset_s`` in."""
+    return [
+        "-output_ts_offset", f"{offset_s:.6f}",
+        "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_S),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_type", "mpegts",
+            "-hls_segment_filename", Path(hls["dir"]) / f"{name}_%05d.ts",
+        Path(hls["playlist_dir"]) / f"{name}.m3u8",
+    ]  # fmt: skip
 
-    # Move to processed
+
+def _hls_video_outputs(hls, pad, framerate, part, offset_s=0):
+    """Filters scaling the video on ``pad`` to each rendition of ``hls``,
+    and the FFmpeg outputs encoding them as ``part`` of the package,
+    starting ``offset_s`` in. Returns ``(filters, outputs)``."""
+    hls["parts"].append(part)
+    ladder = hls["ladder"]
+    scaled = [f"{pad}{i}" for i in range(len(ladder))]
+    graph = f"[{pad}]{_split('split', scaled)}"
+    # Keyframes on segment boundaries, so every rendition splits alike
+    gop = str(math.floor(framerate * 2))
+    outputs = []
+    for i, (height, bitrate) in enumerate(ladder):
+        graph += f";[{scaled[i]}]scale=-2:{height}[{scaled[i]}out]"
+        outputs += [
+            "-map", f"[{scaled[i]}out]",
+            "-c:v", "h264",
+                "-preset", "veryfast",
+                "-b:v", bitrate,
+                "-maxrate:v", bitrate,
+                "-bufsize:v", _double_bitrate(bitrate),
+                "-g", gop,
+                "-keyint_min", gop,
+                "-sc_threshold", "0",
+            "-r", str(framerate),
+            "-pix_fmt", "yuv420p",
+            *_hls_muxer(hls, f"stream_{i}_{part}", offset_s),
+        ]  # fmt: skip
+    return graph, outputs
+
+
+def _hls_audio_output(hls, pad, audio_codec):
+    """The FFmpeg output encoding the audio on ``pad`` as the audio
+    rendition of ``hls``, which is always made in one go."""
+    hls["audio_bitrate"] = audio_codec[audio_codec.index("-b:a") + 1]
+    return ["-map", f"[{pad}]", *audio_codec, *_hls_muxer(hls, "audio")]
+
+
+def _double_bitrate(bitrate):
+    """Twice an FFmpeg bitrate like ``"800k"``, for the rate control buffer."""
+    if bitrate[-1:].isalpha():
+        return f"{float(bitrate[:-1]) * 2:g}{bitrate[-1]}"
+    return str(int(float(bitrate) * 2))
+
+
+def _bitrate_bps(bitrate):
+    """An FFmpeg bitrate like ``"800k"`` in bits per second."""
+    multipliers = {"k": 1000, "M": 1000**2, "G": 1000**3}
+    if bitrate[-1:] in multipliers:
+        return round(float(bitrate[:-1]) * multipliers[bitrate[-1]])
+    return round(float(bitrate))
+
+
+def _read_hls_entries(playlist_path):
+    """The ``(duration, segment name)`` of each segment in a playlist."""
+    with open(playlist_path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return [
+        (float(line[len("#EXTINF:") :].split(",")[0]), os.path.basename(uri))
+        for line, uri in zip(lines, lines[1:])
+        if line.startswith("#EXTINF:")
+    ]
+
+
+def _write_playlist(path, lines):
+    tmp_path = Path(path).with_name(f"{Path(path).name}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def _write_hls(hls):
+    """Join the playlists of each part of the renditions of ``hls`` into
+    one per rendition, then write the master playlist, once every FFmpeg
+    making the package is done."""
+    package_dir = Path(hls["dir"])
+    playlist_dir = Path(hls["playlist_dir"])
+    names = {f"stream_{i}": hls["parts"] for i in range(len(hls["ladder"]))}
+    names["audio"] = [None]
+    for name, parts in names.items():
+        entries = []
+        for part in parts:
+            part_name = f"{name}_{part}" if part else name
+            entries += _read_hls_entries(playlist_dir / f"{part_name}.m3u8")
+        target_s = math.ceil(max(duration for duration, _ in entries))
+        _write_playlist(
+            package_dir / f"{name}.m3u8",
+            [
+                "#EXTM3U",
+                "#EXT-X-VERSION:3",
+                f"#EXT-X-TARGETDURATION:{target_s}",
+                "#EXT-X-MEDIA-SEQUENCE:0",
+                "#EXT-X-PLAYLIST-TYPE:VOD",
+                *(
+                    line
+                    for duration, uri in entries
+                    for line in (f"#EXTINF:{duration:.6f},", uri)
+                ),
+                "#EXT-X-ENDLIST",
+            ],
+        )
+
+    audio_bps = _bitrate_bps(hls["audio_bitrate"])
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:4",
+        '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="Audio",DEFAULT=YES,'
+        f'AUTOSELECT=YES,URI="{package_dir.name}/audio.m3u8"',
+    ]
+    for i, (_, bitrate) in enumerate(hls["ladder"]):
+        lines += [
+            f'#EXT-X-STREAM-INF:BANDWIDTH={_bitrate_bps(bitrate) + audio_bps},AUDIO="audio"',
+            f"{package_dir.name}/stream_{i}.m3u8",
+        ]
+    _write_playlist(hls["index"], lines)
+
+
+def _write_concat_list(concat_file, files):
+    with open(concat_file, "w") as f:
+        for file in files:
+            f.write("file '{}'\n".format(str(file).replace("'", "'\\''")))
+
+
+def render_ingest_segment(task, plan, index):
+    """Run one FFmpeg of an ingest planned by ``plan_ingest``."""
+    segment = plan["segments"][index]
+    _run_segment(
+        task,
+        segment,
+        logger,
+        progress=None if plan["parallel"] else _progress_at(plan, index),
+        manifest=plan.get("manifest"),
+    )
+    return segment["output"]
+
+
+def merge_ingest(task, plan):
+    """Join the segments of an ingest, write its HLS playlists and make its
+    timeline if planned, and move the input to processed."""
+    if plan["mux"]:
+        _run_segment(task, plan["mux"], logger, manifest=plan.get("manifest"))
+    if plan["hls"]:
+        _write_hls(plan["hls"])
+    if plan["scrub"]:
+        if plan["scrub"]["tile"]:
+            thumbs = [
+                thumb
+                for thumb_dir in plan["scrub"]["thumbs"]
+                for thumb in sorted(Path(thumb_dir).glob("*.jpg"))
+            ]
+            _write_concat_list(plan["scrub"]["thumb_list"], thumbs)
+            _run_segment(task, plan["scrub"]["tile"], logger)
+        scrub.write_index(
+            plan["scrub"]["dir"], plan["total"], plan["scrub"]["interval"]
+        )
+
+    move_to_processed(plan["input"])
+    return plan["output"]
+
+
+def move_to_processed(input_file):
+    """Move an ingested file into the Processed folder next to it."""
+    input_path = Path(input_file)
     proc_folder = input_path.parent / "Processed"
     proc_folder.mkdir(parents=True, exist_ok=True)
     shutil.move(input_path, proc_folder / input_path.name)
 
-    return str(output_path)
+
+def run_ingest(task, plan):
+    """Run every segment of an ingest in turn, then join them."""
+    for index in range(len(plan["segments"])):
+        render_ingest_segment(task, plan, index)
+    return merge_ingest(task, plan)
+
+
+def ingest_video(task, *args, **kwargs):
+    return run_ingest(task, plan_ingest(task, *args, **kwargs))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+"""Batched updates to the talk records in a Grist table"""
+
+import json
+import logging
+
+import requests
+
+from .results import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Redis list of updates still to be sent
+PENDING_KEY = "hackyplayer:grist:pending"
+REQUEST_TIMEOUT = 30
+
+# (table_url, key) -> GristClient, so each process keeps its connections and
+# record IDs between tasks
+_clients = {}
+
+
+class GristClient:
+    """Patches records in a Grist table, found by their ``id2`` talk ID."""
+
+    def __init__(self, table_url, key):
+        self.table_url = table_url
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {key}"})
+        # Talk ID -> Grist row ID
+        self.record_ids = {}
+
+    def find_records(self, talk_ids):
+        """Look up the row IDs of any talks that aren't already known."""
+        missing = [str(talk_id) for talk_id in talk_ids]
+        missing = [talk_id for talk_id in missing if talk_id not in self.record_ids]
+        if not missing:
+            return
+
+        # id2 may be stored as a number or text, so ask for both
+        values = missing + [int(talk_id) for talk_id in missing if talk_id.isdigit()]
+        resp = self.session.get(
+            self.table_url,
+            params={"filter": json.dumps({"id2": values})},
+            timeout=REQUEST_TIMEOUT,
+        )
+        resp.raise_for_status()
+        for record in resp.json()["records"]:
+            self.record_ids[str(record["fields"]["id2"])] = record["id"]
+
+    def update(self, updates):
+        """Patch ``{talk_id: fields}`` in one request. Returns how many
+        records were found to patch."""
+        self.find_records(updates)
+        records = []
+        for talk_id, fields in updates.items():
+            try:
+                records.append({"id": self.record_ids[str(talk_id)], "fields": fields})
+            except KeyError:
+                logger.warning("Talk %s isn't in Grist, not updating it", talk_id)
+        if not records:
+            return 0
+
+        resp = self.session.patch(
+            self.table_url, json={"records": records}, timeout=REQUEST_TIMEOUT
+        )
+        if 400 <= resp.status_code < 500:
+            # Rows may have been deleted or renumbered, so look them up again
+            self.record_ids.clear()
+        resp.raise_for_status()
+        return len(records)
+
+
+def client(table_url, key):
+    try:
+        return _clients[(table_url, key)]
+    except KeyError:
+        _clients[(table_url, key)] = GristClient(table_url, key)
+        return _clients[(table_url, key)]
+
+
+def add_pending(celery_app, talk_id, fields):
+    """Queue ``fields`` for the next batch. Returns ``False`` if there's no
+    Redis to queue them in."""
+    redis = redis_client(celery_app)
+    if redis is None:
+        return False
+    redis.rpush(PENDING_KEY, json.dumps({"talk_id": str(talk_id), "fields": fields}))
+    return True
+
+
+def take_pending(celery_app):
+    """Remove and return every queued update as ``{talk_id: fields}``, with
+    later updates to a talk merged over earlier ones."""
+    redis = redis_client(celery_app)
+    if redis is None:
+        return {}
+    with redis.pipeline() as pipe:
+        pipe.lrange(PENDING_KEY, 0, -1)
+        pipe.delete(PENDING_KEY)
+        pending, _ = pipe.execute()
+
+    updates = {}
+    for item in pending:
+        update = json.loads(item)
+        updates.setdefault(update["talk_id"], {}).update(update["fields"])
+    return updates
@@ -0,0 +1,72 @@
+"""Minimal ctypes bindings for Linux inotify"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+IN_CREATE = 0x00000100
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """An inotify instance. Raises ``OSError`` if the OS doesn't support it."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify not supported")
+
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def read(self, timeout=None):
+        """Wait up to ``timeout`` seconds (forever if ``None``) for events.
+
+        Returns a list of ``(wd, mask, name)`` tuples, which is empty if the
+        timeout passed first.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.fd, _READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + name_len].rstrip(b"\0")
+            offset += name_len
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
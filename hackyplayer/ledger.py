@@ -0,0 +1,283 @@
+"""Persistent records of ingests and builds, so the same work is only done once"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the start, middle and end of a file to fingerprint it
+HASH_SAMPLE = 1024 * 1024
+
+QUEUED = "queued"
+INGESTING = "ingesting"
+BUILDING = "building"
+DONE = "done"
+FAILED = "failed"
+
+IN_FLIGHT = (QUEUED, INGESTING, BUILDING)
+
+# How often the tasks doing an entry's work touch it, in seconds, and how
+# long an entry can go untouched before it's taken to be abandoned
+HEARTBEAT_S = 60
+STALE_S = 5 * 60
+# How long a queued entry can wait for a worker before it's taken to be lost
+QUEUED_STALE_S = 24 * 60 * 60
+
+# Redis keys of the ledgers kept there, and how long to remember which entry
+# each task is working on
+INGEST_PREFIX = "hackyplayer:ingest:"
+INGEST_INDEX = "hackyplayer:ingests"
+FILE_PREFIX = "hackyplayer:ingest-file:"
+BUILD_PREFIX = "hackyplayer:build:"
+BUILD_INDEX = "hackyplayer:builds"
+TASK_PREFIX = "hackyplayer:ledger-task:"
+TASK_TTL_S = 7 * 24 * 60 * 60
+
+
+def partial_hash(path, size):
+    """Hash the size and the start, middle and end of a file, which tells
+    recordings apart without reading all of them."""
+    digest = hashlib.sha256(str(size).encode("utf-8"))
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size // 2 - HASH_SAMPLE // 2), size - HASH_SAMPLE):
+            f.seek(max(0, offset))
+            digest.update(f.read(HASH_SAMPLE))
+    return digest.hexdigest()
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class _Ledger:
+    """Entries of work kept in Redis as JSON, under ``prefix`` and their ID,
+    so the web app and every worker, on any node, share them.
+
+    Without a Redis client, nothing is recorded and nothing is found, so all
+    work is done.
+    """
+
+    prefix = ""
+    index = ""
+
+    def __init__(self, client):
+        self.redis = client
+
+    def get(self, entry_id):
+        if self.redis is None:
+            return None
+        value = self.redis.get(self.prefix + entry_id)
+        return json.loads(value) if value else None
+
+    def entries(self, *states):
+        """Every entry in one of ``states``."""
+        if self.redis is None:
+            return []
+        entry_ids = sorted(
+            _text(entry_id) for entry_id in self.redis.smembers(self.index)
+        )
+        if not entry_ids:
+            return []
+        values = self.redis.mget([self.prefix + entry_id for entry_id in entry_ids])
+        entries = [json.loads(value) for value in values if value]
+        return [entry for entry in entries if entry["state"] in states]
+
+    def touch(self, task_id):
+        """Mark the entry claimed by ``task_id`` as still being worked on."""
+        if self.redis is None:
+            return
+        entry_id = self.redis.get(TASK_PREFIX + task_id)
+        if entry_id is None:
+            return
+
+        def touch(entry):
+            if entry and entry["task_id"] == task_id and entry["state"] in IN_FLIGHT:
+                entry["updated"] = time.time()
+                return entry
+            return None
+
+        self._change(_text(entry_id), touch)
+
+    def _claim(self, entry_id, entry, is_stale):
+        """Record ``entry`` as queued, unless the entry already there isn't
+        failed and ``is_stale`` doesn't reject it, in which case return that.
+        """
+        if self.redis is None:
+            return None
+        key = self.prefix + entry_id
+
+        def claim(pipe):
+            value = pipe.get(key)
+            existing = json.loads(value) if value else None
+            if existing and existing["state"] != FAILED and not is_stale(existing):
+                return existing
+            pipe.multi()
+            self._write(pipe, entry_id, {**entry, "state": QUEUED})
+            return None
+
+        return self.redis.transaction(claim, key, value_from_callable=True)
+
+    def _change(self, entry_id, change):
+        """Replace an entry, or ``None`` if there isn't one, with
+        ``change(entry)``, unless that's ``None``."""
+        if self.redis is None:
+            return
+        key = self.prefix + entry_id
+
+        def write(pipe):
+            value = pipe.get(key)
+            entry = change(json.loads(value) if value else None)
+            if entry is not None:
+                pipe.multi()
+                self._write(pipe, entry_id, entry)
+
+        self.redis.transaction(write, key)
+
+    def _write(self, pipe, entry_id, entry):
+        entry = {**entry, "updated": entry.get("updated") or time.time()}
+        pipe.set(self.prefix + entry_id, json.dumps(entry))
+        pipe.sadd(self.index, entry_id)
+        if entry.get("task_id"):
+            pipe.set(TASK_PREFIX + entry["task_id"], entry_id, ex=TASK_TTL_S)
+
+
+class IngestLedger(_Ledger):
+    """Ingests, keyed on each input's size and hash."""
+
+    prefix = INGEST_PREFIX
+    index = INGEST_INDEX
+
+    def fingerprint(self, path):
+        """Identify a file, only hashing it if this path, size and mtime
+        haven't been seen before."""
+        path = Path(path).resolve()
+        stats = os.stat(path)
+        fingerprint = {
+            "path": str(path),
+            "size": stats.st_size,
+            "mtime": stats.st_mtime,
+        }
+        seen_key = FILE_PREFIX + hashlib.sha256(str(path).encode("utf-8")).hexdigest()
+        seen = self.redis.get(seen_key) if self.redis is not None else None
+        seen = json.loads(seen) if seen else {}
+        if seen.get("size") == stats.st_size and seen.get("mtime") == stats.st_mtime:
+            return {**fingerprint, "hash": seen["hash"]}
+
+        fingerprint["hash"] = partial_hash(path, stats.st_size)
+        if self.redis is not None:
+            self.redis.set(seen_key, json.dumps(fingerprint))
+        return fingerprint
+
+    def get(self, fingerprint):
+        return super().get(self._id(fingerprint))
+
+    def claim(self, fingerprint, task_id, is_stale=lambda entry: False):
+        """Record ``task_id`` as ingesting a file, unless it doesn't need to be.
+
+        Returns ``None`` if the claim was made, or the existing entry if the
+        file has been, or is being, ingested and ``is_stale`` doesn't reject
+        that entry.
+        """
+        return self._claim(
+            self._id(fingerprint),
+            {**fingerprint, "task_id": task_id, "output": None, "updated": time.time()},
+            is_stale,
+        )
+
+    def update(self, fingerprint, state, task_id=None, output=None):
+        def update(entry):
+            entry = entry or {"task_id": None, "output": None}
+            return {
+                **entry,
+                **fingerprint,
+                "state": state,
+                "task_id": task_id or entry["task_id"],
+                "output": output or entry["output"],
+                "updated": time.time(),
+            }
+
+        self._change(self._id(fingerprint), update)
+
+    @staticmethod
+    def _id(fingerprint):
+        return f"{fingerprint['size']}:{fingerprint['hash']}"
+
+
+class BuildLedger(_Ledger):
+    """Builds, keyed on everything that goes into their output (see
+    ``formvideo.build_keys``), with the plan of each finished one so a later
+    build that only differs in the talk's details can reuse its segments."""
+
+    prefix = BUILD_PREFIX
+    index = BUILD_INDEX
+
+    def claim(self, key, content_key, task_id, is_stale=lambda entry: False):
+        """Record ``task_id`` as building ``key``, like ``IngestLedger.claim``."""
+        return self._claim(
+            key,
+            {
+                "key": key,
+                "content_key": content_key,
+                "task_id": task_id,
+                "output": None,
+                "plan": None,
+                "updated": time.time(),
+            },
+            is_stale,
+        )
+
+    def update(self, key, state, output=None, plan=None):
+        def update(entry):
+            if entry is None:
+                return None
+            return {
+                **entry,
+                "state": state,
+                "output": output or entry["output"],
+                "plan": entry["plan"] if plan is None else json.dumps(plan),
+                "updated": time.time(),
+            }
+
+        self._change(key, update)
+
+    def reusable(self, content_key):
+        """The plan of the latest finished build with ``content_key``, or
+        ``None``."""
+        done = [
+            entry
+            for entry in self.entries(DONE)
+            if entry["content_key"] == content_key and entry["plan"]
+        ]
+        if not done:
+            return None
+        return json.loads(max(done, key=lambda entry: entry["updated"])["plan"])
+
+
+@contextlib.contextmanager
+def heartbeat(ledger, task_id, interval_s=HEARTBEAT_S):
+    """Touch the entry claimed by ``task_id`` every ``interval_s`` until the
+    ``with`` block ends, so it isn't taken for one a dead worker left."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval_s):
+            try:
+                ledger.touch(task_id)
+            except Exception:
+                # Whatever the store, a missed beat mustn't stop the next one
+                logger.warning("Couldn't touch entry of %s", task_id, exc_info=True)
+
+    ledger.touch(task_id)
+    thread = threading.Thread(target=beat, name="ledger-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
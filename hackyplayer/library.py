@@ -0,0 +1,159 @@
+"""In-memory index of the videos in each of the VIDEO_SOURCES folders"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from . import formvideo, probe
+
+logger = logging.getLogger(__name__)
+
+# How often to check the folders for changes, in seconds
+SCAN_INTERVAL = 10
+# How often to rescan a folder even if its mtime hasn't changed, to catch
+# files that are still growing
+RESCAN_INTERVAL = 300
+# How long to wait for the first scan before serving an empty listing
+FIRST_SCAN_WAIT = 5
+PROBE_TIMEOUT = 60
+# Manifests of live streams change constantly and aren't worth probing
+UNPROBED_EXT = [".mpd"]
+
+SORT_KEYS = ("name", "size", "mtime", "duration")
+
+
+class MediaLibrary:
+    """Files in each source folder, with their sizes and what ffprobe says
+    about them, kept up to date by a background thread.
+
+    Requests only read the index, so listing a folder doesn't touch the disk
+    however many files are in it.
+    """
+
+    def __init__(self, sources, interval=SCAN_INTERVAL, probe_cache=None):
+        self.sources = {source["WEBDIR"]: source for source in sources}
+        self.interval = interval
+        self.probe_cache = probe_cache
+        # webdir -> {filename: entry}
+        self._entries = {webdir: {} for webdir in self.sources}
+        # webdir -> (dir mtime, time of last scan)
+        self._scanned = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._ready = threading.Event()
+
+    def files(self, webdir, search="", sort="name", descending=False):
+        """Entries of a source folder whose names contain ``search``."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._scan_forever, name="media-library", daemon=True
+                )
+                self._thread.start()
+        self._ready.wait(FIRST_SCAN_WAIT)
+
+        if sort not in SORT_KEYS:
+            sort = "name"
+        with self._lock:
+            entries = list(self._entries[webdir].values())
+        total = len(entries)
+        search = search.lower()
+        entries = [entry for entry in entries if search in entry["name"].lower()]
+        if sort == "name":
+            entries.sort(key=lambda entry: entry["name"], reverse=descending)
+        else:
+            # Files that haven't been probed yet have no duration
+            entries.sort(
+                key=lambda entry: (entry[sort] or 0, entry["name"]),
+                reverse=descending,
+            )
+        return total, entries
+
+    def _scan_forever(self):
+        while True:
+            for webdir, source in self.sources.items():
+                try:
+                    self._scan(webdir, source)
+                except Exception:
+                    logger.exception("Couldn't scan %s", source["DISKDIR"])
+            self._ready.set()
+            time.sleep(self.interval)
+
+    def _scan(self, webdir, source):
+        diskdir = Path(source["DISKDIR"])
+        try:
+            dir_mtime = os.stat(diskdir).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._entries[webdir] = {}
+            return
+
+        last_mtime, last_scan = self._scanned.get(webdir, (None, 0))
+        if dir_mtime == last_mtime and time.monotonic() - last_scan < RESCAN_INTERVAL:
+            return
+        self._scanned[webdir] = (dir_mtime, time.monotonic())
+
+        with self._lock:
+            old_entries = self._entries[webdir]
+        entries = {}
+        changed = []
+        for dir_entry in os.scandir(diskdir):
+            stem, ext = os.path.splitext(dir_entry.name)
+            # Hidden files include outputs that are still being written
+            if (
+                ext not in source["EXT"]
+                or dir_entry.name.startswith(".")
+                or not dir_entry.is_file()
+            ):
+                continue
+            stats = dir_entry.stat()
+            old_entry = old_entries.get(dir_entry.name)
+            if (
+                old_entry
+                and old_entry["size"] == stats.st_size
+                and old_entry["mtime"] == stats.st_mtime
+            ):
+                entries[dir_entry.name] = old_entry
+                continue
+            entries[dir_entry.name] = {
+                "name": stem,
+                "file": dir_entry.name,
+                "size": stats.st_size,
+                "mtime": stats.st_mtime,
+                "duration": None,
+                "codec": None,
+                "resolution": None,
+            }
+            if ext not in UNPROBED_EXT:
+                changed.append(dir_entry.name)
+
+        # List new files straight away, then fill in their details
+        with self._lock:
+            self._entries[webdir] = entries
+        for filename in changed:
+            details = _probe(diskdir / filename, self.probe_cache)
+            with self._lock:
+                entry = self._entries[webdir].get(filename)
+                if entry is not None:
+                    self._entries[webdir][filename] = {**entry, **details}
+
+
+def _probe(path, probe_cache=None):
+    try:
+        probed = probe.probe(path, probe_cache, formvideo.FFPROBE_BIN, PROBE_TIMEOUT)
+    except (subprocess.SubprocessError, OSError, ValueError):
+        logger.info("Couldn't probe %s", path)
+        return {}
+
+    details = {}
+    if "duration" in probed.get("format", {}):
+        details["duration"] = probe.duration_seconds(probed)
+    stream = probe.video_stream(probed)
+    if stream:
+        details["codec"] = stream.get("codec_name")
+        if "width" in stream and "height" in stream:
+            details["resolution"] = f"{stream['width']}x{stream['height']}"
+    return details
@@ -0,0 +1,85 @@
+"""EBU R128 loudness measurement, for normalising builds in a single pass"""
+
+import json
+import math
+import subprocess
+
+from . import cores
+
+TARGET_I = -23  # Integrated loudness, LUFS
+TARGET_TP = -1  # True peak, dBTP
+# Loudness range to allow before loudnorm compresses; speech is well under it
+TARGET_LRA = 20
+MAX_LRA = 50  # The most loudnorm accepts
+OUTPUT_RATE = 48000  # loudnorm works at 192kHz, so resample after it
+
+MEASURED_KEYS = ("input_i", "input_tp", "input_lra", "input_thresh")
+
+
+def measure(path, start_ts, end_ts, prefilter="", ffmpeg_bin="ffmpeg"):
+    """Measure the loudness of ``path`` between two timestamps, after the
+    filters ``prefilter``, with loudnorm's first pass.
+
+    Only the audio is decoded, so this runs far faster than realtime.
+    Returns loudnorm's ``input_*`` measurements as floats.
+    """
+    filters = f"{prefilter}," if prefilter else ""
+    ffmpeg_args = [
+        ffmpeg_bin,
+        "-nostats",
+        "-ss", start_ts, "-to", end_ts, "-i", str(path),
+        "-map", "0:a",
+        "-af", (
+            f"{filters}loudnorm=I={TARGET_I}:TP={TARGET_TP}:LRA={TARGET_LRA}"
+            ":print_format=json"
+        ),
+        "-f", "null", "-",
+    ]  # fmt: skip
+    with cores.reserving():
+        result = subprocess.run(
+            cores.ffmpeg_args(ffmpeg_args),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True,
+            **cores.popen_kwargs(),
+        )
+    # The measurements are the last thing loudnorm prints
+    stderr = result.stderr.decode("utf-8", "replace")
+    report = json.loads(stderr[stderr.rindex("{") : stderr.rindex("}") + 1])
+    return {key: float(report[key]) for key in MEASURED_KEYS}
+
+
+def linear_filter(measured, target_i=TARGET_I, target_tp=TARGET_TP):
+    """A loudnorm filter applying one fixed gain to bring audio with the
+    ``measured`` loudness to ``target_i``.
+
+    loudnorm falls back to compressing dynamically if the gain would push
+    the peaks over ``target_tp``, or the audio's range is over the target
+    range, so the target is lowered and the range raised to keep it linear.
+    loudnorm only sees the values as written into the filter, so the target
+    is worked out from those, rounded down and given a hundredth of a dB to
+    spare. Silent audio gets no filter, just the resampling.
+    """
+    if not all(math.isfinite(measured[key]) for key in MEASURED_KEYS):
+        return f"aresample={OUTPUT_RATE}"
+    measured = {key: round(measured[key], 2) for key in MEASURED_KEYS}
+    target_i = min(target_i, target_tp - measured["input_tp"] + measured["input_i"])
+    target_i = math.floor(target_i * 100) / 100 - 0.01
+    target_lra = min(max(TARGET_LRA, math.ceil(measured["input_lra"])), MAX_LRA)
+    return (
+        f"loudnorm=I={target_i:.2f}:TP={target_tp}:LRA={target_lra}"
+        f":measured_I={measured['input_i']:.2f}"
+        f":measured_TP={measured['input_tp']:.2f}"
+        f":measured_LRA={measured['input_lra']:.2f}"
+        f":measured_thresh={measured['input_thresh']:.2f}"
+        f":linear=true,aresample={OUTPUT_RATE}"
+    )
+
+
+def dynamic_filter(target_i=TARGET_I, target_tp=TARGET_TP):
+    """A loudnorm filter for when there's no time to measure first, which
+    adjusts the gain as it goes."""
+    return (
+        f"loudnorm=I={target_i}:TP={target_tp}:LRA={TARGET_LRA},"
+        f"aresample={OUTPUT_RATE}"
+    )
@@ -0,0 +1,116 @@
+"""ffprobe metadata for media files, cached on disk"""
+
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+FFPROBE_BIN = "ffprobe"
+MAX_ENTRIES = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    probe TEXT NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_used ON probes (used);
+"""
+
+# db_path -> ProbeCache, one per process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def run_ffprobe(path, ffprobe_bin=FFPROBE_BIN, timeout=None):
+    """The format and every stream of ``path``, as ffprobe's JSON."""
+    ffprobe_args = [
+        ffprobe_bin,
+        "-v", "quiet",
+        "-print_format", "json",
+        "-show_streams",
+        "-show_format",
+        str(path),
+    ]  # fmt: skip
+    return json.loads(subprocess.check_output(ffprobe_args, timeout=timeout))
+
+
+class ProbeCache(database.Database):
+    """An SQLite database of probes, keyed on each file's path, size and
+    mtime, which forgets the least recently used past ``max_entries``."""
+
+    schema = SCHEMA
+
+    def __init__(self, db_path, max_entries=MAX_ENTRIES):
+        super().__init__(db_path)
+        self.max_entries = max_entries
+
+    def probe(self, path, ffprobe_bin=FFPROBE_BIN, timeout=None):
+        path = Path(path).resolve()
+        stats = os.stat(path)
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT probe FROM probes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (str(path), stats.st_size, stats.st_mtime_ns),
+            ).fetchone()
+            if row:
+                db.execute(
+                    "UPDATE probes SET used = ? WHERE path = ?",
+                    (time.time(), str(path)),
+                )
+                return json.loads(row[0])
+
+        result = run_ffprobe(path, ffprobe_bin, timeout)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    stats.st_size,
+                    stats.st_mtime_ns,
+                    json.dumps(result),
+                    time.time(),
+                ),
+            )
+            db.execute(
+                """
+                DELETE FROM probes WHERE path IN (
+                    SELECT path FROM probes ORDER BY used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+        return result
+
+
+def probe(path, cache_path=None, ffprobe_bin=FFPROBE_BIN, timeout=None):
+    """Probe ``path``, through the cache at ``cache_path`` if it's given."""
+    if cache_path is None:
+        return run_ffprobe(path, ffprobe_bin, timeout)
+    cache_path = str(cache_path)
+    with _caches_lock:
+        if cache_path not in _caches:
+            _caches[cache_path] = ProbeCache(cache_path)
+        cache = _caches[cache_path]
+    return cache.probe(path, ffprobe_bin, timeout)
+
+
+def duration_seconds(probe_result):
+    return float(probe_result["format"]["duration"])
+
+
+def video_stream(probe_result):
+    """The first video stream of a probe, or an empty dict if there isn't one."""
+    for stream in probe_result.get("streams", []):
+        if stream.get("codec_type") == "video":
+            return stream
+    return {}
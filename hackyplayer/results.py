@@ -0,0 +1,70 @@
+"""Bulk lookups of task states in the Celery result backend"""
+
+import celery.states
+from celery.backends.base import KeyValueStoreBackend
+from celery.backends.redis import RedisBackend
+
+
+def redis_client(celery_app):
+    """The result backend's Redis client, or ``None`` if it isn't Redis."""
+    if not isinstance(celery_app.backend, RedisBackend):
+        return None
+    return celery_app.backend.client
+
+
+def task_states(celery_app, task_ids):
+    """Fetch the state and info of many tasks, as ``{task_id: (state, info)}``.
+
+    Key-value backends that support it, like Redis, are asked for all of them
+    in one MGET; any other backend gets one lookup per task.
+    """
+    task_ids = list(dict.fromkeys(task_ids))
+    if not task_ids:
+        return {}
+
+    backend = celery_app.backend
+    try:
+        if not isinstance(backend, KeyValueStoreBackend):
+            raise NotImplementedError
+        keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+        values = backend.mget(keys)
+    except NotImplementedError:
+        return _task_states_each(celery_app, task_ids)
+
+    # Redis returns a list in the order asked for, memcached a dict by key
+    if hasattr(values, "items"):
+        values = [values.get(key) for key in keys]
+
+    states = {}
+    for task_id, value in zip(task_ids, values):
+        if value:
+            # Like AsyncResult.info, this turns the result of a FAILURE or
+            # RETRY back into its exception with exception_to_python
+            meta = backend.decode_result(value)
+            states[task_id] = (meta["status"], meta["result"])
+        else:
+            states[task_id] = (celery.states.PENDING, None)
+    return states
+
+
+def _task_states_each(celery_app, task_ids):
+    states = {}
+    for task_id in task_ids:
+        result = celery_app.AsyncResult(task_id)
+        states[task_id] = (result.state, result.info)
+    return states
+
+
+def progress_percent(info):
+    """How far through a task is, from the info of its PROGRESS state."""
+    if isinstance(info, dict) and "current" in info and info.get("total"):
+        return (info["current"] * 100) / info["total"]
+    return 0
+
+
+def eta_text(info):
+    """How long a task has left as ``m:ss``, or ``""`` if that isn't known."""
+    if not isinstance(info, dict) or info.get("eta_s") is None:
+        return ""
+    minutes, seconds = divmod(round(info["eta_s"]), 60)
+    return f"{minutes}:{seconds:02d}"
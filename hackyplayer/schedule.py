@@ -0,0 +1,105 @@
+"""The talk schedule, indexed once and reloaded when the file changes"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_FILE = Path(__file__).parent / "talks.json"
+SCHEDULE_URL = "https://www.emfcamp.org/schedule/2024.json"
+FETCH_TIMEOUT = 30
+
+
+class Schedule:
+    """Talks from an EMF schedule JSON file.
+
+    The file is only parsed when its mtime or size changes, so looking a talk
+    up costs a ``stat``. ``talks_json`` is the sorted payload for the log
+    page, serialised once per load.
+    """
+
+    def __init__(self, path=SCHEDULE_FILE, url=SCHEDULE_URL):
+        self.path = Path(path)
+        self.url = url
+        self._lock = threading.Lock()
+        self._loaded_stat = None
+        self._index = None
+
+    def talk(self, talk_id):
+        """The schedule entry with ID ``talk_id``, or ``None``."""
+        return self._current()["by_id"].get(str(talk_id))
+
+    def talks_by_slug(self, slug):
+        """Every schedule entry with ``slug`` (they aren't unique)."""
+        return self._current()["by_slug"].get(slug, [])
+
+    def talks(self):
+        """``{id: {"title", "presenter"}}`` of every talk, sorted by title."""
+        return self._current()["talks"]
+
+    def talks_json(self):
+        return self._current()["talks_json"]
+
+    def venues(self):
+        return list(self._current()["by_venue"])
+
+    def in_venue(self, venue):
+        """Every schedule entry in ``venue``, in order of start time."""
+        return self._current()["by_venue"].get(venue, [])
+
+    def refresh(self):
+        """Download the schedule from ``url`` over the file, then reload it."""
+        resp = requests.get(self.url, timeout=FETCH_TIMEOUT)
+        resp.raise_for_status()
+        data = resp.json()
+
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp-{os.getpid()}")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return len(self._current()["by_id"])
+
+    def _current(self):
+        stats = os.stat(self.path)
+        stat_key = (stats.st_mtime_ns, stats.st_size)
+        with self._lock:
+            if stat_key != self._loaded_stat:
+                logger.info("Loading schedule from %s", self.path)
+                with open(self.path) as f:
+                    self._index = _index(json.load(f))
+                self._loaded_stat = stat_key
+            return self._index
+
+
+def _index(data):
+    by_id = {}
+    by_slug = {}
+    by_venue = {}
+    talks = {}
+    for talk in data:
+        by_id[str(talk["id"])] = talk
+        by_slug.setdefault(talk["slug"], []).append(talk)
+        by_venue.setdefault(talk["venue"], []).append(talk)
+        if talk["type"] == "talk":
+            talks[talk["id"]] = {
+                "title": talk["title"],
+                "presenter": talk["speaker"],
+            }
+    for venue_talks in by_venue.values():
+        venue_talks.sort(key=lambda talk: talk["start_date"])
+    talks_sorted = dict(sorted(talks.items(), key=lambda k_v: k_v[1]["title"]))
+    return {
+        "by_id": by_id,
+        "by_slug": by_slug,
+        "by_venue": by_venue,
+        "talks": talks_sorted,
+        "talks_json": json.dumps(talks_sorted),
+    }
@@ -0,0 +1,181 @@
+"""Thumbnail sprite sheets and waveform peaks for the log page's timeline"""
+
+import array
+import json
+import math
+import os
+import sys
+from pathlib import Path
+
+THUMB_INTERVAL_S = 10
+THUMB_WIDTH = 160
+THUMB_HEIGHT = 90
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+# The audio is resampled to this for the peaks, which is plenty for drawing
+PEAK_RATE = 2000
+PEAK_INTERVAL_S = 0.1  # Seconds per sample of the finest zoom level
+ZOOM_FACTOR = 4  # How many samples of a level make one of the next
+MIN_LEVEL_SAMPLES = 256  # Stop zooming out below this many samples
+READ_WINDOWS = 600  # How many windows of audio to read at once
+
+INDEX_FILE = "index.json"
+PEAKS_FILE = "peaks.u8"
+PCM_FILE = "audio.s16"
+SPRITE_PATTERN = "sprite_%03d.jpg"
+
+
+def thumb_filter(interval_s=THUMB_INTERVAL_S, first_s=0):
+    """A filter chain picking a thumbnail every ``interval_s`` from video
+    whose first frame is ``first_s`` before the first one due, as a steady
+    stream of one every ``interval_s``.
+
+    Frames are picked by their own time, rather than by ``fps``, so chunks of
+    a video encoded apart pick the same ones as a single encode would.
+    """
+    return (
+        f"select='gte(t,{first_s:.6f}+{interval_s}*selected_n)',"
+        f"setpts=N*{interval_s}/TB,fps=1/{interval_s},"
+        f"scale={THUMB_WIDTH}:{THUMB_HEIGHT}"
+    )
+
+
+def sprite_output(pad, scrub_dir):
+    """FFmpeg output options writing the thumbnails from ``pad`` to sprite
+    sheets in ``scrub_dir``."""
+    return [
+        "-map", f"[{pad}]",
+        "-q:v", "5",
+        Path(scrub_dir) / SPRITE_PATTERN,
+    ]  # fmt: skip
+
+
+def pcm_output(pad, scrub_dir):
+    """FFmpeg output options writing the audio from ``pad`` as the raw audio
+    ``write_peaks`` reads, into ``scrub_dir``."""
+    return [
+        "-map", f"[{pad}]",
+        "-ac", "1",
+        "-ar", str(PEAK_RATE),
+        "-f", "s16le",
+        Path(scrub_dir) / PCM_FILE,
+    ]  # fmt: skip
+
+
+def tile_args(thumb_list, scrub_dir, ffmpeg_bin="ffmpeg"):
+    """FFmpeg arguments that tile the thumbnails in the concat list
+    ``thumb_list``, written apart by the chunks of an encode, into sprite
+    sheets in ``scrub_dir``. They're tiny, so this takes moments."""
+    return [
+        ffmpeg_bin,
+        "-f", "concat", "-safe", "0", "-i", thumb_list,
+        "-vf", f"tile={SPRITE_COLUMNS}x{SPRITE_ROWS}",
+        "-q:v", "5",
+        Path(scrub_dir) / SPRITE_PATTERN,
+        "-y",
+    ]  # fmt: skip
+
+
+def write_peaks(pcm_path, peaks_path):
+    """Write the peak and RMS levels of the raw audio at ``pcm_path`` to
+    ``peaks_path``, at several zoom levels, and return their layout.
+
+    Each level is a run of ``(peak, rms)`` byte pairs, scaled so 255 is full
+    scale, ``ZOOM_FACTOR`` times coarser than the one before.
+    """
+    window = round(PEAK_RATE * PEAK_INTERVAL_S)
+    peaks = array.array("d")
+    mean_squares = array.array("d")
+    for peak, mean_square in _read_windows(pcm_path, window):
+        peaks.append(peak)
+        mean_squares.append(mean_square)
+
+    levels = []
+    interval_s = PEAK_INTERVAL_S
+    offset = 0
+    tmp_path = Path(peaks_path).with_name(f"{Path(peaks_path).name}.tmp")
+    with open(tmp_path, "wb") as f:
+        while True:
+            level = array.array(
+                "B",
+                (
+                    round(255 * value)
+                    for peak, mean_square in zip(peaks, mean_squares)
+                    for value in (peak, math.sqrt(mean_square))
+                ),
+            )
+            level.tofile(f)
+            levels.append(
+                {"interval": interval_s, "offset": offset, "count": len(peaks)}
+            )
+            offset += len(level)
+            if len(peaks) <= MIN_LEVEL_SAMPLES:
+                break
+            # Peaks of a coarser level are the loudest of the finer ones, and
+            # its mean squares the mean of theirs
+            peaks = array.array(
+                "d",
+                (
+                    max(peaks[i : i + ZOOM_FACTOR])
+                    for i in range(0, len(peaks), ZOOM_FACTOR)
+                ),
+            )
+            mean_squares = array.array(
+                "d",
+                (
+                    sum(mean_squares[i : i + ZOOM_FACTOR])
+                    / len(mean_squares[i : i + ZOOM_FACTOR])
+                    for i in range(0, len(mean_squares), ZOOM_FACTOR)
+                ),
+            )
+            interval_s *= ZOOM_FACTOR
+    os.replace(tmp_path, peaks_path)
+    return levels
+
+
+def _read_windows(pcm_path, window):
+    """``(peak, mean square)`` of each ``window`` samples of a raw audio
+    file, as fractions of full scale."""
+    with open(pcm_path, "rb") as f:
+        while True:
+            samples = array.array("h")
+            # Whole windows at a time, so only the last one can be short
+            samples.frombytes(f.read(window * READ_WINDOWS * samples.itemsize))
+            if not samples:
+                return
+            if sys.byteorder == "big":
+                samples.byteswap()
+            for start in range(0, len(samples), window):
+                chunk = samples[start : start + window]
+                peak = max(max(chunk), -min(chunk)) / 32768
+                yield min(peak, 1), sum(x * x for x in chunk) / len(chunk) / 32768**2
+
+
+def write_index(scrub_dir, duration_s, interval_s=THUMB_INTERVAL_S):
+    """Turn the sprite sheets and raw audio written by the encode into the
+    files the log page reads, and remove the raw audio."""
+    scrub_dir = Path(scrub_dir)
+    pcm_path = scrub_dir / PCM_FILE
+    levels = write_peaks(pcm_path, scrub_dir / PEAKS_FILE)
+    pcm_path.unlink()
+
+    sheets = sorted(path.name for path in scrub_dir.glob("sprite_*.jpg"))
+    index = {
+        "duration": duration_s,
+        "thumbs": {
+            "interval": interval_s,
+            "width": THUMB_WIDTH,
+            "height": THUMB_HEIGHT,
+            "columns": SPRITE_COLUMNS,
+            "rows": SPRITE_ROWS,
+            "count": math.ceil(duration_s / interval_s),
+            "sheets": sheets,
+        },
+        "waveform": {"file": PEAKS_FILE, "levels": levels},
+    }
+    # The log page only looks for the index, so it goes last
+    tmp_path = scrub_dir / f"{INDEX_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, scrub_dir / INDEX_FILE)
+    return index
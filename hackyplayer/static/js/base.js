@@ -8,4 +8,130 @@ function openNav() {
 function closeNav() {
     document.getElementById("sidebar").style.width = "0";
     document.getElementById("main").style.marginLeft = "0";
-  }
\ No newline at end of file
+  }
+/* Format a number of seconds like results.eta_text */
+function formatEta(seconds) {
+    if (seconds === null || seconds === undefined) {
+        return '';
+    }
+    seconds = Math.round(seconds);
+    return Math.floor(seconds / 60) + ':' + String(seconds % 60).padStart(2, '0');
+}
+
+/* Keep DataTables of tasks up to date from the task event stream, updating
+   progress in place and reloading when tasks start or stop. Rows standing
+   for a parallel job list its segments in data.segments, as
+   {id: [done_s, duration_s]}, and sum up their progress. Falls back to
+   polling if the server can't stream events. */
+function followTaskEvents(tables) {
+    var reloadTimer = null;
+    var pollTimer = null;
+
+    function reloadAll() {
+        tables.forEach(function (table) {
+            table.ajax.reload(null, false);
+        });
+    }
+
+    function reloadSoon() {
+        // Give the server's view of the workers a moment to catch up
+        if (reloadTimer === null) {
+            reloadTimer = setTimeout(function () {
+                reloadTimer = null;
+                reloadAll();
+            }, 1500);
+        }
+    }
+
+    function poll(interval) {
+        clearInterval(pollTimer);
+        pollTimer = setInterval(reloadAll, interval);
+    }
+
+    function updateRow(row, event) {
+        var data = row.data();
+        if (data.segments && event.id in data.segments) {
+            var done = 0;
+            var total = 0;
+            data.segments[event.id][0] = event.meta.current;
+            Object.values(data.segments).forEach(function (segment) {
+                done += segment[0];
+                total += segment[1];
+            });
+            data.progress = (total ? done * 100 / total : 0).toFixed(1) + '%';
+            row.data(data).draw(false);
+            return;
+        }
+        if ('progress' in data) {
+            data.progress = (event.meta.current * 100 / event.meta.total).toFixed(1) + '%';
+        }
+        if ('state' in data) {
+            data.state = event.state;
+        }
+        if ('eta' in data) {
+            data.eta = formatEta(event.meta.eta_s);
+        }
+        row.data(data).draw(false);
+    }
+
+    if (!window.EventSource) {
+        poll(5000);
+        return;
+    }
+
+    // Still reload occasionally, in case an event was missed
+    poll(30000);
+    var source = new EventSource('/api/v1/events');
+    source.onmessage = function (message) {
+        JSON.parse(message.data).forEach(function (event) {
+            // Tasks starting or stopping change what the tables list
+            if (!event.meta) {
+                reloadSoon();
+                return;
+            }
+            if (!event.meta.total) {
+                return;
+            }
+            // Progress of tasks no table lists, like those of other pages,
+            // is left alone
+            tables.forEach(function (table) {
+                table.rows(function (idx, data) {
+                    return data.id === event.id
+                        || (data.segments && event.id in data.segments);
+                }).every(function () {
+                    updateRow(this, event);
+                });
+            });
+        });
+    };
+    source.onerror = function () {
+        if (source.readyState === EventSource.CLOSED) {
+            poll(5000);
+        }
+    };
+}
+
+/* DataTables renderers for the media library */
+function formatSize(bytes) {
+    var units = ['B', 'KB', 'MB', 'GB', 'TB'];
+    var unit = 0;
+    while (bytes >= 1024 && unit < units.length - 1) {
+        bytes /= 1024;
+        unit++;
+    }
+    return bytes.toFixed(unit ? 1 : 0) + ' ' + units[unit];
+}
+
+function formatDuration(seconds) {
+    if (seconds === null || seconds === undefined) {
+        return '';
+    }
+    seconds = Math.round(seconds);
+    var hours = Math.floor(seconds / 3600);
+    var minutes = Math.floor(seconds / 60) % 60;
+    return hours + ':' + String(minutes).padStart(2, '0') + ':' + String(seconds % 60).padStart(2, '0');
+}
+
+function formatTime(timestamp) {
+    return new Date(timestamp * 1000).toLocaleString();
+}
@@ -1,4 +1,8 @@
 var framerate = 50
+// Thumbnails and waveform peaks for the timeline strip, once they've loaded
+var timeline = null
+var timeline_thumb_height = 45
+var timeline_min_span = 10
 
 function bff (frames=1) {
     // Button Frame Forward
@@ -13,11 +17,13 @@ function bfb (frames=1) {
 function bmi() {
     // Button Mark In
     document.getElementById("intc").value = seconds_to_timestamp(document.getElementById("video1").currentTime)
+    draw_timeline()
 }
 
 function bmo() {
     // Button Mark Out
     document.getElementById("outtc").value = seconds_to_timestamp(document.getElementById("video1").currentTime)
+    draw_timeline()
 }
 
 function bgi() {
@@ -153,7 +159,166 @@ function checkKey(e) {
     }
 }
 
-window.onload = frameevent
+function load_timeline() {
+    // Fetch the sprite sheets and waveform ingest made, if it made any
+    var strip = document.getElementById("timeline")
+    if (!strip) {
+        return
+    }
+    var base = strip.dataset.scrub
+    fetch(base + "/index.json").then((response) => response.json()).then((index) => {
+        fetch(base + "/" + index.waveform.file).then((response) => response.arrayBuffer()).then((buffer) => {
+            timeline = {
+                index: index,
+                peaks: new Uint8Array(buffer),
+                sheets: index.thumbs.sheets.map(function (sheet) {
+                    var img = new Image()
+                    img.onload = draw_timeline
+                    img.src = base + "/" + sheet
+                    return img
+                }),
+                span: index.duration,
+            }
+
+            var canvas = document.getElementById("timeline_strip")
+            canvas.addEventListener("click", timeline_click)
+            canvas.addEventListener("wheel", timeline_zoom)
+            canvas.addEventListener("mousemove", timeline_hover)
+            canvas.addEventListener("mouseleave", function () {
+                document.getElementById("timeline_thumb").style.display = "none"
+            })
+            var video = document.getElementById("video1")
+            video.addEventListener("timeupdate", draw_timeline)
+            video.addEventListener("seeked", draw_timeline)
+            document.getElementById("intc").addEventListener("change", draw_timeline)
+            document.getElementById("outtc").addEventListener("change", draw_timeline)
+            window.addEventListener("resize", draw_timeline)
+            draw_timeline()
+        })
+    })
+}
+
+function timeline_view() {
+    // The stretch of video the strip shows, kept around the current time
+    var duration = timeline.index.duration
+    var span = Math.min(timeline.span, duration)
+    var start = document.getElementById("video1").currentTime - span / 2
+    start = Math.min(Math.max(start, 0), duration - span)
+    return {start: start, span: span}
+}
+
+function timeline_time(e) {
+    var view = timeline_view()
+    return view.start + e.offsetX / e.target.clientWidth * view.span
+}
+
+function timeline_thumb(time) {
+    // Where in the sprite sheets the thumbnail nearest to time is
+    var thumbs = timeline.index.thumbs
+    var n = Math.max(Math.min(Math.floor(time / thumbs.interval), thumbs.count - 1), 0)
+    var per_sheet = thumbs.columns * thumbs.rows
+    var tile = n % per_sheet
+    return {
+        sheet: timeline.sheets[Math.floor(n / per_sheet)],
+        x: (tile % thumbs.columns) * thumbs.width,
+        y: Math.floor(tile / thumbs.columns) * thumbs.height,
+    }
+}
+
+function draw_timeline() {
+    if (!timeline) {
+        return
+    }
+    var canvas = document.getElementById("timeline_strip")
+    canvas.width = canvas.clientWidth
+    var ctx = canvas.getContext("2d")
+    var view = timeline_view()
+    var thumbs = timeline.index.thumbs
+    ctx.clearRect(0, 0, canvas.width, canvas.height)
+
+    // A row of thumbnails along the top
+    var thumb_width = timeline_thumb_height * thumbs.width / thumbs.height
+    for (var x = 0; x < canvas.width; x += thumb_width) {
+        var thumb = timeline_thumb(view.start + (x + thumb_width / 2) / canvas.width * view.span)
+        if (thumb.sheet && thumb.sheet.complete && thumb.sheet.naturalWidth) {
+            ctx.drawImage(thumb.sheet, thumb.x, thumb.y, thumbs.width, thumbs.height, x, 0, thumb_width, timeline_thumb_height)
+        }
+    }
+
+    // The waveform below, from the coarsest level with a sample per pixel
+    var per_pixel = view.span / canvas.width
+    var levels = timeline.index.waveform.levels
+    var level = levels[0]
+    for (var i = 1; i < levels.length; i++) {
+        if (levels[i].interval <= per_pixel) {
+            level = levels[i]
+        }
+    }
+    var wave_height = canvas.height - timeline_thumb_height
+    var middle = timeline_thumb_height + wave_height / 2
+    for (var x = 0; x < canvas.width; x++) {
+        var first = Math.floor((view.start + x * per_pixel) / level.interval)
+        var last = Math.max(first + 1, Math.floor((view.start + (x + 1) * per_pixel) / level.interval))
+        var peak = 0
+        var rms = 0
+        for (var n = first; n < last && n < level.count; n++) {
+            peak = Math.max(peak, timeline.peaks[level.offset + 2 * n])
+            rms = Math.max(rms, timeline.peaks[level.offset + 2 * n + 1])
+        }
+        ctx.fillStyle = "#4d7a31"
+        ctx.fillRect(x, middle - peak / 255 * wave_height / 2, 1, peak / 255 * wave_height)
+        ctx.fillStyle = "#73bd45"
+        ctx.fillRect(x, middle - rms / 255 * wave_height / 2, 1, rms / 255 * wave_height)
+    }
+
+    function marker(time, colour) {
+        var x = Math.round((time - view.start) / view.span * canvas.width)
+        ctx.fillStyle = colour
+        ctx.fillRect(x - 1, 0, 2, canvas.height)
+    }
+    var intc = document.getElementById("intc").value
+    var outtc = document.getElementById("outtc").value
+    if (intc) {
+        marker(timestamp_to_seconds(intc.replace(/\:/g,'')), "#f48120")
+    }
+    if (outtc) {
+        marker(timestamp_to_seconds(outtc.replace(/\:/g,'')), "#ea1a5b")
+    }
+    marker(document.getElementById("video1").currentTime, "#ffffff")
+}
+
+function timeline_click(e) {
+    document.getElementById("video1").currentTime = timeline_time(e)
+}
+
+function timeline_zoom(e) {
+    e.preventDefault()
+    var span = e.deltaY > 0 ? timeline.span * 2 : timeline.span / 2
+    timeline.span = Math.min(Math.max(span, timeline_min_span), timeline.index.duration)
+    draw_timeline()
+}
+
+function timeline_hover(e) {
+    // Show the thumbnail under the pointer, bigger, above the strip
+    var thumbs = timeline.index.thumbs
+    var thumb = timeline_thumb(timeline_time(e))
+    var preview = document.getElementById("timeline_thumb")
+    if (!thumb.sheet) {
+        preview.style.display = "none"
+        return
+    }
+    preview.style.display = "block"
+    preview.style.width = thumbs.width + "px"
+    preview.style.height = thumbs.height + "px"
+    preview.style.left = Math.min(Math.max(e.offsetX - thumbs.width / 2, 0), e.target.clientWidth - thumbs.width) + "px"
+    preview.style.backgroundImage = "url(" + thumb.sheet.src + ")"
+    preview.style.backgroundPosition = -thumb.x + "px " + -thumb.y + "px"
+}
+
+window.onload = function () {
+    frameevent()
+    load_timeline()
+}
 
 document.onkeydown = checkKey;
 
@@ -227,7 +392,7 @@ function get_shuttle() {
     });
 }
 
-function send_to_renderer(){
+function send_to_renderer(preview=false){
 
     var data = new FormData();
     data.append('start_tc', document.getElementById("intc").value);
@@ -236,6 +401,10 @@ function send_to_renderer(){
     data.append('title', document.getElementById("title").value);
     data.append('video', document.getElementById("video_id").value);
     data.append('talkid', document.getElementById("talkid").value);
+    data.append('profile', document.getElementById("profile").value);
+    if (preview) {
+        data.append('preview', '1');
+    }
 
     document.getElementById("intc").classList.remove('invalid')
     document.getElementById("outtc").classList.remove('invalid')
@@ -271,10 +440,16 @@ function send_to_renderer(){
         var xhttp = new XMLHttpRequest();
 
         xhttp.onreadystatechange = function() {
-            if (this.readyState == 4 && this.status == 200) {
+            if (this.readyState == 4 && this.status == 200 && preview) {
+            poll_preview(JSON.parse(xhttp.responseText)['result_id']);
+            } else if (this.readyState == 4 && this.status == 200) {
             document.getElementById("infopopup").innerHTML = "New job ID: " + JSON.parse(xhttp.responseText)['result_id'];
             document.getElementById("infopopup").classList.remove('fadeIn')
             setTimeout(function() {document.getElementById("infopopup").classList.add('fadeIn')}, 100)
+            } else if (this.readyState == 4 && this.status == 400) {
+            document.getElementById("infopopup").textContent = "Not built: " + JSON.parse(xhttp.responseText)['error'];
+            document.getElementById("infopopup").classList.remove('fadeIn')
+            setTimeout(function() {document.getElementById("infopopup").classList.add('fadeIn')}, 100)
             }
         };
 
@@ -283,6 +458,38 @@ function send_to_renderer(){
     }
 }
 
+function poll_preview(result_id) {
+    // Show how a preview build is going, then play it once it's done
+    document.getElementById("preview").style.display = "block";
+    var video = document.getElementById("preview_video");
+    var state = document.getElementById("preview_state");
+    var xhttp = new XMLHttpRequest();
+    xhttp.onreadystatechange = function() {
+        if (this.readyState != 4) {
+            return;
+        }
+        if (this.status != 200) {
+            state.textContent = "(couldn't get the preview)";
+            return;
+        }
+        var result = JSON.parse(xhttp.responseText);
+        if (result['url']) {
+            state.textContent = "";
+            video.src = result['url'];
+            video.style.display = "block";
+            video.play();
+        } else if (result['error']) {
+            state.textContent = "(failed: " + result['error'] + ")";
+        } else {
+            video.style.display = "none";
+            state.textContent = "(" + result['state'].toLowerCase() + ", " + Math.round(result['progress']) + "%)";
+            setTimeout(function() {poll_preview(result_id)}, 1000);
+        }
+    };
+    xhttp.open("GET", "/api/v1/preview/" + result_id, true);
+    xhttp.send();
+}
+
 function talk_select(e) {
     var talkdata = JSON.parse(document.getElementById('talkdata').textContent);
     if (e.value == -1) {
@@ -305,5 +512,17 @@ function talk_select(e) {
         document.getElementById('talkid').value = e.value
         document.getElementById('talkid').readOnly = true;
         document.getElementById('talkid').classList.add('readonly')
+
+        // Fill in the points analysis suggests, unless they're already marked
+        var suggestions = JSON.parse(document.getElementById('suggestions').textContent);
+        if (suggestions[e.value]) {
+            if (!document.getElementById('intc').value) {
+                document.getElementById('intc').value = suggestions[e.value]["start_tc"]
+            }
+            if (!document.getElementById('outtc').value) {
+                document.getElementById('outtc').value = suggestions[e.value]["end_tc"]
+            }
+            draw_timeline()
+        }
     }
 }
\ No newline at end of file
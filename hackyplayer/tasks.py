@@ -1,3 +1,6 @@
+import contextlib
+import functools
+import json
 import logging
 import os
 import pathlib
@@ -5,34 +8,588 @@ import signal
 import time
 
 import celery
+import celery.result
+import celery.signals
+import celery.states
 import celery_singleton
+import requests
 
-from . import config, formvideo
+from . import (
+    analysis,
+    config,
+    cores,
+    events,
+    formvideo,
+    grist,
+    inotify,
+    ledger,
+    results,
+    schedule,
+)
 
 logger = logging.getLogger(__name__)
 
+# How long a file has to go unchanged before it's ingested
+SETTLE_TIME = 5
+
+# Backoff for retrying Grist updates, in seconds
+GRIST_RETRY_DELAY = 5
+GRIST_RETRY_MAX_DELAY = 300
+
+WATCH_EVENTS = (
+    inotify.IN_CREATE
+    | inotify.IN_MODIFY
+    | inotify.IN_CLOSE_WRITE
+    | inotify.IN_MOVED_TO
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_DELETE
+    | inotify.IN_DELETE_SELF
+    | inotify.IN_MOVE_SELF
+)
+
 flask_app = config.create_app()
 celery_app = flask_app.extensions["celery"]
+talk_schedule = schedule.Schedule(
+    flask_app.config["SCHEDULE_FILE"], flask_app.config["SCHEDULE_URL"]
+)
 
 
 class ErrSigTerm(Exception):
     pass
 
 
+# Tell the dashboards when tasks are queued, start and finish
+@celery.signals.after_task_publish.connect
+def _published(sender=None, headers=None, **kwargs):
+    events.publish(celery_app, headers["id"], sender, celery.states.PENDING, force=True)
+
+
+@celery.signals.task_prerun.connect
+def _started(task_id=None, task=None, **kwargs):
+    events.publish(celery_app, task_id, task.name, celery.states.STARTED, force=True)
+
+
+@celery.signals.task_postrun.connect
+def _finished(task_id=None, task=None, state=None, **kwargs):
+    events.publish(celery_app, task_id, task.name, state, force=True)
+
+
+# task_id -> the cores a running task wants for its FFmpegs
+_core_demands = {}
+
+
+@functools.cache
+def _core_budget():
+    return cores.CoreBudget(
+        flask_app.config["WORKER_CORES"],
+        flask_app.config["CORE_LOCK_DIR"] or cores.LOCK_DIR,
+    )
+
+
+# Run the FFmpegs of each task on the cores it asks for in TASK_CPU, so the
+# workers on a node share them rather than all running on every core. The
+# cores are only reserved while an FFmpeg runs, so a task planning a job, or
+# replacing itself with its segments, doesn't hold or wait for them.
+@celery.signals.task_prerun.connect
+def _want_cores(task_id=None, task=None, **kwargs):
+    demand = flask_app.config["TASK_CPU"].get(task.name.rpartition(".")[2])
+    if demand:
+        wanting = contextlib.ExitStack()
+        wanting.enter_context(
+            _core_budget().want(demand["THREADS"], demand.get("NICE", 0))
+        )
+        _core_demands[task_id] = wanting
+
+
+@celery.signals.task_postrun.connect
+def _stop_wanting_cores(task_id=None, **kwargs):
+    wanting = _core_demands.pop(task_id, None)
+    if wanting:
+        wanting.close()
+
+
+# Task -> (ledger, the task ID its entry is claimed under) for the tasks
+# doing a ledger entry's work. The segments and merge of a split job find
+# the ID in its plan.
+_LEDGER_WORK = {
+    "build_video": lambda task_id, args: (_build_ledger(), task_id),
+    "build_video_segment": lambda task_id, args: (_build_ledger(), args[0]["task_id"]),
+    "merge_video": lambda task_id, args: (_build_ledger(), args[1]["task_id"]),
+    "ingest_video": lambda task_id, args: (_ingest_ledger(), task_id),
+    "ingest_video_segment": lambda task_id, args: (
+        _ingest_ledger(),
+        args[0]["task_id"],
+    ),
+    "merge_ingest": lambda task_id, args: (_ingest_ledger(), args[1]["task_id"]),
+}
+
+# task_id -> the heartbeat of a running task's ledger entry
+_heartbeats = {}
+
+
+# A worker that dies leaves its entries in the ledgers, and its tasks in
+# whatever state they last reported, so keep the entries of running tasks
+# fresh and treat any that aren't as abandoned
+@celery.signals.task_prerun.connect
+def _start_heartbeat(task_id=None, task=None, args=(), **kwargs):
+    work = _LEDGER_WORK.get(task.name.rpartition(".")[2])
+    if work:
+        beating = contextlib.ExitStack()
+        beating.enter_context(ledger.heartbeat(*work(task_id, args)))
+        _heartbeats[task_id] = beating
+
+
+@celery.signals.task_postrun.connect
+def _stop_heartbeat(task_id=None, **kwargs):
+    beating = _heartbeats.pop(task_id, None)
+    if beating:
+        beating.close()
+
+
+@celery.signals.task_revoked.connect
+def _revoked(sender=None, request=None, **kwargs):
+    events.publish(
+        celery_app, request.id, sender.name, celery.states.REVOKED, force=True
+    )
+
+
 @celery.shared_task(ignore_result=False, bind=True)
-def build_video(self, *args, **kwargs):
-    result = formvideo.form_video(self, *args, **kwargs)
+def build_video(self, *args, build_key=None, **kwargs):
+    # Builds with the same key share a temp folder, so a retry resumes
+    build = formvideo.plan_build(self, *args, job_id=build_key, **kwargs)
+    build["key"] = build_key
+    build["task_id"] = self.request.id
+    _update_build(build, ledger.BUILDING)
+    # A build reusing every segment of another only has to mux
+    if not build["parallel"] or not build["segments"]:
+        try:
+            result = formvideo.run_build(self, build)
+        except BaseException:
+            _update_build(build, ledger.FAILED)
+            raise
+        _update_build(build, ledger.DONE, result)
+        return result
+
+    # Spread the segments over the workers, then mux them once they're done.
+    # The merge takes this task's ID, which stays pending until it finishes,
+    # so the entry is queued again while the chord waits for workers.
+    _update_build(build, ledger.QUEUED)
+    return self.replace(
+        celery.chord(
+            [
+                build_video_segment.s(build, index)
+                for index in range(len(build["segments"]))
+            ],
+            merge_video.s(build),
+        )
+    )
+
+
+@celery.shared_task(ignore_result=False, bind=True)
+def build_video_segment(self, build, index):
+    result = formvideo.render_segment(self, build, index)
     return result
 
 
 @celery.shared_task(ignore_result=False, bind=True)
-def ingest_video(self, input_file, output_dir, log_dir):
-    result = formvideo.ingest_video(self, input_file, output_dir, log_dir=log_dir)
+def merge_video(self, segment_files, build):
+    try:
+        result = formvideo.merge_build(self, build)
+    except BaseException:
+        _update_build(build, ledger.FAILED)
+        raise
+    _update_build(build, ledger.DONE, result)
     return result
 
 
+@functools.cache
+def _build_ledger():
+    return ledger.BuildLedger(results.redis_client(celery_app))
+
+
+def _update_build(build, state, output=None):
+    if build.get("key"):
+        _build_ledger().update(
+            build["key"],
+            state,
+            output=output,
+            plan=build if state == ledger.DONE else None,
+        )
+
+
+def submit_build(video, talk, start_tc, end_tc, **kwargs):
+    """Queue a build, unless an identical one has finished or is running.
+
+    Returns ``(task_id, output)``, where ``task_id`` is the task making the
+    build, and ``output`` its file if it's already finished. A build which
+    only differs from a finished one in the talk's details reuses the
+    segments of that one that it can.
+    """
+    try:
+        key, content_key = formvideo.build_keys(
+            video,
+            talk,
+            start_tc,
+            end_tc,
+            smart_render=kwargs.get("smart_render", False),
+            parallel_chunk_s=kwargs.get("parallel_chunk_s", 0),
+            profile=kwargs.get("profile"),
+            checkpoint_s=kwargs.get("checkpoint_s", 0),
+        )
+    except OSError:
+        logger.warning("Couldn't identify the build of %s, building it anyway", video)
+        return build_video.delay(video, talk, start_tc, end_tc, **kwargs).id, None
+
+    builds = _build_ledger()
+    task_id = celery.uuid()
+    entry = builds.claim(key, content_key, task_id, is_stale=_stale_entry)
+    if entry:
+        logger.info("Build of %s is already %s", video, entry["state"])
+        output = entry["output"] if entry["state"] == ledger.DONE else None
+        return entry["task_id"], output
+
+    build_video.apply_async(
+        (video, talk, start_tc, end_tc),
+        {**kwargs, "build_key": key, "reuse": builds.reusable(content_key)},
+        task_id=task_id,
+    )
+    return task_id, None
+
+
+@functools.cache
+def _ingest_ledger():
+    return ledger.IngestLedger(results.redis_client(celery_app))
+
+
+def _stale_entry(entry, task_id=None):
+    """Whether a ledger entry no longer stops its work being done again."""
+    if entry["state"] == ledger.DONE:
+        return not (entry["output"] and os.path.exists(entry["output"]))
+    if entry["task_id"] == task_id:
+        return True
+    state = celery.result.AsyncResult(entry["task_id"]).state
+    if state in celery.states.READY_STATES:
+        return True
+    # A task, or the chord that replaced it, waiting in the queue only gets
+    # touched as its segments run, but one whose message was lost would wait
+    # forever
+    if state == celery.states.PENDING and entry["state"] == ledger.QUEUED:
+        return time.time() - entry["updated"] > ledger.QUEUED_STALE_S
+    return time.time() - entry["updated"] > ledger.STALE_S
+
+
+@celery.shared_task(ignore_result=False, bind=True)
+def ingest_video(self, input_file, output_dir, log_dir, **kwargs):
+    ingests = _ingest_ledger()
+    fingerprint = ingests.fingerprint(input_file)
+    entry = ingests.claim(
+        fingerprint,
+        self.request.id,
+        is_stale=lambda entry: _stale_entry(entry, self.request.id),
+    )
+    if entry:
+        logger.info(
+            "'%s' is already %s by task %s, skipping",
+            input_file,
+            entry["state"],
+            entry["task_id"],
+        )
+        if entry["state"] == ledger.DONE:
+            formvideo.move_to_processed(input_file)
+        return entry["output"]
+
+    plan = formvideo.plan_ingest(
+        self,
+        input_file,
+        output_dir,
+        log_dir=log_dir,
+        job_id=fingerprint["hash"],
+        **kwargs,
+    )
+    plan["fingerprint"] = fingerprint
+    ingests.update(fingerprint, ledger.INGESTING, output=plan["output"])
+    if not plan["parallel"]:
+        try:
+            result = formvideo.run_ingest(self, plan)
+        except BaseException:
+            ingests.update(fingerprint, ledger.FAILED)
+            raise
+        ingests.update(fingerprint, ledger.DONE)
+        _after_ingest(result)
+        return result
+
+    # Give the segments IDs up front so their progress can be summed up, and
+    # the whole ingest stopped, from any one of them. If a segment fails, the
+    # chord fails this task's ID, so the watcher will try again.
+    plan["segment_ids"] = [celery.uuid() for _ in plan["segments"]]
+    ingests.update(fingerprint, ledger.QUEUED)
+    return self.replace(
+        celery.chord(
+            [
+                ingest_video_segment.s(plan, index).set(task_id=segment_id)
+                for index, segment_id in enumerate(plan["segment_ids"])
+            ],
+            merge_ingest.s(plan),
+        )
+    )
+
+
+@celery.shared_task(ignore_result=False, bind=True)
+def ingest_video_segment(self, plan, index):
+    result = formvideo.render_ingest_segment(self, plan, index)
+    return result
+
+
+@celery.shared_task(ignore_result=False, bind=True)
+def merge_ingest(self, segment_files, plan):
+    ingests = _ingest_ledger()
+    try:
+        result = formvideo.merge_ingest(self, plan)
+    except BaseException:
+        ingests.update(plan["fingerprint"], ledger.FAILED)
+        raise
+    ingests.update(plan["fingerprint"], ledger.DONE)
+    _after_ingest(result)
+    return result
+
+
+def _after_ingest(output):
+    if flask_app.config["INGEST_ANALYSE"]:
+        analyse_video.delay(output)
+
+
+@celery.shared_task(ignore_result=False, bind=True)
+def analyse_video(self, video, venue=None):
+    """Suggest in and out points for the talks recorded in ``video``."""
+    return analysis.analyse_video(
+        self,
+        video,
+        talk_schedule,
+        flask_app.config["VIDEO_ANALYSIS"],
+        venue=venue,
+        timezone=flask_app.config["SCHEDULE_TIMEZONE"],
+        probe_cache=str(flask_app.config["PROBE_CACHE"]),
+    )
+
+
+@celery.shared_task(ignore_result=False)
+def clean_temp():
+    """Remove the temp folders and partial outputs of jobs that have been
+    given up on, keeping those of jobs that are running, and the segments of
+    recently finished builds that later builds could reuse."""
+    max_age_s = flask_app.config["TEMP_MAX_AGE_SECONDS"]
+    keep = set()
+    for entry in _ingest_ledger().entries(*ledger.IN_FLIGHT):
+        if not _stale_entry(entry):
+            keep.add(formvideo.INGEST_JOB_DIR.format(entry["hash"]))
+    for entry in _build_ledger().entries(*ledger.IN_FLIGHT):
+        if not _stale_entry(entry):
+            keep.add(formvideo.BUILD_JOB_DIR.format(entry["key"]))
+
+    # Keep the segments that are slow to make again, newest builds first,
+    # up to REUSE_MAX_BYTES
+    finished = {}
+    kept_bytes = 0
+    done = _build_ledger().entries(ledger.DONE)
+    for entry in sorted(done, key=lambda entry: entry["updated"], reverse=True):
+        job_dir = formvideo.BUILD_JOB_DIR.format(entry["key"])
+        finished[job_dir] = set()
+        if time.time() - entry["updated"] >= max_age_s or not entry["plan"]:
+            continue
+        files = json.loads(entry["plan"]).get("files", {})
+        worth_keeping = [
+            pathlib.Path(file)
+            for name, file in files.items()
+            if name not in formvideo.COPIED_SEGMENTS
+            and pathlib.Path(file).parent.name == job_dir
+        ]
+        try:
+            size = sum(file.stat().st_size for file in worth_keeping)
+        except FileNotFoundError:
+            continue
+        if kept_bytes + size > flask_app.config["REUSE_MAX_BYTES"]:
+            continue
+        kept_bytes += size
+        finished[job_dir] = {file.name for file in worth_keeping}
+
+    partial_dirs = [
+        flask_app.config["VIDEO_OUTPUT"],
+        flask_app.config["VIDEO_PREVIEW"]["DISKDIR"],
+        *(folder["OUTPUT_DIR"] for folder in flask_app.config["WATCHFOLDERS"]),
+    ]
+    removed = formvideo.clean_temp(
+        flask_app.config["VIDEO_TEMP"],
+        keep,
+        partial_dirs,
+        max_age_s,
+        finished,
+    )
+    return len(removed)
+
+
+# A worker starting again may be after a crash, so tidy up after it
+@celery.signals.worker_ready.connect
+def _clean_on_start(**kwargs):
+    clean_temp.delay()
+
+
+@celery.shared_task(ignore_result=False, bind=True, max_retries=8)
+def sync_grist(self, updates=None):
+    """Send every queued Grist update, and ``updates``, in one request."""
+    table_url = flask_app.config.get("GRIST_TABLE_URL")
+    key = flask_app.config.get("GRIST_KEY")
+    if not table_url or not key:
+        return 0
+
+    updates = dict(updates or {})
+    for talk_id, fields in grist.take_pending(celery_app).items():
+        updates.setdefault(talk_id, {}).update(fields)
+    if not updates:
+        return 0
+
+    try:
+        return grist.client(table_url, key).update(updates)
+    except requests.RequestException as exc:
+        delay = min(GRIST_RETRY_MAX_DELAY, GRIST_RETRY_DELAY * 2**self.request.retries)
+        logger.warning("Grist update failed, retrying in %ss: %s", delay, exc)
+        raise self.retry(exc=exc, countdown=delay, kwargs={"updates": updates})
+
+
+def _poll_folder(watch, start_ingest):
+    i = 0
+
+    files = {}
+
+    while True:
+        logger.debug("Scanning '%s' for new files", watch)
+        old_files = files
+        files = {}
+        try:
+            file_list = [
+                f
+                for f in os.listdir(watch)
+                if os.path.isfile(pathlib.Path.joinpath(watch, f))
+            ]
+        except FileNotFoundError:
+            logger.error("Folder on disk doesn't exist or is inaccessible: %s", watch)
+            break
+        for video in file_list:
+            files[video] = {}
+            new_file = files[video]
+
+            stats = os.stat(pathlib.Path.joinpath(watch, pathlib.Path(video)))
+            new_file["st_size"] = stats.st_size
+            new_file["st_mtime"] = stats.st_mtime
+
+            new_file["processing"] = False
+            new_file["pass"] = 0
+            try:
+                old_file = old_files[video]
+            except KeyError:
+                new_file["pass"] = 1
+                continue
+            if old_file["processing"]:
+                new_file["processing"] = old_file["processing"]
+                continue
+            if (
+                old_file["st_size"] == new_file["st_size"]
+                or old_file["st_mtime"] == new_file["st_mtime"]
+            ):
+                logger.debug(
+                    "'%s': same size and mtime, pass %s",
+                    video,
+                    old_file["pass"] + 1,
+                )
+                new_file["pass"] = old_file["pass"] + 1
+            if new_file["pass"] >= 3:
+                logger.info(
+                    "'%s': 3 passes with no changes, starting processing", video
+                )
+                new_file["processing"] = start_ingest(video)
+        time.sleep(5)
+        i += 1
+
+
+def _notify_folder(watch, notifier, start_ingest):
+    notifier.add_watch(watch, WATCH_EVENTS)
+
+    # Files which have changed since they were last looked at, as
+    # {name: {"stats": (st_size, st_mtime) or None, "changed": time}}
+    pending = {}
+    # Files that have already been sent for ingest
+    processing = set()
+
+    def file_stats(video):
+        try:
+            stats = os.stat(watch / video)
+        except FileNotFoundError:
+            return None
+        return (stats.st_size, stats.st_mtime)
+
+    def rescan():
+        logger.debug("Scanning '%s' for new files", watch)
+        for video in os.listdir(watch):
+            if video not in processing and os.path.isfile(watch / video):
+                pending[video] = {
+                    "stats": file_stats(video),
+                    "changed": time.monotonic(),
+                }
+
+    try:
+        rescan()
+    except FileNotFoundError:
+        logger.error("Folder on disk doesn't exist or is inaccessible: %s", watch)
+        return
+
+    while True:
+        timeout = None
+        if pending:
+            next_check = min(change["changed"] for change in pending.values())
+            timeout = max(0, next_check + SETTLE_TIME - time.monotonic())
+        events = notifier.read(timeout=timeout)
+        now = time.monotonic()
+        for _, mask, video in events:
+            if mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+                logger.error("Folder on disk was removed: %s", watch)
+                return
+            if mask & inotify.IN_Q_OVERFLOW:
+                logger.warning("Missed events for '%s', rescanning", watch)
+                rescan()
+                continue
+            if mask & inotify.IN_ISDIR or not video:
+                continue
+            if mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                pending.pop(video, None)
+                processing.discard(video)
+            elif video in processing:
+                continue
+            elif mask & (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO):
+                # Finished being written, so ingest unless anything else
+                # happens to it before the stats are next checked
+                pending[video] = {
+                    "stats": file_stats(video),
+                    "changed": now - SETTLE_TIME,
+                }
+            else:
+                pending[video] = {"stats": None, "changed": now}
+
+        for video, change in list(pending.items()):
+            if now - change["changed"] < SETTLE_TIME:
+                continue
+            stats = file_stats(video)
+            if stats is None:
+                del pending[video]
+            elif stats != change["stats"]:
+                change.update(stats=stats, changed=now)
+            else:
+                logger.info("'%s': no changes, starting processing", video)
+                del pending[video]
+                processing.add(video)
+                start_ingest(video)
+
+
 @celery.shared_task(base=celery_singleton.Singleton, ignore_result=False)
-def watch_folder(watch, output_dir="static/video/source"):
+def watch_folder(watch, output_dir="static/video/source", poll=False):
     watch = pathlib.Path(watch)
 
     def stop_running(signum, frame):
@@ -41,66 +598,77 @@ def watch_folder(watch, output_dir="static/video/source"):
     signal.signal(signal.SIGTERM, stop_running)
     # signal.signal(signal.SIGINT, stop_running)
 
-    logger.info("Starting watchfolder: '%s'", watch)
-    i = 0
+    ingests = _ingest_ledger()
+    proxy = flask_app.config["VIDEO_PROXY"]
+    hls = flask_app.config["VIDEO_HLS"]
+    scrub = flask_app.config["VIDEO_SCRUB"]
 
-    files = {}
+    def start_ingest(video):
+        input_file = pathlib.Path.joinpath(watch, pathlib.Path(video))
+        try:
+            fingerprint = ingests.fingerprint(input_file)
+        except FileNotFoundError:
+            return None
+
+        # Claim the file before queueing, so it's never sent twice even if
+        # the watcher restarts before the ingest starts
+        task_id = celery.uuid()
+        entry = ingests.claim(fingerprint, task_id, is_stale=_stale_entry)
+        if entry:
+            logger.info(
+                "'%s': already %s by task %s, skipping",
+                video,
+                entry["state"],
+                entry["task_id"],
+            )
+            if entry["state"] == ledger.DONE:
+                formvideo.move_to_processed(input_file)
+            return entry["task_id"]
+
+        result = ingest_video.apply_async(
+            (str(input_file), str(output_dir)),
+            {
+                "log_dir": str(flask_app.config["LOG_DIR"]),
+                "temp_dir": str(flask_app.config["VIDEO_TEMP"]),
+                "parallel_chunk_s": flask_app.config["INGEST_CHUNK_SECONDS"],
+                "checkpoint_s": flask_app.config["CHECKPOINT_SECONDS"],
+                "probe_cache": str(flask_app.config["PROBE_CACHE"]),
+                "proxy_dir": (
+                    str(proxy["DISKDIR"]) if flask_app.config["INGEST_PROXY"] else None
+                ),
+                "proxy_height": proxy["HEIGHT"],
+                "hls_dir": (
+                    str(hls["DISKDIR"]) if flask_app.config["INGEST_HLS"] else None
+                ),
+                "hls_ladder": hls["LADDER"],
+                "scrub_dir": (
+                    str(scrub["DISKDIR"]) if flask_app.config["INGEST_SCRUB"] else None
+                ),
+                "thumb_interval_s": scrub["THUMB_SECONDS"],
+                "profile": flask_app.config["ENCODE_PROFILES"][
+                    flask_app.config["INGEST_PROFILE"]
+                ],
+            },
+            task_id=task_id,
+        )
+        return result.id
+
+    notifier = None
+    if not poll:
+        try:
+            notifier = inotify.Inotify()
+        except OSError:
+            logger.warning("inotify isn't available, polling '%s' instead", watch)
+
+    logger.info("Starting watchfolder: '%s'", watch)
 
     try:
-        while True:
-            logger.debug("Scanning '%s' for new files", watch)
-            old_files = files
-            files = {}
-            try:
-                file_list = [
-                    f
-                    for f in os.listdir(watch)
-                    if os.path.isfile(pathlib.Path.joinpath(watch, f))
-                ]
-            except FileNotFoundError:
-                logger.error(
-                    "Folder on disk doesn't exist or is inaccessible: %s", watch
-                )
-                break
-            for video in file_list:
-                files[video] = {}
-                new_file = files[video]
-
-                stats = os.stat(pathlib.Path.joinpath(watch, pathlib.Path(video)))
-                new_file["st_size"] = stats.st_size
-                new_file["st_mtime"] = stats.st_mtime
-
-                new_file["processing"] = False
-                new_file["pass"] = 0
-                try:
-                    old_file = old_files[video]
-                except KeyError:
-                    new_file["pass"] = 1
-                    continue
-                if old_file["processing"]:
-                    new_file["processing"] = old_file["processing"]
-                    continue
-                if (
-                    old_file["st_size"] == new_file["st_size"]
-                    or old_file["st_mtime"] == new_file["st_mtime"]
-                ):
-                    logger.debug(
-                        "'%s': same size and mtime, pass %s",
-                        video,
-                        old_file["pass"] + 1,
-                    )
-                    new_file["pass"] = old_file["pass"] + 1
-                if new_file["pass"] >= 3:
-                    logger.info(
-                        "'%s': 3 passes with no changes, starting processing", video
-                    )
-                    result = ingest_video.delay(
-                        str(pathlib.Path.joinpath(watch, pathlib.Path(video))),
-                        str(output_dir),
-                        log_dir=str(flask_app.config["LOG_DIR"]),
-                    )
-                    new_file["processing"] = result.id
-            time.sleep(5)
-            i += 1
+        if notifier:
+            _notify_folder(watch, notifier, start_ingest)
+        else:
+            _poll_folder(watch, start_ingest)
     except ErrSigTerm:
         logger.info("Stopping watchfolder: '%s'", watch)
+    finally:
+        if notifier:
+            notifier.close()
@@ -0,0 +1,73 @@
+"""Shared snapshot of the tasks the Celery workers are running"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often the snapshot is refreshed, in seconds
+REFRESH_INTERVAL = 2
+# How long to wait for workers to reply to each inspect broadcast
+INSPECT_TIMEOUT = 1.0
+
+
+class WorkerSnapshot:
+    """Active and reserved tasks of every worker, refreshed in the background.
+
+    Inspecting workers broadcasts to all of them and waits for the replies,
+    so one thread does it every ``interval`` seconds and requests read its
+    latest result, however many dashboards are polling. Readers must treat
+    the returned task dicts as read-only.
+    """
+
+    def __init__(self, celery_app, interval=REFRESH_INTERVAL, timeout=INSPECT_TIMEOUT):
+        self.celery_app = celery_app
+        self.interval = interval
+        self.timeout = timeout
+        self.updated = None
+        self._tasks = ({}, {})
+        self._thread = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+
+    def active(self):
+        return self._snapshot()[0]
+
+    def reserved(self):
+        return self._snapshot()[1]
+
+    def refresh_soon(self):
+        """Refresh without waiting for the interval, e.g. after starting or
+        revoking a task."""
+        self._wake.set()
+
+    def refresh(self):
+        inspect = self.celery_app.control.inspect(timeout=self.timeout)
+        active = inspect.active() or {}
+        reserved = inspect.reserved() or {}
+        self._tasks = (active, reserved)
+        self.updated = time.time()
+        self._ready.set()
+
+    def _snapshot(self):
+        # Started on first use, so processes that never serve the API (such
+        # as the workers themselves) don't inspect anything
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._collect, name="worker-snapshot", daemon=True
+                )
+                self._thread.start()
+        self._ready.wait(self.timeout * 2 + self.interval)
+        return self._tasks
+
+    def _collect(self):
+        while True:
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Couldn't inspect the Celery workers")
+            self._wake.wait(self.interval)
@@ -0,0 +1,18 @@
+from hackyplayer import database
+
+
+class Counts(database.Database):
+    schema = "CREATE TABLE IF NOT EXISTS counts (n INTEGER);"
+
+
+def test_schema_once(tmp_path, monkeypatch):
+    db_path = tmp_path / "sub" / "counts.sqlite3"
+    Counts(db_path)
+
+    def connect(self):
+        raise AssertionError("opened the database again")
+
+    monkeypatch.setattr(Counts, "_connect", connect)
+
+    # Already set up in this process, so it isn't opened
+    Counts(db_path)
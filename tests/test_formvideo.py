@@ -0,0 +1,61 @@
+import types
+
+import pytest
+
+from hackyplayer import formvideo
+
+
+def test_timecode_split():
+    assert formvideo.timecode_split("01:02:03:04") == (1, 2, 3, 4)
+
+
+@pytest.mark.parametrize(
+    "timecode",
+    ["00:01:00", "00:01:00:00:00", "0:01:00:00", "aa:bb:cc:dd", "", "00:01:00.00"],
+)
+def test_timecode_split_malformed(timecode):
+    with pytest.raises(ValueError, match="HH:MM:SS:FF"):
+        formvideo.timecode_split(timecode)
+
+
+@pytest.mark.parametrize("timecode", ["24:00:00:00", "00:60:00:00", "00:00:00:50"])
+def test_timecode_split_out_of_range(timecode):
+    with pytest.raises(ValueError, match="out of range"):
+        formvideo.timecode_split(timecode)
+
+
+def test_check_timecodes_malformed(tmp_path):
+    # Rejected before the video is even probed
+    with pytest.raises(ValueError, match="HH:MM:SS:FF"):
+        formvideo.check_timecodes(tmp_path / "missing.mp4", "00:01:00", "00:02:00:00")
+
+
+def test_check_timecodes_backwards(tmp_path):
+    with pytest.raises(ValueError, match="isn't before"):
+        formvideo.check_timecodes(
+            tmp_path / "missing.mp4", "00:02:00:00", "00:01:00:00"
+        )
+
+
+def test_plan_ingest_scrub_in_encode(tmp_path, monkeypatch):
+    monkeypatch.setattr(formvideo, "_video_duration_seconds", lambda *args: 1205.0)
+    task = types.SimpleNamespace(request=types.SimpleNamespace(id="task"))
+
+    plan = formvideo.plan_ingest(
+        task,
+        tmp_path / "talk.mov",
+        tmp_path / "out",
+        log_dir=tmp_path,
+        temp_dir=tmp_path,
+        scrub_dir=tmp_path / "scrub",
+        thumb_interval_s=10,
+        checkpoint_s=605,
+    )
+
+    # Nothing decodes the output again
+    runs = [*plan["segments"], plan["mux"], plan["scrub"]["tile"]]
+    assert not any(plan["output"] in run["args"][:-2] for run in runs)
+    # The second chunk starts 5s after a thumbnail was due
+    second_chunk = " ".join(plan["segments"][1]["args"])
+    assert "select='gte(t,5.000000+10*selected_n)'" in second_chunk
+    assert len(plan["scrub"]["thumbs"]) == 2
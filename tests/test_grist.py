@@ -0,0 +1,110 @@
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+from hackyplayer import grist
+
+
+class StubGrist(http.server.BaseHTTPRequestHandler):
+    """A Grist records endpoint holding talks 1 and 2, which answers with
+    each status in ``server.failures`` before it succeeds."""
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        self.server.requests.append(("GET", json.loads(query["filter"][0])))
+        records = [
+            {"id": 10, "fields": {"id2": 1}},
+            {"id": 20, "fields": {"id2": "2"}},
+        ]
+        self._reply({"records": records})
+
+    def do_PATCH(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append(("PATCH", json.loads(body)))
+        if self.server.failures:
+            self.send_response(self.server.failures.pop(0))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._reply({})
+
+    def _reply(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubGrist)
+    server.requests = []
+    server.failures = []
+    server.url = f"http://127.0.0.1:{server.server_port}/records"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_update_batches(server):
+    client = grist.GristClient(server.url, "key")
+
+    patched = client.update({"1": {"Status": "Built"}, "2": {"Status": "Queued"}})
+
+    assert patched == 2
+    assert server.requests == [
+        ("GET", {"id2": ["1", "2", 1, 2]}),
+        (
+            "PATCH",
+            {
+                "records": [
+                    {"id": 10, "fields": {"Status": "Built"}},
+                    {"id": 20, "fields": {"Status": "Queued"}},
+                ]
+            },
+        ),
+    ]
+
+
+def test_update_reuses_record_ids(server):
+    client = grist.GristClient(server.url, "key")
+    client.update({"1": {"Status": "Queued"}})
+
+    client.update({"1": {"Status": "Built"}, "3": {"Status": "Built"}})
+
+    # Only the talk it hasn't seen is looked up, and the one Grist doesn't
+    # have is left out
+    assert server.requests[2:] == [
+        ("GET", {"id2": ["3", 3]}),
+        ("PATCH", {"records": [{"id": 10, "fields": {"Status": "Built"}}]}),
+    ]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_sync_grist_retries(server, monkeypatch, status):
+    # Imported here, as it sets up the whole app
+    from hackyplayer import tasks
+
+    monkeypatch.setitem(tasks.flask_app.config, "GRIST_TABLE_URL", server.url)
+    monkeypatch.setitem(tasks.flask_app.config, "GRIST_KEY", "key")
+    monkeypatch.setattr(grist, "take_pending", lambda celery_app: {"2": {"A": 1}})
+    server.failures = [status, status]
+
+    # Run eagerly, which runs the retries straight away
+    result = tasks.sync_grist.apply(kwargs={"updates": {"1": {"B": 2}}})
+
+    assert result.get() == 2
+    patches = [body for method, body in server.requests if method == "PATCH"]
+    assert len(patches) == 3
+    # Every retry sends the whole batch again
+    assert all(len(patch["records"]) == 2 for patch in patches)
@@ -0,0 +1,93 @@
+import pytest
+
+from hackyplayer import ledger
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def builds():
+    return ledger.BuildLedger(fakeredis.FakeRedis())
+
+
+def test_build_claim(builds):
+    assert builds.claim("key", "content", "first") is None
+
+    entry = builds.claim("key", "content", "second")
+
+    assert entry["state"] == ledger.QUEUED
+    assert entry["task_id"] == "first"
+
+
+def test_build_claim_stale(builds):
+    builds.claim("key", "content", "first")
+
+    assert builds.claim("key", "content", "second", is_stale=lambda e: True) is None
+    assert builds.get("key")["task_id"] == "second"
+
+
+def test_build_claim_failed(builds):
+    builds.claim("key", "content", "first")
+    builds.update("key", ledger.FAILED)
+
+    assert builds.claim("key", "content", "second") is None
+
+
+def test_build_touch(builds):
+    builds.claim("key", "content", "first")
+    updated = builds.get("key")["updated"]
+
+    builds.touch("first")
+
+    assert builds.get("key")["updated"] > updated
+
+
+def test_build_reusable(builds):
+    builds.claim("old", "content", "first")
+    builds.update("old", ledger.DONE, "old.mp4", plan={"name": "old"})
+    builds.claim("new", "content", "second")
+    builds.update("new", ledger.DONE, "new.mp4", plan={"name": "new"})
+    builds.claim("other", "other", "third")
+
+    assert builds.reusable("content") == {"name": "new"}
+    assert builds.reusable("other") is None
+    assert {entry["key"] for entry in builds.entries(ledger.DONE)} == {"old", "new"}
+
+
+def test_without_redis():
+    builds = ledger.BuildLedger(None)
+
+    assert builds.claim("key", "content", "first") is None
+    assert builds.claim("key", "content", "second") is None
+    assert builds.entries(ledger.QUEUED) == []
+
+
+@pytest.fixture
+def ingests():
+    return ledger.IngestLedger(fakeredis.FakeRedis())
+
+
+def test_ingest_claim(ingests, tmp_path):
+    video = tmp_path / "talk.mp4"
+    video.write_bytes(b"video")
+    fingerprint = ingests.fingerprint(video)
+    assert ingests.claim(fingerprint, "first") is None
+    ingests.update(fingerprint, ledger.DONE, output="out.mp4")
+
+    # The same recording dropped in again under another name
+    copy = tmp_path / "copy.mp4"
+    copy.write_bytes(b"video")
+    entry = ingests.claim(ingests.fingerprint(copy), "second")
+
+    assert entry["state"] == ledger.DONE
+    assert entry["task_id"] == "first"
+    assert entry["output"] == "out.mp4"
+
+
+def test_ingest_fingerprint_reuses_hash(ingests, tmp_path, monkeypatch):
+    video = tmp_path / "talk.mp4"
+    video.write_bytes(b"video")
+    fingerprint = ingests.fingerprint(video)
+    monkeypatch.setattr(ledger, "partial_hash", lambda path, size: "rehashed")
+
+    assert ingests.fingerprint(video) == fingerprint
@@ -0,0 +1,67 @@
+import random
+import re
+
+import pytest
+
+from hackyplayer import loudness
+
+
+def _options(filters):
+    """The options of the loudnorm filter in ``filters``, as loudnorm reads them."""
+    loudnorm = filters.split(",")[0]
+    assert loudnorm.startswith("loudnorm=")
+    return dict(re.findall(r"(\w+)=([^:]+)", loudnorm[len("loudnorm=") :]))
+
+
+def _is_linear(options):
+    """loudnorm's own test for whether it can apply one fixed gain."""
+    offset = float(options["I"]) - float(options["measured_I"])
+    peak = float(options["measured_TP"]) + offset
+    fits_range = float(options["measured_LRA"]) <= float(options["LRA"])
+    return peak <= float(options["TP"]) and fits_range
+
+
+def _measured(input_i, input_tp, input_lra=6.0, input_thresh=-40.0):
+    return {
+        "input_i": input_i,
+        "input_tp": input_tp,
+        "input_lra": input_lra,
+        "input_thresh": input_thresh,
+    }
+
+
+@pytest.mark.parametrize(
+    "measured",
+    [
+        # Rounding the target to two places would round it up past the peak
+        _measured(-30.004, -7.996),
+        _measured(-30.005, -7.995),
+        _measured(-25.999, -3.001),
+        # Quiet with low peaks, so the full target is reached
+        _measured(-35.0, -20.0),
+        # Range over the default target range
+        _measured(-28.0, -6.0, input_lra=23.456),
+    ],
+)
+def test_linear_filter_stays_linear(measured):
+    options = _options(loudness.linear_filter(measured))
+    assert options["linear"] == "true"
+    assert _is_linear(options)
+    assert float(options["I"]) <= loudness.TARGET_I
+
+
+def test_linear_filter_stays_linear_after_formatting():
+    rng = random.Random(0)
+    for _ in range(10000):
+        input_i = rng.uniform(-50, -10)
+        measured = _measured(
+            input_i,
+            rng.uniform(input_i, 0),
+            input_lra=rng.uniform(0, 40),
+        )
+        assert _is_linear(_options(loudness.linear_filter(measured)))
+
+
+def test_linear_filter_silence():
+    measured = _measured(float("-inf"), float("-inf"), 0.0, -70.0)
+    assert loudness.linear_filter(measured) == f"aresample={loudness.OUTPUT_RATE}"
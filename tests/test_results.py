@@ -0,0 +1,79 @@
+import celery
+import celery.states
+import pytest
+from celery.backends.base import KeyValueStoreBackend
+
+from hackyplayer import results
+
+
+class DictBackend(KeyValueStoreBackend):
+    """A key-value result backend in a dict, which can't fetch many keys at
+    once, so lookups take the one-task-at-a-time path."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture(
+    params=[f"{__name__}:DictBackend", "cache+memory://"], ids=["fallback", "mget"]
+)
+def celery_app(request):
+    return celery.Celery(backend=request.param, set_as_current=False)
+
+
+def test_task_states(celery_app):
+    progress = {"current": 30, "total": 120}
+    celery_app.backend.store_result("running", progress, "Ingesting...")
+    celery_app.backend.store_result("done", "out.mp4", celery.states.SUCCESS)
+
+    states = results.task_states(celery_app, ["running", "done", "queued", "done"])
+
+    assert states == {
+        "running": ("Ingesting...", progress),
+        "done": (celery.states.SUCCESS, "out.mp4"),
+        "queued": (celery.states.PENDING, None),
+    }
+
+
+def test_task_states_none(celery_app):
+    assert results.task_states(celery_app, []) == {}
+
+
+def test_fallback_without_mget(monkeypatch):
+    celery_app = celery.Celery(backend=f"{__name__}:DictBackend", set_as_current=False)
+    celery_app.backend.store_result("done", 1, celery.states.SUCCESS)
+    looked_up = []
+    monkeypatch.setattr(
+        results,
+        "_task_states_each",
+        lambda app, task_ids: looked_up.extend(task_ids) or {},
+    )
+
+    results.task_states(celery_app, ["done", "queued"])
+
+    assert looked_up == ["done", "queued"]
+
+
+def test_task_states_failure(celery_app):
+    celery_app.backend.mark_as_failure("failed", ValueError("bad timecode"))
+    celery_app.backend.mark_as_retry("retrying", OSError("disk full"))
+
+    states = results.task_states(celery_app, ["failed", "retrying"])
+
+    state, info = states["failed"]
+    assert state == celery.states.FAILURE
+    assert isinstance(info, ValueError)
+    assert str(info) == "bad timecode"
+    state, info = states["retrying"]
+    assert state == celery.states.RETRY
+    assert isinstance(info, OSError)